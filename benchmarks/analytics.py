@@ -0,0 +1,99 @@
+"""
+Time `GET /charges/stats` over years of daily charges, with NumPy and in pure Python.
+
+The first request of a user loads their charges into column arrays; later ones, e.g. for other
+ranges or windows, only compute on the cached columns. Run with:
+
+    python benchmarks/analytics.py
+"""
+import argparse
+import datetime
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from flask import Flask, g
+
+import open_trs
+import open_trs.analytics
+import open_trs.db
+
+
+def _create_user(app: Flask, args: argparse.Namespace) -> str:
+    """
+    Register a user and generate their projects and charges, on every weekday of the history.
+    """
+
+    client = app.test_client()
+    credentials = {'username': 'analytics', 'password': 'analytics'}
+    client.post('/auth/register', json={**credentials, 'email': 'analytics@analytics.test'})
+    token = client.post('/auth/login', json=credentials).get_json()['token']
+    today = datetime.date.today()
+
+    with app.app_context():
+        g.user_id = user_id = open_trs.db.get_directory_db().execute(
+            'SELECT id FROM Users WHERE username = ?', (credentials['username'],)).fetchone()[0]
+        db = open_trs.db.get_db()
+        project_ids = [db.execute('INSERT INTO Projects (owner, name, category) VALUES (?, ?, 0)'
+                                  ' RETURNING id', (user_id, f'Project {i}')).fetchone()[0]
+                       for i in range(args.projects)]
+
+        charges = []
+
+        for offset in range(args.years * 365):
+            day = today - datetime.timedelta(days=offset)
+
+            if day.weekday() < 5:
+                for project_id in random.sample(project_ids, random.randint(1, 3)):
+                    charges.append((project_id, user_id, random.randint(1, 8),
+                                    open_trs.db.date_to_day(day)))
+
+        db.executemany('INSERT INTO Charges (project, user, hours, date_charged)'
+                       ' VALUES (?, ?, ?, ?)', charges)
+        db.commit()
+
+    print(f'{len(charges)} charges over {args.years} years in {args.projects} projects')
+
+    return token
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--years', type=int, default=5, help='Years of charges.')
+    parser.add_argument('--projects', type=int, default=10, help='Projects of the user.')
+    parser.add_argument('--requests', type=int, default=50, help='Requests per variant.')
+    args = parser.parse_args()
+
+    random.seed(0)
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = open_trs.create_app(testing=True, config={
+            'DATABASE': os.path.join(directory, 'open_trs.sqlite')})
+
+        with app.app_context():
+            open_trs.db.init_db()
+
+        headers = {'Authorization': f'Bearer {_create_user(app, args)}'}
+        client = app.test_client()
+
+        for name, use_numpy in (('NumPy', True), ('Python', False)):
+            app.config['ANALYTICS_NUMPY'] = use_numpy
+            # Loading starts over with an empty cache, since each variant keeps its own arrays
+            open_trs.analytics.init_app(app)
+            times = []
+
+            for i in range(args.requests + 1):
+                # Windows differ, so that the requests are not coalesced or otherwise repeated
+                start = time.perf_counter()
+                response = client.get('/charges/stats', headers=headers, json={'window': i + 1})
+                times.append((time.perf_counter() - start) * 1000)
+                assert response.status_code == 200, response.data
+
+            print(f'{name:>6}: first request {times[0]:.1f} ms,'
+                  f' cached median {statistics.median(times[1:]):.1f} ms')
+
+
+if __name__ == '__main__':
+    main()
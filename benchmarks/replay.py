@@ -0,0 +1,242 @@
+"""
+Replay a capture of production requests (see `open_trs.capture`) against a fresh database.
+
+Every user of the capture gets a user of their own with generated projects and charges, and the
+captured request shapes are turned back into requests with equivalent batch sizes, date ranges,
+and IDs of the generated data. Requests are sent at the captured pace, sped up by `--speedup`,
+and latencies are reported per endpoint next to the captured ones. Run with:
+
+    python benchmarks/replay.py capture.jsonl --speedup 10
+"""
+import argparse
+import collections
+import concurrent.futures
+import datetime
+import json
+import os
+import random
+import statistics
+import string
+import tempfile
+import threading
+import time
+
+from flask import Flask, g, url_for
+
+import open_trs
+import open_trs.db
+
+# Endpoints that are not replayed: logins are made once per user, and streams never finish
+_SKIPPED_ENDPOINTS = {'auth.login', 'auth.register', 'events.stream', 'metrics.get_metrics'}
+
+
+class _User:
+    """
+    A generated user standing in for a pseudonymous user of the capture.
+    """
+
+    def __init__(self, token: str, project_ids: list, charge_ids: list):
+        """
+        Initialize a new _User.
+
+        Args:
+            token: The user's JWT.
+            project_ids: The IDs of the user's projects.
+            charge_ids: The IDs of the user's charges.
+        """
+
+        self.token = token
+        self.ids = {'project': project_ids, 'charge': charge_ids}
+
+
+def _read_capture(path: str) -> list:
+    with open(path) as file:
+        records = [json.loads(line) for line in file if line.strip()]
+
+    return sorted((record for record in records
+                   if record['user'] is not None and record['endpoint'] not in _SKIPPED_ENDPOINTS),
+                  key=lambda record: record['time'])
+
+
+def _create_user(app: Flask, index: int, args: argparse.Namespace) -> _User:
+    """
+    Register a user and generate their projects and charges, on most weekdays of the history.
+    """
+
+    client = app.test_client()
+    credentials = {'username': f'replay{index}', 'password': 'replay'}
+    client.post('/auth/register', json={**credentials, 'email': f'replay{index}@replay.test'})
+    token = client.post('/auth/login', json=credentials).get_json()['token']
+    today = datetime.date.today()
+
+    with app.app_context():
+        g.user_id = user_id = open_trs.db.get_directory_db().execute(
+            'SELECT id FROM Users WHERE username = ?', (credentials['username'],)).fetchone()[0]
+        db = open_trs.db.get_db()
+        project_ids = [db.execute('INSERT INTO Projects (owner, name, category) VALUES (?, ?, 0)'
+                                  ' RETURNING id', (user_id, f'Project {i}')).fetchone()[0]
+                       for i in range(args.projects)]
+
+        charges = []
+
+        for offset in range(args.history_days):
+            day = today - datetime.timedelta(days=offset)
+
+            if day.weekday() < 5:
+                for project_id in random.sample(project_ids, random.randint(1, 3)):
+                    charges.append((project_id, user_id, random.randint(1, 8),
+                                    open_trs.db.date_to_day(day)))
+
+        db.executemany('INSERT INTO Charges (project, user, hours, date_charged)'
+                       ' VALUES (?, ?, ?, ?)', charges)
+        charge_ids = [row[0] for row in db.execute('SELECT id FROM Charges WHERE user = ?',
+                                                   (user_id,))]
+        db.commit()
+
+    return _User(token, project_ids, charge_ids)
+
+
+def _materialize(shape, user: _User, consume: bool):
+    """
+    Turn a shape recorded by `open_trs.capture.anonymize` back into a value.
+
+    IDs are drawn from the user's generated data; those of deletions are removed from it, so later
+    requests do not reference them.
+    """
+
+    if isinstance(shape, dict) and '$list' in shape:
+        item = shape['item']
+
+        if isinstance(item, dict) and '$id' in item:
+            pool = user.ids[item['$id']]
+            ids = random.sample(pool, min(shape['$list'], len(pool)))
+
+            if consume:
+                consumed = set(ids)
+                pool[:] = [i for i in pool if i not in consumed]
+
+            return ids
+
+        return [_materialize(item, user, consume) for _ in range(shape['$list'])]
+    elif isinstance(shape, dict) and '$id' in shape:
+        pool = user.ids[shape['$id']]
+
+        if not pool:
+            return 0
+
+        value = random.choice(pool)
+
+        if consume:
+            pool.remove(value)
+
+        return value
+    elif isinstance(shape, dict) and '$day' in shape:
+        return (datetime.date.today() + datetime.timedelta(days=shape['$day'])).isoformat()
+    elif isinstance(shape, dict) and '$str' in shape:
+        # Generated strings are never shorter than 12 characters, so names rarely collide
+        return ''.join(random.choices(string.ascii_letters, k=max(shape['$str'], 12)))
+    elif isinstance(shape, dict):
+        return {key: _materialize(value, user, consume or key == 'delete')
+                for key, value in shape.items()}
+
+    return shape
+
+
+def _send(app: Flask, method: str, url: str, token: str, body) -> tuple:
+    start = time.perf_counter()
+    response = app.test_client().open(url, method=method, json=body,
+                                      headers={'Authorization': f'Bearer {token}'})
+
+    return response.status_code, time.perf_counter() - start
+
+
+def _format_latencies(latencies: list) -> str:
+    if len(latencies) < 2:
+        return f'{latencies[0] * 1000:9.1f}' * 4 if latencies else ''
+
+    percentiles = statistics.quantiles(latencies, n=100, method='inclusive')
+
+    return ''.join(f'{value * 1000:9.1f}'
+                   for value in (percentiles[49], percentiles[89], percentiles[98], max(latencies)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('capture', help='The capture file, as written to CAPTURE_PATH.')
+    parser.add_argument('--speedup', type=float, default=1, help='Factor to speed the pace up by.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Requests sent at once.')
+    parser.add_argument('--projects', type=int, default=10, help='Projects per user.')
+    parser.add_argument('--history-days', type=int, default=365,
+                        help='Days of charges generated per user.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the generated data.')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    records = _read_capture(args.capture)
+
+    if not records:
+        parser.error('The capture holds no replayable requests')
+
+    with tempfile.TemporaryDirectory() as directory:
+        app = open_trs.create_app(testing=True)
+        app.config.update(DATABASE=os.path.join(directory, 'open_trs.sqlite'),
+                          JWT_EXPIRATION=365 * 86400)
+
+        with app.app_context():
+            open_trs.db.init_db()
+
+        pseudonyms = sorted({record['user'] for record in records})
+        users = {pseudonym: _create_user(app, index, args)
+                 for index, pseudonym in enumerate(pseudonyms)}
+        print(f'Replaying {len(records)} requests of {len(users)} users'
+              f' at {args.speedup}x with {args.concurrency} concurrent requests')
+
+        results = collections.defaultdict(list)
+        lock = threading.Lock()
+
+        def replay(endpoint: str, method: str, url: str, token: str, body):
+            result = _send(app, method, url, token, body)
+
+            with lock:
+                results[endpoint].append(result)
+
+        start, first_time = time.perf_counter(), records[0]['time']
+
+        with concurrent.futures.ThreadPoolExecutor(args.concurrency) as executor:
+            for record in records:
+                delay = start + (record['time'] - first_time) / args.speedup - time.perf_counter()
+
+                if delay > 0:
+                    time.sleep(delay)
+
+                user = users[record['user']]
+                consume = record['method'] == 'DELETE'
+                view_args = _materialize(record['view_args'], user, consume)
+                body = _materialize(record['body'], user, consume)
+
+                with app.test_request_context():
+                    url = url_for(record['endpoint'], **view_args)
+
+                executor.submit(replay, record['endpoint'], record['method'], url, user.token,
+                                body)
+
+        elapsed = time.perf_counter() - start
+        captured = collections.defaultdict(list)
+
+        for record in records:
+            captured[record['endpoint']].append(record['duration'])
+
+    print(f'{len(records)} requests in {elapsed:.1f}s ({len(records) / elapsed:.1f}/s)\n')
+    print(f'{"endpoint":<32}{"count":>7}  {"replayed ms: p50, p90, p99, max":>36}'
+          f'  {"captured ms: p50, p90, p99, max":>36}  statuses')
+
+    for endpoint, endpoint_results in sorted(results.items()):
+        statuses = collections.Counter(status for status, _ in endpoint_results)
+        print(f'{endpoint:<32}{len(endpoint_results):>7}'
+              f'  {_format_latencies([latency for _, latency in endpoint_results]):>36}'
+              f'  {_format_latencies(captured[endpoint]):>36}'
+              f'  {", ".join(f"{status}: {count}" for status, count in sorted(statuses.items()))}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Measure the cold start of a worker: from a fresh interpreter to the first successful response.
+
+Every run starts a new Python process that imports `open_trs`, creates the app, and answers an
+authenticated `GET /charges/` against a database prepared beforehand, timing each phase. Runs are
+repeated without cached bytecode, as in an image built without compiling it, with bytecode, and
+with bytecode and the config's `WARMUP`, which moves the first request's extra work into
+`create_app`. Run with:
+
+    python benchmarks/startup.py --runs 20
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+_PHASES = ('import', 'create_app', 'first_request', 'second_request')
+
+
+def _child(database: str, token: str, warmup: bool):
+    """
+    Run in a fresh process: time each phase and print the timings as JSON.
+    """
+
+    start = time.perf_counter()
+    timings = {}
+
+    import open_trs
+    timings['import'] = time.perf_counter() - start
+
+    phase_start = time.perf_counter()
+    app = open_trs.create_app(testing=True, config={'DATABASE': database, 'WARMUP': warmup})
+    timings['create_app'] = time.perf_counter() - phase_start
+
+    for phase in ('first_request', 'second_request'):
+        phase_start = time.perf_counter()
+        response = app.test_client().get('/charges/', json={},
+                                         headers={'Authorization': f'Bearer {token}'})
+        assert response.status_code == 200, response.data
+        timings[phase] = time.perf_counter() - phase_start
+
+    timings['total'] = time.perf_counter() - start
+    print(json.dumps(timings))
+
+
+def _prepare(database: str) -> str:
+    """
+    Create a database with a user who has a year of charges, and return the user's token.
+    """
+
+    import datetime
+
+    import open_trs
+    import open_trs.db
+
+    app = open_trs.create_app(testing=True, config={'DATABASE': database,
+                                                    'JWT_EXPIRATION': 86400})
+
+    with app.app_context():
+        open_trs.db.init_db()
+
+    client = app.test_client()
+    credentials = {'username': 'startup', 'password': 'startup'}
+    client.post('/auth/register', json={**credentials, 'email': 'startup@startup.test'})
+    token = client.post('/auth/login', json=credentials).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+    project = client.post('/projects/create', headers=headers,
+                          json={'name': 'Startup', 'category': 0}).get_json()['project']['id']
+    first_day = datetime.date.today() - datetime.timedelta(days=365)
+    client.post('/charges/create', headers=headers, json={'charges': [
+        {'project': project, 'hours': 8,
+         'date_charged': (first_day + datetime.timedelta(days=day)).isoformat()}
+        for day in range(365)]})
+
+    return token
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--runs', type=int, default=10, help='Fresh processes per variant.')
+    parser.add_argument('--child', nargs=3, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        database, token, warmup = args.child
+        _child(database, token, warmup == 'warmup')
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, 'open_trs.sqlite')
+        token = _prepare(database)
+        environment = {**os.environ, 'PYTHONPATH': os.pathsep.join(
+            [os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+             os.environ.get('PYTHONPATH', '')])}
+        environment.pop('PYTHONDONTWRITEBYTECODE', None)
+
+        # Bytecode is only looked for in the prefix, which is empty for runs without bytecode and
+        # filled by an unmeasured run otherwise
+        variants = (('no bytecode', os.path.join(directory, 'empty'), 'cold'),
+                    ('bytecode', os.path.join(directory, 'pycache'), 'cold'),
+                    ('bytecode, warmup', os.path.join(directory, 'pycache'), 'warmup'))
+        command = [sys.executable, __file__, '--child', database, token]
+        subprocess.run([*command, 'cold'], check=True, capture_output=True,
+                       env={**environment, 'PYTHONPYCACHEPREFIX': variants[1][1]})
+
+        for name, prefix, warmup in variants:
+            runs = []
+            variant_environment = {**environment, 'PYTHONPYCACHEPREFIX': prefix}
+
+            if prefix == variants[0][1]:
+                variant_environment['PYTHONDONTWRITEBYTECODE'] = '1'
+
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                output = subprocess.run([*command, warmup], env=variant_environment,
+                                        capture_output=True, text=True, check=True).stdout
+                timings = json.loads(output)
+                timings['process'] = time.perf_counter() - start
+                runs.append(timings)
+
+            print(f'{name} ({args.runs} runs, median ms):')
+
+            for phase in (*_PHASES, 'total', 'process'):
+                print(f'  {phase:>16}: {statistics.median(run[phase] for run in runs) * 1000:8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Compare variable-length `IN (?, ?, ...)` lists with the single JSON parameter bound by
+`open_trs.db.bind_values`.
+
+Every distinct batch size gives an `IN` list a statement text of its own, so a mix of batch sizes
+keeps evicting statements from sqlite3's per-connection cache and preparing them again. Run with:
+
+    python benchmarks/statement_shapes.py
+"""
+import argparse
+import random
+import sqlite3
+import time
+
+import open_trs.db
+
+
+def _connect(num_rows: int) -> sqlite3.Connection:
+    db = sqlite3.connect(':memory:')
+    db.execute('CREATE TABLE Charges (id INTEGER PRIMARY KEY, user INTEGER, hours INTEGER)')
+    db.executemany('INSERT INTO Charges (user, hours) VALUES (1, 1)', [()] * num_rows)
+    db.commit()
+
+    return db
+
+
+def _run_in_list(db: sqlite3.Connection, batches: list):
+    for ids in batches:
+        db.execute(f'SELECT id, user FROM Charges WHERE id IN ({", ".join("?" * len(ids))})',
+                   ids).fetchall()
+
+
+def _run_json_each(db: sqlite3.Connection, batches: list):
+    for ids in batches:
+        ids_sql, ids_parameters = open_trs.db.bind_values(db, ids)
+        db.execute(f'SELECT id, user FROM Charges WHERE id IN {ids_sql}', ids_parameters).fetchall()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=100000, help='Charges in the table.')
+    parser.add_argument('--queries', type=int, default=20000, help='Queries per variant.')
+    parser.add_argument('--max-batch', type=int, default=500, help='Largest batch of IDs.')
+    args = parser.parse_args()
+
+    db = _connect(args.rows)
+    rng = random.Random(0)
+
+    # Small batches are dominated by preparing statements, large ones by the lookups themselves
+    for label, max_batch in (('batches of 1-20 IDs', 20), (f'batches of 1-{args.max_batch} IDs',
+                                                           args.max_batch)):
+        batches = [[rng.randint(1, args.rows) for _ in range(rng.randint(1, max_batch))]
+                   for _ in range(args.queries)]
+        print(f'{args.queries} queries, {label}:')
+
+        for name, run in (('IN (?, ...)', _run_in_list), ('json_each(?)', _run_json_each)):
+            start = time.perf_counter()
+            run(db, batches)
+            seconds = time.perf_counter() - start
+            print(f'  {name:>12}: {seconds:.3f}s, {seconds / args.queries * 1e6:.1f}us per query')
+
+    huge_batch = [rng.randint(1, args.rows)
+                  for _ in range(db.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER) + 1)]
+    print(f'1 query, {len(huge_batch)} IDs:')
+
+    for name, run in (('IN (?, ...)', _run_in_list), ('json_each(?)', _run_json_each)):
+        try:
+            run(db, [huge_batch])
+            print(f'  {name:>12}: ok')
+        except sqlite3.OperationalError as e:
+            print(f'  {name:>12}: failed ({e})')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,26 @@
 import os
+from typing import Optional
 
 from flask import Flask, jsonify
 
+import open_trs.analytics
 import open_trs.auth
+import open_trs.backup
+import open_trs.capture
 import open_trs.configs
 import open_trs.db
+import open_trs.events
+import open_trs.jobs
+import open_trs.maintenance
+import open_trs.metrics
+import open_trs.partitions
+import open_trs.profiling
 import open_trs.projects
 import open_trs.charges
+import open_trs.purge
+import open_trs.ratelimit
+import open_trs.reporting
+import open_trs.warmup
 
 
 CONFIGS = {
@@ -22,7 +36,7 @@ class InvalidUsage(Exception):
     Exception raised for invalid usage of an endpoint.
     """
 
-    def __init__(self, message, status_code=None, payload=None):
+    def __init__(self, message, status_code=None, payload=None, headers=None):
         """
         Initialize a new InvalidUsage exception.
 
@@ -30,12 +44,15 @@ class InvalidUsage(Exception):
             message (str): The message associated with the instance.
             status_code (int, optional): The status code associated with the instance; defaults to None.
             payload (dict, optional): The payload associated with the instance; defaults to None.
+            headers (dict, optional): Headers added to the response, e.g. `Retry-After`; defaults
+                to None.
         """
         super().__init__()
 
         self.message = message
         self.status_code = status_code
         self.payload = payload
+        self.headers = headers
 
     def to_dict(self):
         """
@@ -62,16 +79,22 @@ def handle_invalid_usage(exception: InvalidUsage):
         A JSON response containing the exception details and status code.
     """
 
-    return jsonify(exception.to_dict()), exception.status_code
+    return jsonify(exception.to_dict()), exception.status_code, exception.headers or {}
 
 
-def create_app(testing: bool = False):
+def create_app(testing: bool = False, config: Optional[dict] = None, warm_up: bool = True):
     """
     Create and configure the Flask application.
 
     Args:
         testing (bool, optional): Flag indicating whether the application is running in testing
             mode; defaults to False.
+        config (dict, optional): Settings overriding those of the selected configuration and of
+            `OPEN_TRS_*` environment variables, applied before the app is warmed up; defaults to
+            None.
+        warm_up (bool, optional): Whether to warm the app up if the config's `WARMUP` is set;
+            defaults to True. Callers validating the config first warm it up themselves with
+            `open_trs.warmup.warm_up`.
 
     Returns:
         The configured Flask application.
@@ -88,21 +111,44 @@ def create_app(testing: bool = False):
     app.config['DATABASE'] = os.path.join(app.instance_path, 'open_trs.sqlite')
     app.config.from_object(CONFIGS[config_name])
 
+    # Deployments set secrets and paths in the environment, e.g. OPEN_TRS_SECRET_KEY
+    if not testing:
+        app.config.from_prefixed_env('OPEN_TRS')
+
+    app.config.update(config or {})
+
     # Ensure instance folder exists; Flask does not automatically create it
     try:
         os.makedirs(app.instance_path)
     except OSError:
         pass
 
-    # Register CLI commands and tear down functions
+    # Register CLI commands and tear down functions; profiling and capture first, so that they
+    # cover the rest
+    open_trs.profiling.init_app(app)
+    open_trs.capture.init_app(app)
     open_trs.db.init_app(app)
+    open_trs.jobs.init_app(app)
+    open_trs.backup.init_app(app)
+    open_trs.reporting.init_app(app)
+    open_trs.maintenance.init_app(app)
+    open_trs.partitions.init_app(app)
+    open_trs.events.init_app(app)
+    open_trs.ratelimit.init_app(app)
+    open_trs.analytics.init_app(app)
 
     # Register API blueprints
     app.register_blueprint(open_trs.auth.bp)
     app.register_blueprint(open_trs.projects.bp)
     app.register_blueprint(open_trs.charges.bp)
+    app.register_blueprint(open_trs.jobs.bp)
+    app.register_blueprint(open_trs.events.bp)
+    app.register_blueprint(open_trs.metrics.bp)
 
     # Register error handlers
     app.register_error_handler(InvalidUsage, handle_invalid_usage)
 
+    if warm_up and app.config['WARMUP']:
+        open_trs.warmup.warm_up(app)
+
     return app
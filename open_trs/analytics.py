@@ -0,0 +1,327 @@
+import array
+import bisect
+import collections
+import threading
+from typing import List, Optional
+
+from flask import Flask, current_app
+
+import open_trs.backends
+import open_trs.db
+import open_trs.events
+import open_trs.partitions
+
+# Key of the app's cache in `Flask.extensions`
+_EXTENSION = 'open_trs.analytics'
+
+
+class Columns:
+    """
+    A user's charges as column arrays sorted by day: NumPy arrays when NumPy is used, `array`
+    arrays otherwise.
+    """
+
+    def __init__(self, days, projects, hours):
+        """
+        Initialize a new Columns.
+
+        Args:
+            days: The charges' day numbers, in ascending order.
+            projects: The charges' project IDs.
+            hours: The charges' hours.
+        """
+
+        self.days = days
+        self.projects = projects
+        self.hours = hours
+
+
+class _Cache:
+    """
+    The columns of the users that most recently asked for statistics, each with the data version
+    they were loaded at.
+    """
+
+    def __init__(self, max_users: int):
+        """
+        Initialize a new _Cache.
+
+        Args:
+            max_users: The number of users kept; the least recently used are evicted first.
+        """
+
+        self.max_users = max_users
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id: int, version: int) -> Optional[Columns]:
+        with self.lock:
+            entry = self.entries.get(user_id)
+
+            if entry is None or entry[0] != version:
+                return None
+
+            self.entries.move_to_end(user_id)
+
+            return entry[1]
+
+    def put(self, user_id: int, version: int, columns: Columns):
+        with self.lock:
+            self.entries[user_id] = (version, columns)
+            self.entries.move_to_end(user_id)
+
+            while len(self.entries) > self.max_users:
+                self.entries.popitem(last=False)
+
+
+def import_numpy():
+    """
+    Import NumPy on first use rather than with this module, since loading it takes longer than
+    starting the rest of the app; `open_trs.warmup.warm_up` imports it ahead of requests.
+
+    Returns:
+        The `numpy` module, or None if it is not installed or the config's `ANALYTICS_NUMPY` is not
+        set.
+    """
+
+    if not current_app.config['ANALYTICS_NUMPY']:
+        return None
+
+    try:
+        import numpy
+    except ImportError:
+        return None
+
+    return numpy
+
+
+def get_columns(db: open_trs.backends.Connection, user_id: int) -> Columns:
+    """
+    Get a user's charges, including those of archived years and excluding those of deleted
+    projects, as columns.
+
+    Columns are loaded with a single query and cached per worker until the user's data version
+    (see `open_trs.events.get_data_version`) changes.
+
+    Args:
+        db: The database connection.
+        user_id: The user's ID.
+
+    Returns:
+        The user's charges.
+    """
+
+    cache = current_app.extensions[_EXTENSION]
+    version = open_trs.events.get_data_version(db, user_id)
+    columns = cache.get(user_id, version)
+
+    if columns is not None:
+        return columns
+
+    source = open_trs.partitions.get_charges_source(db, user_id=user_id)
+    rows = db.execute(
+        'SELECT Charges.date_charged, Charges.project, Charges.hours'
+        f' FROM {source} JOIN Projects ON Projects.id = Charges.project'
+        ' WHERE Charges.user = ? AND Projects.deleted IS NULL'
+        ' ORDER BY Charges.date_charged', (user_id,)).fetchall()
+    days, projects, hours = zip(*rows) if rows else ((), (), ())
+    numpy = import_numpy()
+
+    if numpy is not None:
+        columns = Columns(numpy.array(days, dtype=numpy.int64),
+                          numpy.array(projects, dtype=numpy.int64),
+                          numpy.array(hours, dtype=numpy.int64))
+    else:
+        columns = Columns(array.array('q', days), array.array('q', projects),
+                          array.array('q', hours))
+
+    cache.put(user_id, version, columns)
+
+    return columns
+
+
+def _get_percentile(values: List[float], percentile: float) -> float:
+    """
+    Interpolate a percentile of sorted values linearly between the closest ranks, like NumPy.
+
+    Args:
+        values: The values, in ascending order.
+        percentile: The percentile, from 0 to 100.
+
+    Returns:
+        The percentile's value.
+    """
+
+    position = (len(values) - 1) * percentile / 100
+    below = int(position)
+    above = min(below + 1, len(values) - 1)
+
+    return values[below] + (values[above] - values[below]) * (position - below)
+
+
+def _compute_with_numpy(numpy, columns: Columns, start_day: int, num_days: int, window: int,
+                        percentiles: List[float]) -> dict:
+    """
+    Compute the statistics of `compute_stats` with array operations over a projects by days
+    matrix.
+    """
+
+    first = numpy.searchsorted(columns.days, start_day, side='left')
+    last = numpy.searchsorted(columns.days, start_day + num_days - 1, side='right')
+    project_ids, rows = numpy.unique(columns.projects[first:last], return_inverse=True)
+    num_rows = len(project_ids) + 1
+
+    # Row 0 holds all projects together; hours are whole, so their float sums are exact
+    matrix = numpy.zeros((num_rows, num_days), dtype=numpy.int64)
+    matrix[1:] = numpy.bincount(
+        rows * num_days + (columns.days[first:last] - start_day), weights=columns.hours[first:last],
+        minlength=(num_rows - 1) * num_days).reshape(num_rows - 1, num_days)
+    matrix[0] = matrix[1:].sum(axis=0)
+    charged = matrix > 0
+
+    weekdays = (open_trs.db.day_to_date(start_day).weekday() + numpy.arange(num_days)) % 7
+    week_starts = numpy.flatnonzero((weekdays == 0) | (numpy.arange(num_days) == 0))
+    week_hours = numpy.add.reduceat(matrix, week_starts, axis=1)
+
+    # Runs of charged days start where a row turns from uncharged to charged and end where it
+    # turns back; runs are found in row order, so the last run of a row is its current one
+    edges = numpy.diff(numpy.pad(charged, ((0, 0), (1, 1))).astype(numpy.int8), axis=1)
+    run_rows, run_starts = numpy.nonzero(edges == 1)
+    run_lengths = numpy.nonzero(edges == -1)[1] - run_starts
+    longest_streaks = numpy.zeros(num_rows, dtype=numpy.int64)
+    numpy.maximum.at(longest_streaks, run_rows, run_lengths)
+    current_streaks = numpy.zeros(num_rows, dtype=numpy.int64)
+    current = run_starts + run_lengths == num_days
+    current_streaks[run_rows[current]] = run_lengths[current]
+
+    return {
+        'projects': [None, *project_ids.tolist()],
+        'hours': matrix.sum(axis=1).tolist(),
+        'days': charged.sum(axis=1).tolist(),
+        'rolling_hours': matrix[:, -window:].sum(axis=1).tolist(),
+        'percentiles': [numpy.percentile(row[row > 0], percentiles).tolist() if row.any() else None
+                        for row in matrix],
+        'weekdays': (matrix @ (weekdays[:, None] == numpy.arange(7))).tolist(),
+        'week_starts': week_starts.tolist(),
+        'week_hours': week_hours.tolist(),
+        'week_changes': numpy.diff(week_hours, axis=1).tolist(),
+        'longest_streaks': longest_streaks.tolist(),
+        'current_streaks': current_streaks.tolist(),
+    }
+
+
+def _compute_with_python(columns: Columns, start_day: int, num_days: int, window: int,
+                         percentiles: List[float]) -> dict:
+    """
+    Compute the statistics of `compute_stats` without NumPy, one project row at a time, with
+    slices and byte strings rather than loops over days where possible.
+    """
+
+    first = bisect.bisect_left(columns.days, start_day)
+    last = bisect.bisect_right(columns.days, start_day + num_days - 1)
+    project_ids = sorted(set(columns.projects[first:last]))
+    rows = {project_id: row for row, project_id in enumerate(project_ids, start=1)}
+
+    # Row 0 holds all projects together
+    matrix = [array.array('q', bytes(8 * num_days)) for _ in range(len(project_ids) + 1)]
+
+    for i in range(first, last):
+        day = columns.days[i] - start_day
+        matrix[rows[columns.projects[i]]][day] += columns.hours[i]
+        matrix[0][day] += columns.hours[i]
+
+    first_weekday = open_trs.db.day_to_date(start_day).weekday()
+    week_starts = [day for day in range(num_days) if day == 0 or (first_weekday + day) % 7 == 0]
+    stats = collections.defaultdict(list, projects=[None, *project_ids], week_starts=week_starts)
+
+    for row in matrix:
+        charged_hours = sorted(filter(None, row))
+        # One byte per day, 1 if charged, so that streaks are runs of b'\x01'
+        charged = bytes(map(bool, row))
+        week_hours = [sum(row[week_start:week_end]) for week_start, week_end
+                      in zip(week_starts, [*week_starts[1:], num_days])]
+
+        stats['hours'].append(sum(row))
+        stats['days'].append(len(charged_hours))
+        stats['rolling_hours'].append(sum(row[-window:]))
+        stats['percentiles'].append(
+            [_get_percentile(charged_hours, percentile) for percentile in percentiles]
+            if charged_hours else None)
+        stats['weekdays'].append([sum(row[(weekday - first_weekday) % 7::7])
+                                  for weekday in range(7)])
+        stats['week_hours'].append(week_hours)
+        stats['week_changes'].append([hours - previous for previous, hours
+                                      in zip(week_hours, week_hours[1:])])
+        stats['longest_streaks'].append(max(map(len, charged.split(b'\x00'))))
+        stats['current_streaks'].append(len(charged) - len(charged.rstrip(b'\x01')))
+
+    return stats
+
+
+def compute_stats(columns: Columns, start_day: int, end_day: int, window: int) -> dict:
+    """
+    Compute statistics of a user's hours per day between two days, per project and for all
+    projects together.
+
+    The statistics of every project with charges in the range, and of all projects together under
+    a null project, are its total hours, the number of days charged, the average hours per day of
+    the range and of its last `window` days, percentiles of the hours of the days charged, the
+    hours per weekday (Monday first), the longest streak of consecutive days charged and the one
+    reaching the end of the range, and the hours of every week with their change from the week
+    before. Weeks start on Mondays, except the first one, which starts with the range.
+
+    Args:
+        columns: The user's charges, see `get_columns`.
+        start_day: The first day number of the range.
+        end_day: The last day number of the range.
+        window: The number of days of the rolling average.
+
+    Returns:
+        The start dates of the weeks and the statistics, ready to be serialized as JSON.
+    """
+
+    num_days = end_day - start_day + 1
+    window = min(window, num_days)
+    percentiles = current_app.config['ANALYTICS_PERCENTILES']
+    numpy = import_numpy()
+
+    if numpy is not None and isinstance(columns.days, numpy.ndarray):
+        stats = _compute_with_numpy(numpy, columns, start_day, num_days, window, percentiles)
+    else:
+        stats = _compute_with_python(columns, start_day, num_days, window, percentiles)
+
+    series = []
+
+    # Sums of hours are whole; averages and percentiles are rounded alike by both computations
+    for i, project_id in enumerate(stats['projects']):
+        series.append({
+            'project': project_id,
+            'hours': stats['hours'][i],
+            'days': stats['days'][i],
+            'daily_average': round(stats['hours'][i] / num_days, 4),
+            'rolling_average': round(stats['rolling_hours'][i] / window, 4),
+            'percentiles': ({str(percentile): round(value, 4) for percentile, value
+                             in zip(percentiles, stats['percentiles'][i])}
+                            if stats['percentiles'][i] is not None else None),
+            'weekdays': stats['weekdays'][i],
+            'longest_streak': stats['longest_streaks'][i],
+            'current_streak': stats['current_streaks'][i],
+            'week_hours': stats['week_hours'][i],
+            'week_changes': [None, *stats['week_changes'][i]],
+        })
+
+    return {
+        'weeks': [str(open_trs.db.day_to_date(start_day + day)) for day in stats['week_starts']],
+        'stats': series,
+    }
+
+
+def init_app(app: Flask):
+    """
+    Initialize the Flask application.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+
+    app.extensions[_EXTENSION] = _Cache(app.config['ANALYTICS_CACHE_USERS'])
@@ -4,10 +4,11 @@ import time
 import werkzeug.security
 
 import jwt
-from flask import abort, Blueprint, current_app, request, jsonify
+from flask import abort, Blueprint, current_app, g, request, jsonify
 
 import open_trs
 import open_trs.db
+import open_trs.ratelimit
 
 EMAIL_REGEX = re.compile(r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
 
@@ -22,7 +23,9 @@ def login_required(view: callable):
     If the provided JWT is invalid or expired, it returns a JSON response with an error message
     and status code 400.
 
-    Decorated functions will receive the user's ID integer as an additional argument
+    Decorated functions will receive the user's ID integer as an additional argument. The ID is
+    also stored as `flask.g.user_id` so that `open_trs.db.get_db` can select the user's shard.
+    Requests are rate limited per user, see `open_trs.ratelimit.limit`.
 
     Args:
         view (callable): The view function to be decorated.
@@ -51,12 +54,23 @@ def login_required(view: callable):
             raise open_trs.InvalidUsage('Unable to decode token', 400)
 
         user_id = decoded_jwt['sub']
+        g.user_id = user_id
+        open_trs.ratelimit.limit(f'user:{user_id}')
 
         return view(user_id, *args, **kwargs)
 
     return wrapped_view
 
 
+@bp.before_request
+def limit_by_ip():
+    """
+    Rate limit the unauthenticated authentication routes by the client's IP address.
+    """
+
+    open_trs.ratelimit.limit(f'ip:{request.remote_addr}')
+
+
 @bp.route('/register', methods=['POST'])
 def register():
     """
@@ -88,11 +102,13 @@ def register():
     elif not password:
         raise open_trs.InvalidUsage('Password is required', 400)
 
-    db = open_trs.db.get_db()
+    db = open_trs.db.get_directory_db()
 
     try:
-        db.execute('INSERT INTO Users (username, email, password) VALUES (?, ?, ?)',
-                   (username, email, werkzeug.security.generate_password_hash(password)))
+        user = db.execute(
+            'INSERT INTO Users (username, email, password) VALUES (?, ?, ?) RETURNING id',
+            (username, email, werkzeug.security.generate_password_hash(password))).fetchone()
+        open_trs.db.assign_shard(db, user['id'])
         db.commit()
     except db.IntegrityError:
         raise open_trs.InvalidUsage(
@@ -117,7 +133,7 @@ def login():
     username = data.get('username')
     password = data.get('password')
 
-    db = open_trs.db.get_db()
+    db = open_trs.db.get_directory_db()
     user = db.execute(
         'SELECT id, password FROM Users WHERE username = ?', (username,)).fetchone()
 
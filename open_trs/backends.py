@@ -0,0 +1,283 @@
+import decimal
+import os
+import re
+import sqlite3
+from typing import Any, Iterable, Sequence, Tuple, Union
+
+# Connection pools of client-server backends, keyed by database URL
+_pools = {}
+# Pools inherited from the parent of a forked process, see `_reset_after_fork`
+_inherited_pools = []
+
+_PLACEHOLDER_REGEX = re.compile(r'\?')
+_USER_COLUMN_REGEX = re.compile(r'(?<![\w"])user(?![\w"])')
+_AUTOINCREMENT_REGEX = re.compile(r'\bINTEGER PRIMARY KEY AUTOINCREMENT\b', re.IGNORECASE)
+_INTEGER_REGEX = re.compile(r'\bINTEGER\b', re.IGNORECASE)
+_DROP_TABLE_REGEX = re.compile(r'\b(DROP TABLE IF EXISTS \w+)', re.IGNORECASE)
+_PRAGMA_REGEX = re.compile(r'^\s*PRAGMA [^;]*;', re.IGNORECASE | re.MULTILINE)
+
+
+def parse_database_url(database: str) -> Tuple[str, str]:
+    """
+    Split a configured `DATABASE` into the backend name and the backend specific target.
+
+    Plain paths and `file:` URIs are SQLite databases, as are SQLAlchemy style `sqlite:///path`
+    URLs. `postgresql://` and `postgres://` URLs are PostgreSQL connection strings.
+
+    Args:
+        database: The configured database.
+
+    Returns:
+        A tuple containing the backend name ("sqlite" or "postgresql") and its target.
+    """
+
+    if database.startswith(('postgresql://', 'postgres://')):
+        return 'postgresql', database
+    elif database.startswith('sqlite:///'):
+        return 'sqlite', database[len('sqlite:///'):] or ':memory:'
+
+    return 'sqlite', database
+
+
+def translate_sql(sql: str, parameters: bool = True) -> str:
+    """
+    Translate a statement written in the SQLite dialect used throughout Open TRS to PostgreSQL.
+
+    Open TRS sticks to SQL both databases understand (e.g. `ON CONFLICT`, `RETURNING`, row value
+    comparisons), so translation only has to swap placeholders, quote the `user` column, which is
+    a reserved word in PostgreSQL, and map SQLite specific DDL.
+
+    Args:
+        sql: The SQLite statement.
+        parameters (bool, optional): Whether the statement will be executed with parameters, in
+            which case literal percent signs are escaped; defaults to True.
+
+    Returns:
+        The equivalent PostgreSQL statement.
+    """
+
+    sql = _PRAGMA_REGEX.sub('', sql)
+
+    if parameters:
+        sql = _PLACEHOLDER_REGEX.sub('%s', sql.replace('%', '%%'))
+
+    sql = _USER_COLUMN_REGEX.sub('"user"', sql)
+    sql = _AUTOINCREMENT_REGEX.sub('BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY', sql)
+    sql = _INTEGER_REGEX.sub('BIGINT', sql)
+    sql = _DROP_TABLE_REGEX.sub(r'\1 CASCADE', sql)
+
+    return sql
+
+
+class PostgresRow(tuple):
+    """
+    Row of a PostgreSQL result supporting access by index and by column name, like `sqlite3.Row`.
+    """
+
+    def __new__(cls, values: Iterable, names: Sequence[str]):
+        row = super().__new__(cls, values)
+        row._names = names
+
+        return row
+
+    def __getitem__(self, key: Union[int, str, slice]) -> Any:
+        if isinstance(key, str):
+            return super().__getitem__(self._names.index(key))
+
+        return super().__getitem__(key)
+
+    def keys(self) -> Sequence[str]:
+        """
+        Get the result's column names.
+
+        Returns:
+            The column names, in order.
+        """
+
+        return self._names
+
+
+class PostgresConnection:
+    """
+    Pooled PostgreSQL connection exposing the subset of the `sqlite3.Connection` interface used by
+    Open TRS, so views can run the same SQL against either backend.
+    """
+
+    def __init__(self, pool, connection):
+        """
+        Initialize a new PostgresConnection.
+
+        Args:
+            pool (psycopg_pool.ConnectionPool): The pool the connection was checked out from.
+            connection (psycopg.Connection): The checked out connection.
+        """
+
+        import psycopg
+
+        self.IntegrityError = psycopg.IntegrityError
+        self.OperationalError = psycopg.OperationalError
+
+        self._pool = pool
+        self._connection = connection
+
+    def execute(self, sql: str, parameters: Sequence = ()):
+        """
+        Execute a single statement.
+
+        Args:
+            sql: The statement, written in the SQLite dialect.
+            parameters (Sequence, optional): The statement's parameters; defaults to no parameters.
+
+        Returns:
+            The psycopg cursor holding the statement's results.
+        """
+
+        return self._connection.execute(translate_sql(sql), tuple(parameters))
+
+    def executemany(self, sql: str, seq_of_parameters: Iterable[Sequence]):
+        """
+        Execute a statement once for every set of parameters.
+
+        Args:
+            sql: The statement, written in the SQLite dialect.
+            seq_of_parameters: The parameters for each execution.
+
+        Returns:
+            The psycopg cursor used for the executions.
+        """
+
+        cursor = self._connection.cursor()
+        cursor.executemany(translate_sql(sql), [tuple(parameters)
+                                                for parameters in seq_of_parameters])
+
+        return cursor
+
+    def executescript(self, script: str):
+        """
+        Execute a script of parameterless statements and commit.
+
+        Args:
+            script: The statements, written in the SQLite dialect.
+        """
+
+        self._connection.execute(translate_sql(script, parameters=False))
+        self._connection.commit()
+
+    def commit(self):
+        """
+        Commit the current transaction.
+        """
+
+        self._connection.commit()
+
+    def rollback(self):
+        """
+        Roll back the current transaction.
+        """
+
+        self._connection.rollback()
+
+    def close(self):
+        """
+        Return the connection to its pool; uncommitted changes are rolled back.
+        """
+
+        if self._connection is not None:
+            self._connection.rollback()
+            self._pool.putconn(self._connection)
+            self._connection = None
+
+
+def _postgres_row_factory(cursor):
+    names = [column.name for column in cursor.description or ()]
+
+    return lambda values: PostgresRow(values, names)
+
+
+def _configure_postgres_connection(connection):
+    import psycopg.adapt
+
+    class NumericLoader(psycopg.adapt.Loader):
+        # Aggregates such as SUM(BIGINT) return NUMERIC; keep them JSON numbers like in SQLite
+        def load(self, data):
+            value = decimal.Decimal(bytes(data).decode())
+
+            return int(value) if value == value.to_integral_value() else float(value)
+
+    connection.adapters.register_loader('numeric', NumericLoader)
+    connection.row_factory = _postgres_row_factory
+
+
+def _reset_after_fork():
+    """
+    Forget the connection pools of the parent process in a forked child, e.g. a gunicorn worker.
+
+    The pools' connections and threads belong to the parent, so the child opens pools of its own.
+    The inherited pools stay referenced, so that they are never finalized, which would close the
+    parent's connections.
+    """
+
+    _inherited_pools.extend(_pools.values())
+    _pools.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def connect(database: str, pool_size: int = 10) -> Union[sqlite3.Connection, PostgresConnection]:
+    """
+    Open a connection to the configured database, picking the backend from its URL.
+
+    SQLite connections are opened directly. PostgreSQL connections are checked out of a connection
+    pool that is created for each URL on first use; it requires the optional `psycopg[pool]`
+    dependency.
+
+    Args:
+        database: The configured database path or URL.
+        pool_size (int, optional): The maximum number of pooled connections per client-server
+            database; defaults to 10.
+
+    Returns:
+        The database connection.
+    """
+
+    backend, target = parse_database_url(database)
+
+    if backend == 'sqlite':
+        db = sqlite3.connect(target, detect_types=sqlite3.PARSE_DECLTYPES,
+                             uri=target.startswith('file:'))
+        db.row_factory = sqlite3.Row
+
+        return db
+
+    try:
+        import psycopg_pool
+    except ImportError:
+        raise RuntimeError('PostgreSQL support requires psycopg, install open-trs[postgresql]')
+
+    if database not in _pools:
+        _pools[database] = psycopg_pool.ConnectionPool(
+            target, min_size=1, max_size=pool_size, configure=_configure_postgres_connection,
+            open=True)
+
+    pool = _pools[database]
+
+    return PostgresConnection(pool, pool.getconn())
+
+
+def is_sqlite(db: Union[sqlite3.Connection, PostgresConnection]) -> bool:
+    """
+    Check whether a connection uses the SQLite backend.
+
+    Args:
+        db: The database connection.
+
+    Returns:
+        True for SQLite connections.
+    """
+
+    return isinstance(db, sqlite3.Connection)
+
+
+Connection = Union[sqlite3.Connection, PostgresConnection]
+Row = Union[sqlite3.Row, PostgresRow]
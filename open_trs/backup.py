@@ -0,0 +1,348 @@
+import datetime
+import os
+import shutil
+import time
+from typing import Callable, List, Optional, Tuple
+
+import click
+from flask import Flask, current_app
+
+import open_trs.backends
+import open_trs.db
+import open_trs.jobs
+import open_trs.partitions
+
+_SNAPSHOT_PREFIX = 'open_trs-'
+# Directory of a snapshot holding the archived partitions, laid out like `PARTITIONS_DIR`
+_SNAPSHOT_PARTITIONS = 'partitions'
+
+
+def get_databases() -> List[Tuple[str, str]]:
+    """
+    Get the databases making up a snapshot: the config's `DATABASE`, named "main", and every shard.
+
+    Returns:
+        A list of `(name, database)` tuples.
+    """
+
+    databases = [('main', current_app.config['DATABASE']),
+                 *current_app.config['DATABASE_SHARDS'].items()]
+
+    for _, database in databases:
+        if open_trs.backends.parse_database_url(database)[0] != 'sqlite':
+            raise RuntimeError('Backups are only supported for SQLite databases, use the'
+                               " database server's own tools instead")
+
+    return databases
+
+
+def _get_snapshot_partitions(snapshot_dir: str, names: List[str]) -> List[Tuple[str, str]]:
+    """
+    Get the archived partitions recorded in the Partitions tables of a snapshot's databases.
+
+    A snapshot covers the partitions its own databases refer to, which may differ from those of
+    the live databases if charges were archived after it was taken.
+
+    Args:
+        snapshot_dir: The snapshot's directory.
+        names: The names of the databases to read, which must have the current schema.
+
+    Returns:
+        A list of `(name, path)` tuples, where the path is relative to `PARTITIONS_DIR` and to the
+        snapshot's partitions directory, and the name is the path without its extension.
+    """
+
+    partitions = []
+
+    for name in names:
+        db = open_trs.backends.connect(os.path.join(snapshot_dir, f'{name}.sqlite'))
+
+        try:
+            paths = [row[0] for row in db.execute('SELECT path FROM Partitions ORDER BY year')]
+        finally:
+            db.close()
+
+        partitions.extend((os.path.splitext(path)[0], path) for path in paths)
+
+    return partitions
+
+
+def _get_backup_dir() -> str:
+    return current_app.config['BACKUP_DIR'] or os.path.join(current_app.instance_path, 'backups')
+
+
+def copy_database(source: str, target: str, pages: int, pause: float) -> dict:
+    """
+    Copy a live SQLite database with the online backup API.
+
+    The copy proceeds in steps of `pages` pages with a pause between them. The source is only
+    locked while a step runs, so writers wait at most for one step instead of the whole copy, and
+    the result is a consistent snapshot even if the source is written to meanwhile.
+
+    Args:
+        source: The path or URI of the database to copy.
+        target: The path or URI of the database to overwrite with the copy.
+        pages: The number of pages copied per step.
+        pause: The seconds to sleep between steps.
+
+    Returns:
+        A dictionary of statistics: the number of `pages` and `steps`, the total `seconds`, and
+        the `longest_step` in seconds, which bounds how long a writer could have been blocked.
+    """
+
+    stats = {'pages': 0, 'steps': 0, 'seconds': 0.0, 'longest_step': 0.0}
+    source_db = open_trs.backends.connect(source)
+    target_db = open_trs.backends.connect(target)
+    start = step_start = time.perf_counter()
+
+    def progress(status: int, remaining: int, total: int):
+        nonlocal step_start
+
+        stats['steps'] += 1
+        stats['pages'] = total
+        stats['longest_step'] = max(stats['longest_step'], time.perf_counter() - step_start)
+
+        if remaining:
+            time.sleep(pause)
+
+        step_start = time.perf_counter()
+
+    try:
+        source_db.backup(target_db, pages=pages, progress=progress)
+    finally:
+        target_db.close()
+        source_db.close()
+
+    stats['seconds'] = time.perf_counter() - start
+
+    return stats
+
+
+def backup(output_dir: Optional[str] = None) -> Tuple[str, List[Tuple[str, dict]]]:
+    """
+    Write a snapshot of the database, its shards and their archived partitions without stopping
+    the app.
+
+    Snapshots written to the config's `BACKUP_DIR` are named after the time they were taken, and
+    only the newest `BACKUP_KEEP` of them are kept.
+
+    Args:
+        output_dir (str, optional): The directory to write the snapshot to; defaults to a new
+            directory in the config's `BACKUP_DIR`.
+
+    Returns:
+        A tuple containing the snapshot's directory and the `(name, statistics)` of every
+        database copied, see `copy_database`.
+    """
+
+    databases = get_databases()
+    backup_dir = _get_backup_dir()
+
+    if output_dir is None:
+        timestamp = datetime.datetime.now(datetime.timezone.utc).strftime('%Y%m%dT%H%M%S.%f')
+        output_dir = os.path.join(backup_dir, f'{_SNAPSHOT_PREFIX}{timestamp}')
+
+    os.makedirs(output_dir)
+    results = []
+
+    for name, database in databases:
+        stats = copy_database(database, os.path.join(output_dir, f'{name}.sqlite'),
+                              current_app.config['BACKUP_PAGES'],
+                              current_app.config['BACKUP_PAUSE'])
+        results.append((name, stats))
+
+    # The partitions the copies refer to; archiving meanwhile only adds partitions they do not
+    for name, path in _get_snapshot_partitions(output_dir, [name for name, _ in databases]):
+        target = os.path.join(output_dir, _SNAPSHOT_PARTITIONS, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        stats = copy_database(os.path.join(open_trs.partitions.get_partitions_dir(), path), target,
+                              current_app.config['BACKUP_PAGES'],
+                              current_app.config['BACKUP_PAUSE'])
+        results.append((name, stats))
+
+    if os.path.dirname(os.path.abspath(output_dir)) == os.path.abspath(backup_dir):
+        snapshots = sorted(entry for entry in os.listdir(backup_dir)
+                           if entry.startswith(_SNAPSHOT_PREFIX))
+
+        for snapshot in snapshots[:-current_app.config['BACKUP_KEEP']]:
+            shutil.rmtree(os.path.join(backup_dir, snapshot))
+
+    return output_dir, results
+
+
+def verify(snapshot_dir: str) -> List[Tuple[str, List[str]]]:
+    """
+    Check the integrity of every database and archived partition in a snapshot.
+
+    Args:
+        snapshot_dir: The snapshot's directory.
+
+    Returns:
+        A list of `(name, problems)` tuples; a database passed if its list of problems is empty.
+    """
+
+    results = []
+
+    for name, _ in get_databases():
+        path = os.path.join(snapshot_dir, f'{name}.sqlite')
+
+        if not os.path.exists(path):
+            results.append((name, ['Missing from snapshot']))
+            continue
+
+        db = open_trs.backends.connect(path)
+
+        try:
+            problems = [row[0] for row in db.execute('PRAGMA integrity_check')
+                        if row[0] != 'ok']
+            version = db.execute('PRAGMA user_version').fetchone()[0]
+        finally:
+            db.close()
+
+        if version != open_trs.db.SCHEMA_VERSION:
+            problems.append(f'Schema version {version}, expected {open_trs.db.SCHEMA_VERSION}')
+
+        results.append((name, problems))
+
+    # Databases that failed cannot be trusted to list their partitions
+    passed = [name for name, problems in results if not problems]
+
+    for name, path in _get_snapshot_partitions(snapshot_dir, passed):
+        snapshot_path = os.path.join(snapshot_dir, _SNAPSHOT_PARTITIONS, path)
+
+        if not os.path.exists(snapshot_path):
+            results.append((name, ['Missing from snapshot']))
+            continue
+
+        db = open_trs.backends.connect(snapshot_path)
+
+        try:
+            results.append((name, [row[0] for row in db.execute('PRAGMA integrity_check')
+                                   if row[0] != 'ok']))
+        finally:
+            db.close()
+
+    return results
+
+
+def restore(snapshot_dir: str) -> List[Tuple[str, dict]]:
+    """
+    Overwrite the database, its shards and their archived partitions with a verified snapshot.
+
+    Args:
+        snapshot_dir: The snapshot's directory.
+
+    Returns:
+        The `(name, statistics)` of every database restored, see `copy_database`.
+    """
+
+    for name, problems in verify(snapshot_dir):
+        if problems:
+            raise RuntimeError(f'Snapshot of {name} failed verification: {"; ".join(problems)}')
+
+    databases = get_databases()
+    results = [(name, copy_database(os.path.join(snapshot_dir, f'{name}.sqlite'), database,
+                                    current_app.config['BACKUP_PAGES'],
+                                    current_app.config['BACKUP_PAUSE']))
+               for name, database in databases]
+
+    for name, path in _get_snapshot_partitions(snapshot_dir, [name for name, _ in databases]):
+        target = os.path.join(open_trs.partitions.get_partitions_dir(), path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        results.append((name, copy_database(
+            os.path.join(snapshot_dir, _SNAPSHOT_PARTITIONS, path), target,
+            current_app.config['BACKUP_PAGES'], current_app.config['BACKUP_PAUSE'])))
+
+    return results
+
+
+@open_trs.jobs.handler('backup', concurrency=1)
+def _backup_job(payload: dict, report_progress: Callable[[float], None]) -> dict:
+    try:
+        snapshot_dir, results = backup()
+    finally:
+        # The next backup is queued even if this one failed, so that the schedule goes on
+        interval = current_app.config['BACKUP_INTERVAL']
+
+        if interval:
+            open_trs.jobs.enqueue('backup', {}, delay=interval, unique=True)
+
+    return {'snapshot': snapshot_dir, 'databases': dict(results)}
+
+
+def _echo_results(verb: str, results: List[Tuple[str, dict]]):
+    for name, stats in results:
+        click.echo(f'{verb} {name}: {stats["pages"]} pages in {stats["seconds"]:.2f}s'
+                   f' ({stats["steps"]} steps, longest {stats["longest_step"] * 1000:.1f}ms).')
+
+
+@click.command('backup')
+@click.option('--output', default=None, help='Directory to write the snapshot to.')
+@click.option('--schedule', is_flag=True,
+              help='Queue a background backup job that repeats every BACKUP_INTERVAL seconds.')
+def backup_command(output: Optional[str], schedule: bool):
+    """
+    Click command to back up the database while the app keeps running.
+    """
+
+    if schedule:
+        job_id = open_trs.jobs.enqueue('backup', {}, unique=True)
+        click.echo('A backup job is already scheduled.' if job_id is None
+                   else f'Queued backup job {job_id}.')
+        return
+
+    try:
+        snapshot_dir, results = backup(output)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    _echo_results('Backed up', results)
+    click.echo(f'Snapshot written to {snapshot_dir}.')
+
+
+@click.command('verify-backup')
+@click.argument('snapshot')
+def verify_backup_command(snapshot: str):
+    """
+    Click command to check the integrity of a snapshot.
+    """
+
+    try:
+        results = verify(snapshot)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    for name, problems in results:
+        click.echo(f'{name}: {"; ".join(problems) or "ok"}')
+
+    if any(problems for _, problems in results):
+        raise click.ClickException('Snapshot failed verification.')
+
+
+@click.command('restore')
+@click.argument('snapshot')
+@click.confirmation_option(prompt='This overwrites the database with the snapshot. Continue?')
+def restore_command(snapshot: str):
+    """
+    Click command to overwrite the database with a snapshot.
+    """
+
+    try:
+        results = restore(snapshot)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    _echo_results('Restored', results)
+
+
+def init_app(app: Flask):
+    """
+    Initialize the Flask application.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+
+    app.cli.add_command(backup_command)
+    app.cli.add_command(verify_backup_command)
+    app.cli.add_command(restore_command)
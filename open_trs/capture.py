@@ -0,0 +1,193 @@
+import datetime
+import hashlib
+import hmac
+import json
+import os
+import random
+import re
+import threading
+import time
+
+from flask import Flask, current_app, g, request
+from werkzeug.wrappers import Response
+
+# Keys whose values reference a project, or an object of the blueprint's own kind (a charge or
+# project), rather than carrying data
+_PROJECT_KEYS = {'project', 'project_id'}
+_OWN_KEYS = {'id', 'ids', 'delete'}
+# Keys whose values choose between options rather than carrying data
+_OPTION_KEYS = {'group_by', 'mode'}
+_DATE_REGEX = re.compile(r'^\d{4}-\d{2}-\d{2}$')
+# Calendar periods, e.g. "2024-W06", "2024-02", or "2024-Q1", which identify nobody
+_PERIOD_REGEX = re.compile(r'^\d{4}-(W\d{2}|\d{2}|Q[1-4])$')
+
+# Serializes appends of the threads of this worker process
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """
+    Replace `_lock` in a forked child, e.g. a gunicorn worker, since a thread of the parent may have
+    been appending a captured request under it while the child was forked.
+    """
+
+    global _lock
+
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _get_kind(key: str, endpoint: str) -> str:
+    """
+    Get the kind of object an ID under a key refers to.
+
+    Args:
+        key: The key holding the ID, e.g. "project" or "ids".
+        endpoint: The request's endpoint, e.g. "charges.delete_charges".
+
+    Returns:
+        "project" or "charge", or None if the key does not hold IDs.
+    """
+
+    if key in _PROJECT_KEYS:
+        return 'project'
+    elif key in _OWN_KEYS:
+        return 'project' if endpoint.startswith('projects.') else 'charge'
+
+    return None
+
+
+def anonymize(value, endpoint: str, today: datetime.date, kind: str = None):
+    """
+    Reduce a request's JSON body, or part of it, to its shape.
+
+    Keys, numbers, booleans, options such as `group_by`, and calendar periods are kept. Lists
+    become their length and the shape of their first item, dates become their offset in days from
+    the day of the request, IDs become the kind of object they reference, and other strings become
+    their length, so that a shape tells batch sizes and date ranges apart without holding users'
+    data.
+
+    Args:
+        value: The JSON value.
+        endpoint: The request's endpoint, deciding what IDs refer to.
+        today: The day of the request.
+        kind (str, optional): The kind of object `value` references, if it is an ID; defaults to
+            None.
+
+    Returns:
+        The value's shape, e.g. `{"$list": 3, "item": {"$day": -7}}`.
+    """
+
+    if isinstance(value, dict):
+        return {key: item if key in _OPTION_KEYS
+                else anonymize(item, endpoint, today, _get_kind(key, endpoint))
+                for key, item in value.items()}
+    elif isinstance(value, list):
+        return {'$list': len(value),
+                'item': anonymize(value[0], endpoint, today, kind) if value else None}
+    elif kind is not None and isinstance(value, int) and not isinstance(value, bool):
+        return {'$id': kind}
+    elif isinstance(value, str) and _DATE_REGEX.match(value):
+        try:
+            return {'$day': (datetime.date.fromisoformat(value) - today).days}
+        except ValueError:
+            return {'$str': len(value)}
+    elif isinstance(value, str) and not _PERIOD_REGEX.match(value):
+        return {'$str': len(value)}
+
+    return value
+
+
+def start_capture():
+    """
+    Start timing the current request, if it is captured.
+
+    A `CAPTURE_SAMPLE_RATE` fraction of requests is captured once the config's `CAPTURE_PATH` is
+    set.
+    """
+
+    if (current_app.config['CAPTURE_PATH'] and request.url_rule is not None
+            and random.random() < current_app.config['CAPTURE_SAMPLE_RATE']):
+        g.capture_start = time.perf_counter()
+
+
+def record_status(response: Response) -> Response:
+    """
+    Remember the status code of the current request's response, if it is captured.
+
+    Args:
+        response: The response to the request.
+
+    Returns:
+        The response.
+    """
+
+    if 'capture_start' in g:
+        g.capture_status = response.status_code
+
+    return response
+
+
+def write_capture(e: Exception = None):
+    """
+    Append the shape of the current request to the config's `CAPTURE_PATH`, if it is captured.
+
+    Every line of the capture is a JSON object with the request's start time, method, endpoint,
+    view arguments, and body shape (see `anonymize`), the user as a pseudonym that is only stable
+    for the same `SECRET_KEY`, and the response's status code and duration in seconds. Bodies of
+    the `/auth` routes, which hold credentials, are never recorded.
+
+    Args:
+        e (Exception, optional): The exception that occurred, if any.
+    """
+
+    start = g.pop('capture_start', None)
+
+    if start is None:
+        return
+
+    duration = time.perf_counter() - start
+    endpoint = request.endpoint
+    today = datetime.date.today()
+    user = None
+
+    if g.get('user_id') is not None:
+        user = hmac.new(current_app.config['SECRET_KEY'].encode(), str(g.user_id).encode(),
+                        hashlib.sha256).hexdigest()[:12]
+
+    body = None
+
+    if not endpoint.startswith('auth.'):
+        body = anonymize(request.get_json(silent=True), endpoint, today)
+
+    record = {
+        'time': round(time.time() - duration, 3),
+        'method': request.method,
+        'endpoint': endpoint,
+        'view_args': anonymize(request.view_args or {}, endpoint, today),
+        'body': body,
+        'user': user,
+        'status': g.pop('capture_status', 500),
+        'duration': round(duration, 6),
+    }
+
+    try:
+        with _lock, open(current_app.config['CAPTURE_PATH'], 'a') as file:
+            file.write(json.dumps(record, separators=(',', ':')) + '\n')
+    except OSError:
+        current_app.logger.warning('Unable to write the request capture', exc_info=True)
+
+
+def init_app(app: Flask):
+    """
+    Initialize the Flask application.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+
+    app.before_request(start_capture)
+    app.after_request(record_status)
+    app.teardown_request(write_capture)
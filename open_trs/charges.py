@@ -1,28 +1,87 @@
+import calendar
 import datetime
-import sqlite3
-from typing import List, Tuple
+import re
+from typing import List, Optional, Tuple
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, current_app, jsonify, request
 
+import open_trs.analytics
+import open_trs.backends
+import open_trs.coalesce
 import open_trs.db
+import open_trs.events
 import open_trs.auth
-
+import open_trs.idempotency
+import open_trs.partitions
+import open_trs.reporting
+
+
+_TIMESHEET_MAX_DAYS = 366
+_STATS_MAX_DAYS = 20 * 366
+_PERIOD_COLUMNS = {'day': 'date', 'week': 'iso_week', 'month': 'month', 'quarter': 'quarter',
+                   'year': 'year'}
+_WEEK_REGEX = re.compile(r'^(\d{4})-W(\d{2})$')
+_MONTH_REGEX = re.compile(r'^(\d{4})-(\d{2})$')
+_QUARTER_REGEX = re.compile(r'^(\d{4})-Q([1-4])$')
+
+# How `create_charges` resolves charges for a project and date that is already charged
+_CONFLICT_CLAUSES = {
+    'reject': '',
+    'skip': ' ON CONFLICT (user, project, date_charged) DO NOTHING',
+    'replace': ' ON CONFLICT (user, project, date_charged) DO UPDATE SET hours = excluded.hours',
+    'add_hours': ' ON CONFLICT (user, project, date_charged)'
+                 ' DO UPDATE SET hours = Charges.hours + excluded.hours',
+}
+# Comparisons accepted by the `hours` predicate of bulk operations
+_HOURS_OPERATORS = {'eq': '=', 'ne': '!=', 'lt': '<', 'lte': '<=', 'gt': '>', 'gte': '>='}
+# Charges of deleted projects stay hidden while they are purged; takes the user's ID
+_NOT_DELETED = 'project NOT IN (SELECT id FROM Projects WHERE owner = ? AND deleted IS NOT NULL)'
+# Rows per INSERT statement, bounding the parameters of backends binding each value separately
+_INSERT_CHUNK_SIZE = 200
+# Charges shifted by a bulk update are parked this many days before their day, far from any real
+# day, so that they cannot collide with each other on the way
+_SHIFT_PARKING_OFFSET = 1 << 30
+# Day numbers of the first and last dates charges can be moved to
+_MIN_DAY = open_trs.db.date_to_day(datetime.date.min)
+_MAX_DAY = open_trs.db.date_to_day(datetime.date.max)
 
 bp = Blueprint('charges', __name__, url_prefix='/charges')
 
 
-def _validate_and_filter_charges(charges: List[dict]) -> Tuple[set, set]:
+def _parse_day(date_charged: str) -> int:
+    """
+    Parse an ISO formatted date from an incoming request into a day number.
+
+    Args:
+        date_charged: The ISO formatted date.
+
+    Returns:
+        The number of days since the epoch.
+    """
+
+    try:
+        return open_trs.db.date_to_day(datetime.date.fromisoformat(date_charged))
+    except (TypeError, ValueError):
+        raise open_trs.InvalidUsage('Invalid date format, use YYYY-MM-DD', 400)
+
+
+def _validate_and_filter_charges(charges: List[dict], mode: str = 'reject') -> Tuple[dict, set]:
     """
     Validate charges from an incoming request and filter them so that all are unique.
 
+    Charges for the same project and date are combined according to `mode`: identical charges are
+    always merged, `skip` keeps the first, `replace` keeps the last, `add_hours` sums the hours, and
+    `reject` refuses differing charges.
+
     Args:
         charges: List of charges.
+        mode (str, optional): The create mode; defaults to "reject".
 
     Returns:
-        A tuple containing unique charges and unique projects.
+        A tuple containing the hours of each unique `(project, date_charged)` and unique projects.
     """
 
-    unique_charges = set()
+    unique_charges = {}
     unique_projects = set()
 
     # Validate charges and filter out duplicates
@@ -38,26 +97,147 @@ def _validate_and_filter_charges(charges: List[dict]) -> Tuple[set, set]:
         elif not project_id or not isinstance(project_id, int):
             raise open_trs.InvalidUsage('Project required', 400)
 
-        try:
-            date_charged = datetime.date.fromisoformat(date_charged)
-        except ValueError:
-            raise open_trs.InvalidUsage('Invalid date format, use YYYY-MM-DD', 400)
-
-        unique_charges.add((hours, project_id, date_charged))
+        date_charged = _parse_day(date_charged)
+        key = (project_id, date_charged)
         unique_projects.add(project_id)
 
-    # Check that charges don't already exist
-    query = 'SELECT id FROM Charges WHERE (project, date_charged) IN ' \
-            f'({",".join(["(?,?)"] * len(unique_charges))})'
-    data = tuple([element for charge in unique_charges for element in charge[1:]])
-
-    if open_trs.db.get_db().execute(query, data).fetchone() is not None:
-        raise open_trs.InvalidUsage('Project already charged for this date', 400)
+        if key not in unique_charges or mode == 'replace':
+            unique_charges[key] = hours
+        elif mode == 'add_hours':
+            unique_charges[key] += hours
+        elif mode == 'reject' and unique_charges[key] != hours:
+            raise open_trs.InvalidUsage('Project already charged for this date', 400)
 
     return unique_charges, unique_projects
 
 
-def _validate_and_get_projects(db: sqlite3.Connection, user_id: int,
+def _charge_to_dict(charge: open_trs.backends.Row) -> dict:
+    """
+    Convert a charge row to its API representation.
+
+    Args:
+        charge: A row from the Charges table.
+
+    Returns:
+        A dictionary of the charge with `date_charged` as an ISO formatted date.
+    """
+
+    charge = dict(charge)
+    charge['date_charged'] = open_trs.db.day_to_iso(charge['date_charged'])
+
+    return charge
+
+
+def _parse_date_range(date_range: dict) -> Tuple[datetime.date, datetime.date]:
+    """
+    Parse and validate a `date_range` object from an incoming request.
+
+    Args:
+        date_range: Dictionary containing ISO formatted `start` and `end` dates.
+
+    Returns:
+        A tuple containing the start and end dates.
+    """
+
+    if not isinstance(date_range, dict):
+        raise open_trs.InvalidUsage('Date range must be an object with start and end dates', 400)
+
+    start = date_range.get('start')
+    end = date_range.get('end')
+
+    if start is None:
+        raise open_trs.InvalidUsage('Start date required', 400)
+    elif end is None:
+        raise open_trs.InvalidUsage('End date required', 400)
+
+    try:
+        start = datetime.date.fromisoformat(start)
+        end = datetime.date.fromisoformat(end)
+    except (TypeError, ValueError):
+        raise open_trs.InvalidUsage('Invalid date format, use YYYY-MM-DD', 400)
+
+    if start > end:
+        raise open_trs.InvalidUsage('End date must be after start date', 400)
+
+    return start, end
+
+
+def _parse_period(period: dict) -> Tuple[datetime.date, datetime.date]:
+    """
+    Resolve a calendar `period` object from an incoming request into a date range.
+
+    Exactly one of the following keys is expected: `week` (ISO week, e.g. "2024-W06"), `month`
+    (e.g. "2024-02"), `quarter` (e.g. "2024-Q1"), `year` (e.g. 2024), or `last_days` (a rolling
+    number of days ending today).
+
+    Args:
+        period: Dictionary describing the period.
+
+    Returns:
+        A tuple containing the first and last dates of the period.
+    """
+
+    if not isinstance(period, dict) or len(period) != 1:
+        raise open_trs.InvalidUsage('Period must specify exactly one of week, month, quarter,'
+                                    ' year, or last_days', 400)
+
+    kind, value = next(iter(period.items()))
+
+    try:
+        if kind == 'week':
+            year, week = _WEEK_REGEX.match(value).groups()
+            start = datetime.date.fromisocalendar(int(year), int(week), 1)
+            end = start + datetime.timedelta(days=6)
+        elif kind == 'month':
+            year, month = (int(group) for group in _MONTH_REGEX.match(value).groups())
+            start = datetime.date(year, month, 1)
+            end = datetime.date(year, month, calendar.monthrange(year, month)[1])
+        elif kind == 'quarter':
+            year, quarter = (int(group) for group in _QUARTER_REGEX.match(value).groups())
+            start = datetime.date(year, 3 * quarter - 2, 1)
+            end = datetime.date(year, 3 * quarter, calendar.monthrange(year, 3 * quarter)[1])
+        elif kind == 'year':
+            start = datetime.date(int(value), 1, 1)
+            end = datetime.date(int(value), 12, 31)
+        elif kind == 'last_days':
+            if not isinstance(value, int) or isinstance(value, bool) or value <= 0:
+                raise ValueError
+
+            end = datetime.date.today()
+            start = end - datetime.timedelta(days=value - 1)
+        else:
+            raise open_trs.InvalidUsage(f'Unknown period "{kind}"', 400)
+    except (AttributeError, TypeError, ValueError, OverflowError):
+        raise open_trs.InvalidUsage(f'Invalid {kind} period', 400)
+
+    return start, end
+
+
+def _parse_date_filter(request_json: dict) -> Tuple[datetime.date, datetime.date]:
+    """
+    Parse the optional `date_range` or `period` filter from an incoming request.
+
+    Args:
+        request_json: The request's JSON body.
+
+    Returns:
+        A tuple containing the start and end dates, or `(None, None)` if no filter was provided.
+    """
+
+    date_range = request_json.get('date_range')
+    period = request_json.get('period')
+
+    if date_range is not None and period is not None:
+        raise open_trs.InvalidUsage('Specify either a date range or a period, not both', 400)
+    elif date_range is not None:
+        return _parse_date_range(date_range)
+    elif period is not None:
+        return _parse_period(period)
+
+    return None, None
+
+
+def _validate_and_get_projects(db: open_trs.backends.Connection, user_id: int,
                                project_ids: List[int]) -> List[dict]:
     """
     Get projects from the database and validate that all exist and are owned by the provided user.
@@ -71,9 +251,9 @@ def _validate_and_get_projects(db: sqlite3.Connection, user_id: int,
         A list of project dictionaries.
     """
 
-    projects = db.execute(
-        f'SELECT owner FROM Projects WHERE id IN ({",".join("?" * len(project_ids))})',
-        (*project_ids,)).fetchall()
+    ids_sql, ids_parameters = open_trs.db.bind_values(db, project_ids)
+    projects = db.execute(f'SELECT owner FROM Projects WHERE id IN {ids_sql} AND deleted IS NULL',
+                          ids_parameters).fetchall()
 
     if len(projects) != len(project_ids):
         raise open_trs.InvalidUsage('Project not found', 404)
@@ -85,8 +265,85 @@ def _validate_and_get_projects(db: sqlite3.Connection, user_id: int,
     return [dict(project) for project in projects]
 
 
+def _build_charge_filter(user_id: int, charge_filter: dict) -> Tuple[str, list]:
+    """
+    Build the `WHERE` clause selecting the user's charges that match a bulk operation's filter.
+
+    The filter may contain a `project` ID, a `date_range` or calendar `period`, and an `hours`
+    predicate such as `{"gte": 8}`. Every clause starts with the user and date, so the statement
+    is served by the `(user, date_charged)` index.
+
+    Args:
+        user_id: The user's ID.
+        charge_filter: The filter from the incoming request.
+
+    Returns:
+        A tuple containing the `WHERE` clause and its parameters.
+    """
+
+    if not charge_filter:
+        raise open_trs.InvalidUsage('Filter required', 400)
+
+    clauses = ['user = ?', _NOT_DELETED]
+    parameters = [user_id, user_id]
+
+    start, end = _parse_date_filter(charge_filter)
+
+    if start is not None:
+        clauses.append('date_charged BETWEEN ? AND ?')
+        parameters.extend((open_trs.db.date_to_day(start), open_trs.db.date_to_day(end)))
+
+    if 'project' in charge_filter:
+        project_id = charge_filter['project']
+
+        if not project_id or not isinstance(project_id, int):
+            raise open_trs.InvalidUsage('Project required', 400)
+
+        clauses.append('project = ?')
+        parameters.append(project_id)
+
+    hours_filter = charge_filter.get('hours', {})
+
+    if not isinstance(hours_filter, dict):
+        raise open_trs.InvalidUsage('Invalid hours filter', 400)
+
+    for operator, value in hours_filter.items():
+        if operator not in _HOURS_OPERATORS:
+            raise open_trs.InvalidUsage(
+                f'Invalid hours operator, use one of {", ".join(_HOURS_OPERATORS)}', 400)
+        elif not isinstance(value, int):
+            raise open_trs.InvalidUsage('Invalid hours filter', 400)
+
+        clauses.append(f'hours {_HOURS_OPERATORS[operator]} ?')
+        parameters.append(value)
+
+    if len(clauses) == 2:
+        raise open_trs.InvalidUsage('Filter required', 400)
+
+    return ' AND '.join(clauses), parameters
+
+
+def _count_matching_charges(db: open_trs.backends.Connection, where: str, parameters: list):
+    """
+    Answer a bulk operation's dry run by counting the charges it would affect.
+
+    Args:
+        db: The database connection.
+        where: The `WHERE` clause selecting the charges.
+        parameters: The clause's parameters.
+
+    Returns:
+        A JSON response containing the number of matching charges.
+    """
+
+    count = db.execute(f'SELECT COUNT(*) FROM Charges WHERE {where}', parameters).fetchone()[0]
+
+    return jsonify({'message': f'{count} charges match', 'count': count}), 200
+
+
 @bp.route('/', methods=['GET'])
 @open_trs.auth.login_required
+@open_trs.coalesce.coalesced
 def get_charges(user_id: int):
     """
     Get the user's charges.
@@ -95,91 +352,293 @@ def get_charges(user_id: int):
         user_id: The user's ID.
 
     Returns:
-        A JSON response containing the user's charges within a specified `date_range`. If a `date_range` is not
-        specified, all charges are returned.
+        A JSON response containing the user's charges within a specified `date_range` or calendar
+        `period`, including those of archived years. If neither is specified, all charges are
+        returned.
+    """
+
+    start, end = _parse_date_filter(request.get_json())
+
+    db = open_trs.db.get_db()
+
+    if start is None and end is None:
+        source = open_trs.partitions.get_charges_source(db, user_id=user_id)
+        charges = db.execute(f'SELECT * FROM {source} WHERE user = ? AND {_NOT_DELETED}'
+                             ' ORDER BY date_charged, id', (user_id, user_id)).fetchall()
+    else:
+        start_day, end_day = open_trs.db.date_to_day(start), open_trs.db.date_to_day(end)
+        source = open_trs.partitions.get_charges_source(db, start_day, end_day)
+        charges = db.execute(f'SELECT * FROM {source} WHERE user = ?'
+                             f' AND date_charged BETWEEN ? AND ? AND {_NOT_DELETED}'
+                             ' ORDER BY date_charged, id',
+                             (user_id, start_day, end_day, user_id)).fetchall()
+
+    charges = [_charge_to_dict(charge) for charge in charges]
+
+    return jsonify({'charges': charges}), 200
+
+
+@bp.route('/timesheet', methods=['GET'])
+@open_trs.auth.login_required
+@open_trs.coalesce.coalesced
+def get_timesheet(user_id: int):
+    """
+    Get the user's charges as a dense projects by days matrix.
+
+    Every project owned by the user is a row and every day in the requested `date_range` is a
+    column, so clients can render a timesheet grid without fetching projects and charges
+    separately and pivoting them.
+
+    Args:
+        user_id: The user's ID.
+
+    Returns:
+        A JSON response for the requested `date_range` or calendar `period` containing the user's
+        projects, an `hours` matrix with one row per project and one column per day starting at
+        `start`, the row, column, and grand totals, and `as_of`, the time of the reporting
+        snapshot read (see `open_trs.reporting`) or null if the live database was read.
+    """
+
+    start, end = _parse_date_filter(request.get_json())
+
+    if start is None:
+        raise open_trs.InvalidUsage('Date range required', 400)
+
+    num_days = (end - start).days + 1
+    start_day = open_trs.db.date_to_day(start)
+
+    if num_days > _TIMESHEET_MAX_DAYS:
+        raise open_trs.InvalidUsage(f'Date range cannot exceed {_TIMESHEET_MAX_DAYS} days', 400)
+
+    db, as_of = open_trs.reporting.get_reporting_db()
+    end_day = start_day + num_days - 1
+    source = open_trs.partitions.get_charges_source(db, start_day, end_day)
+
+    # A single grouped query; projects without charges in the range still produce one row
+    rows = db.execute(
+        'SELECT Projects.id AS project, Projects.name AS name,'
+        '  Charges.date_charged AS date_charged, SUM(Charges.hours) AS hours'
+        f' FROM Projects LEFT JOIN {source}'
+        '  ON Charges.project = Projects.id AND Charges.user = ?'
+        '  AND Charges.date_charged BETWEEN ? AND ?'
+        ' WHERE Projects.owner = ? AND Projects.deleted IS NULL'
+        ' GROUP BY Projects.id, Charges.date_charged'
+        ' ORDER BY Projects.id, Charges.date_charged',
+        (user_id, start_day, end_day, user_id)).fetchall()
+
+    projects = []
+    hours = []
+    day_totals = [0] * num_days
+
+    for row in rows:
+        if not projects or projects[-1]['id'] != row['project']:
+            projects.append({'id': row['project'], 'name': row['name']})
+            hours.append([0] * num_days)
+
+        if row['date_charged'] is not None:
+            day = row['date_charged'] - start_day
+            hours[-1][day] = row['hours']
+            day_totals[day] += row['hours']
+
+    project_totals = [sum(project_hours) for project_hours in hours]
+
+    return jsonify({'start': str(start),
+                    'end': str(end),
+                    'projects': projects,
+                    'hours': hours,
+                    'project_totals': project_totals,
+                    'day_totals': day_totals,
+                    'total': sum(project_totals),
+                    'as_of': as_of}), 200
+
+
+@bp.route('/summary', methods=['GET'])
+@open_trs.auth.login_required
+@open_trs.coalesce.coalesced
+def get_summary(user_id: int):
+    """
+    Get the user's hours per project grouped by calendar period.
+
+    Args:
+        user_id: The user's ID.
+
+    Returns:
+        A JSON response containing the total hours per `group_by` period (day, week, month, quarter,
+        or year) and project, optionally limited to a `date_range` or calendar `period`, and
+        `as_of`, the time of the reporting snapshot read or null if the live database was read.
     """
 
     request_json = request.get_json()
-    date_range = request_json.get('date_range')
+    group_by = request_json.get('group_by', 'month')
 
-    start, end = None, None
+    if not isinstance(group_by, str) or group_by not in _PERIOD_COLUMNS:
+        raise open_trs.InvalidUsage(f'Invalid group_by, use one of {", ".join(_PERIOD_COLUMNS)}',
+                                    400)
 
-    if date_range is not None:
-        start = date_range.get('start')
-        end = date_range.get('end')
+    start, end = _parse_date_filter(request_json)
 
-        if start is None:
-            raise open_trs.InvalidUsage('Start date required', 400)
-        elif end is None:
-            raise open_trs.InvalidUsage('End date required', 400)
+    db, as_of = open_trs.reporting.get_reporting_db()
 
-        try:
-            start = datetime.date.fromisoformat(start)
-            end = datetime.date.fromisoformat(end)
-        except ValueError:
-            raise open_trs.InvalidUsage('Invalid date format, use YYYY-MM-DD', 400)
+    if start is None:
+        source = open_trs.partitions.get_charges_source(db, user_id=user_id)
+        start_day, end_day = db.execute('SELECT MIN(date_charged), MAX(date_charged)'
+                                        f' FROM {source} WHERE user = ? AND {_NOT_DELETED}',
+                                        (user_id, user_id)).fetchone()
 
-        if start > end:
-            raise open_trs.InvalidUsage('End date must be after start date', 400)
+        if start_day is None:
+            return jsonify({'group_by': group_by, 'summary': [], 'as_of': as_of}), 200
+    else:
+        start_day, end_day = open_trs.db.date_to_day(start), open_trs.db.date_to_day(end)
 
-    db = open_trs.db.get_db()
+    years = open_trs.db.day_to_date(start_day).year, open_trs.db.day_to_date(end_day).year
+    max_years = current_app.config['CALENDAR_MAX_YEARS']
 
-    if start is None and end is None:
-        charges = db.execute('SELECT * FROM Charges WHERE user = ? ORDER BY date_charged, id',
-                             (user_id,)).fetchall()
+    # Every year summarized is added to the calendar first, which takes a while per year
+    if years[1] - years[0] >= max_years:
+        raise open_trs.InvalidUsage(f'Summary cannot span more than {max_years} years, specify a'
+                                    ' shorter date range or period', 400)
+
+    if as_of is None:
+        open_trs.db.populate_calendar(db, *years)
+    elif open_trs.db.get_missing_calendar_years(db, *years):
+        # The read-only snapshot cannot be extended, so years it lacks are summarized live
+        db, as_of = open_trs.db.get_db(), None
+        open_trs.db.populate_calendar(db, *years)
+
+    column = _PERIOD_COLUMNS[group_by]
+
+    # The range found in the user's charges covers every archived year they charged, however many
+    if start is None:
+        source = open_trs.partitions.get_charges_source(db, user_id=user_id)
     else:
-        charges = db.execute('SELECT * FROM Charges WHERE user = ? AND date_charged BETWEEN ? AND ?'
-                             ' ORDER BY date_charged, id',
-                             (user_id, start, end)).fetchall()
+        source = open_trs.partitions.get_charges_source(db, start_day, end_day)
+    rows = db.execute(
+        f'SELECT Calendar.{column} AS period, Charges.project AS project,'
+        '  SUM(Charges.hours) AS hours'
+        f' FROM {source} JOIN Calendar ON Calendar.day = Charges.date_charged'
+        ' WHERE Charges.user = ? AND Charges.date_charged BETWEEN ? AND ?'
+        f' AND {_NOT_DELETED}'
+        f' GROUP BY Calendar.{column}, Charges.project'
+        ' ORDER BY period, project',
+        (user_id, start_day, end_day, user_id)).fetchall()
 
-    charges = [dict(charge) for charge in charges]
+    summary = [dict(row) for row in rows]
 
-    for charge in charges:
-        charge['date_charged'] = str(charge['date_charged'])
+    for row in summary:
+        row['period'] = str(row['period'])
 
-    return jsonify({'charges': charges}), 200
+    return jsonify({'group_by': group_by, 'summary': summary, 'as_of': as_of}), 200
+
+
+@bp.route('/stats', methods=['GET'])
+@open_trs.auth.login_required
+@open_trs.coalesce.coalesced
+def get_stats(user_id: int):
+    """
+    Get statistics and trends of the user's hours per day, per project and for all projects.
+
+    The user's charges are loaded once into column arrays and kept until their data changes, so
+    repeated requests, e.g. for other ranges or windows, only compute; see `open_trs.analytics`.
+
+    Args:
+        user_id: The user's ID.
+
+    Returns:
+        A JSON response for the requested `date_range` or calendar `period`, by default the days
+        from the user's first to last charge, containing its `start` and `end`, the rolling average
+        `window` in days (`window` in the request, by default `ANALYTICS_WINDOW`), the start dates
+        of its `weeks`, and the `stats` described by `open_trs.analytics.compute_stats`.
+    """
+
+    request_json = request.get_json()
+    window = request_json.get('window', current_app.config['ANALYTICS_WINDOW'])
+
+    if type(window) is not int or not 1 <= window <= _TIMESHEET_MAX_DAYS:
+        raise open_trs.InvalidUsage(f'Window must be from 1 to {_TIMESHEET_MAX_DAYS} days', 400)
+
+    start, end = _parse_date_filter(request_json)
+
+    columns = open_trs.analytics.get_columns(open_trs.db.get_db(), user_id)
+
+    if start is not None:
+        start_day, end_day = open_trs.db.date_to_day(start), open_trs.db.date_to_day(end)
+    elif len(columns.days):
+        start_day, end_day = int(columns.days[0]), int(columns.days[-1])
+    else:
+        return jsonify({'start': None, 'end': None, 'window': window, 'weeks': [],
+                        'stats': []}), 200
+
+    if end_day - start_day + 1 > _STATS_MAX_DAYS:
+        raise open_trs.InvalidUsage(f'Date range cannot exceed {_STATS_MAX_DAYS} days', 400)
+
+    stats = open_trs.analytics.compute_stats(columns, start_day, end_day, window)
+
+    return jsonify({'start': str(open_trs.db.day_to_date(start_day)),
+                    'end': str(open_trs.db.day_to_date(end_day)),
+                    'window': window,
+                    **stats}), 200
 
 
 @bp.route('/create', methods=['POST'])
 @open_trs.auth.login_required
+@open_trs.idempotency.idempotent
 def create_charges(user_id: int):
     """
     Create new charges.
 
+    The optional `mode` decides what happens to charges for a project and date that is already
+    charged: `reject` (the default) fails the whole request, `skip` leaves the existing charge,
+    `replace` overwrites its hours, and `add_hours` adds to them. Each chunk of charges is written
+    by a single `INSERT ... ON CONFLICT` statement, so concurrent submissions cannot create
+    duplicates.
+
     Args:
         user_id: The user's ID.
 
     Returns:
-        A JSON response containing the newly created charges.
+        A JSON response containing the newly created or updated charges.
     """
 
     request_json = request.get_json()
     new_charges = request_json.get('charges')
+    mode = request_json.get('mode', 'reject')
 
     if not new_charges:
         raise open_trs.InvalidUsage('No charges provided', 400)
+    elif not isinstance(mode, str) or mode not in _CONFLICT_CLAUSES:
+        raise open_trs.InvalidUsage(f'Invalid mode, use one of {", ".join(_CONFLICT_CLAUSES)}',
+                                    400)
 
     db = open_trs.db.get_db()
 
-    unique_charges, unique_projects = _validate_and_filter_charges(new_charges)
+    unique_charges, unique_projects = _validate_and_filter_charges(new_charges, mode)
     _validate_and_get_projects(db, user_id, list(unique_projects))
+    open_trs.partitions.check_not_archived(
+        db, (open_trs.db.day_to_date(day).year for _, day in unique_charges))
 
     charge_data = [(hours, project_id, date_charged, user_id)
-                   for hours, project_id, date_charged in unique_charges]
-    db.executemany(
-        'INSERT INTO Charges (hours, project, date_charged, user)'
-        ' VALUES (?, ?, ?, ?)', charge_data)
-    db.commit()
+                   for (project_id, date_charged), hours in unique_charges.items()]
+    inserted_charges = []
+
+    try:
+        for i in range(0, len(charge_data), _INSERT_CHUNK_SIZE):
+            rows_sql, rows_parameters = open_trs.db.bind_rows(
+                db, charge_data[i:i + _INSERT_CHUNK_SIZE], 4)
+            inserted_charges.extend(db.execute(
+                f'INSERT INTO Charges (hours, project, date_charged, user) {rows_sql}'
+                f'{_CONFLICT_CLAUSES[mode]} RETURNING *', rows_parameters).fetchall())
+    except db.IntegrityError:
+        db.rollback()
+        raise open_trs.InvalidUsage('Project already charged for this date', 400)
 
-    inserted_charges = db.execute(
-        'SELECT * FROM Charges'
-        f' WHERE (hours, project, date_charged, user) IN ({",".join(["(?,?,?,?)"] * len(charge_data))})'
-        '  ORDER BY date_charged, id',
-        tuple([element for data in charge_data for element in data])).fetchall()
-    inserted_charges = [dict(charge) for charge in inserted_charges]
+    if inserted_charges:
+        open_trs.events.publish(db, user_id, 'charges', {
+            'action': 'created', 'ids': sorted(charge['id'] for charge in inserted_charges)})
 
-    for charge in inserted_charges:
-        charge['date_charged'] = str(charge['date_charged'])
+    db.commit()
+
+    inserted_charges = sorted((_charge_to_dict(charge) for charge in inserted_charges),
+                              key=lambda charge: (charge['date_charged'], charge['id']))
 
     return jsonify({'message': f'Successfully inserted {len(inserted_charges)} charges',
                     'charges': inserted_charges}), 201
@@ -189,7 +648,7 @@ def create_charges(user_id: int):
 @open_trs.auth.login_required
 def update_charges(user_id: int):
     """
-    Update charges.
+    Update the hours, project, or date of charges.
 
     Args:
         user_id: The user's ID.
@@ -207,22 +666,36 @@ def update_charges(user_id: int):
     db = open_trs.db.get_db()
 
     unique_charges = {}
+    unique_projects = set()
 
     for charge in updated_charges:
         charge_id = charge.get('id')
         hours = charge.get('hours')
+        project_id = charge.get('project')
+        date_charged = charge.get('date_charged')
 
-        if hours is None or not isinstance(hours, int):
-            raise open_trs.InvalidUsage('Hours required', 400)
-        elif hours <= 0:
-            raise open_trs.InvalidUsage('Hours must be greater than 0', 400)
+        # Hours may be left out only when the charge is moved to another project or date
+        if 'hours' in charge or ('project' not in charge and 'date_charged' not in charge):
+            if hours is None or not isinstance(hours, int):
+                raise open_trs.InvalidUsage('Hours required', 400)
+            elif hours <= 0:
+                raise open_trs.InvalidUsage('Hours must be greater than 0', 400)
+
+        if 'project' in charge:
+            if not project_id or not isinstance(project_id, int):
+                raise open_trs.InvalidUsage('Project required', 400)
+
+            unique_projects.add(project_id)
+
+        if 'date_charged' in charge:
+            date_charged = _parse_day(date_charged)
 
-        unique_charges[charge_id] = hours
+        unique_charges[charge_id] = (hours, project_id, date_charged)
 
     # Check that charges exist and are owned by the user
-    query = f'SELECT id, user FROM Charges WHERE id IN ({",".join("?" * len(unique_charges))})'
-    data = (*unique_charges.keys(),)
-    charges = db.execute(query, data).fetchall()
+    ids_sql, ids_parameters = open_trs.db.bind_values(db, list(unique_charges))
+    charges = db.execute(f'SELECT id, user FROM Charges WHERE id IN {ids_sql} AND {_NOT_DELETED}',
+                         (*ids_parameters, user_id)).fetchall()
 
     if len(charges) != len(unique_charges):
         raise open_trs.InvalidUsage('Charge not found', 404)
@@ -231,23 +704,192 @@ def update_charges(user_id: int):
         if charge['user'] != user_id:
             raise open_trs.InvalidUsage('Forbidden', 403)
 
-    charge_data = [(hours, user_id, charge_id) for charge_id, hours in unique_charges.items()]
-    db.executemany('UPDATE Charges SET hours = ? WHERE user = ? AND id= ?', charge_data)
-    db.commit()
+    if unique_projects:
+        _validate_and_get_projects(db, user_id, list(unique_projects))
 
-    updated_charges = db.execute(
-        f'SELECT * FROM Charges WHERE id IN ({", ".join("?" * len(unique_charges))})'
-        ' ORDER BY date_charged, id',
-        tuple(unique_charges.keys())).fetchall()
-    updated_charges = [dict(charge) for charge in updated_charges]
+    open_trs.partitions.check_not_archived(
+        db, (open_trs.db.day_to_date(date_charged).year
+             for _, _, date_charged in unique_charges.values() if date_charged is not None))
 
-    for charge in updated_charges:
-        charge['date_charged'] = str(charge['date_charged'])
+    updated_charges = []
+
+    try:
+        for charge_id, (hours, project_id, date_charged) in unique_charges.items():
+            updated_charges.append(db.execute(
+                'UPDATE Charges SET hours = COALESCE(?, hours), project = COALESCE(?, project),'
+                ' date_charged = COALESCE(?, date_charged) WHERE user = ? AND id = ? RETURNING *',
+                (hours, project_id, date_charged, user_id, charge_id)).fetchone())
+    except db.IntegrityError:
+        db.rollback()
+        raise open_trs.InvalidUsage('Project already charged for this date', 400)
+
+    open_trs.events.publish(db, user_id, 'charges',
+                            {'action': 'updated', 'ids': sorted(unique_charges)})
+    db.commit()
+
+    updated_charges = sorted((_charge_to_dict(charge) for charge in updated_charges),
+                             key=lambda charge: (charge['date_charged'], charge['id']))
 
     return jsonify({'message': f'Successfully updated {len(updated_charges)} charges',
                     'charges': updated_charges}), 200
 
 
+def _shift_charges(db: open_trs.backends.Connection, user_id: int, where: str, parameters: list,
+                   assignments: List[str], assignment_parameters: list,
+                   project_id: Optional[int]) -> int:
+    """
+    Apply a bulk update that shifts the matching charges by a number of days.
+
+    The unique index on user, project and day is checked row by row, so a single `UPDATE` would
+    move a charge onto the next day of a run of consecutive days before that one has moved on.
+    Instead, the shifted charges are checked against the charges left in place, then parked on
+    days far before any real one and moved from there to their final days.
+
+    Args:
+        db: The database connection.
+        user_id: The user's ID.
+        where: The filter's `WHERE` clause, see `_build_charge_filter`.
+        parameters: The filter's parameters.
+        assignments: The `SET` assignments, the last of which shifts `date_charged`.
+        assignment_parameters: The assignments' parameters, the last of which is the shift.
+        project_id: The project the charges are moved to, or None if they stay in theirs.
+
+    Returns:
+        The number of updated charges.
+    """
+
+    shift_days = assignment_parameters[-1]
+    conflict = db.execute(
+        'SELECT 1 FROM Charges AS Moved JOIN Charges AS Other ON Other.user = Moved.user'
+        '  AND Other.project = COALESCE(?, Moved.project)'
+        '  AND Other.date_charged = Moved.date_charged + ?'
+        f' WHERE Moved.id IN (SELECT id FROM Charges WHERE {where})'
+        f' AND Other.id NOT IN (SELECT id FROM Charges WHERE {where}) LIMIT 1',
+        (project_id, shift_days, *parameters, *parameters)).fetchone()
+
+    if conflict is not None:
+        raise open_trs.InvalidUsage('Project already charged for this date', 400)
+
+    # Parking keeps the charges' order, so they cannot collide with each other either
+    count = db.execute(f'UPDATE Charges SET date_charged = date_charged - ? WHERE {where}',
+                       (_SHIFT_PARKING_OFFSET, *parameters)).rowcount
+    db.execute(f'UPDATE Charges SET {", ".join(assignments)} WHERE user = ? AND date_charged < ?',
+               (*assignment_parameters[:-1], shift_days + _SHIFT_PARKING_OFFSET, user_id,
+                -_SHIFT_PARKING_OFFSET // 2))
+
+    return count
+
+
+@bp.route('/bulk_update', methods=['PUT'])
+@open_trs.auth.login_required
+def bulk_update_charges(user_id: int):
+    """
+    Update all of the user's charges matching a filter with a single statement.
+
+    The `set` object may change `hours`, `project`, and either `date_charged` or `shift_days`, which
+    moves every matching charge by that many days. With `dry_run` the matching charges are only
+    counted. Charges of archived years (see `open_trs.partitions`) are read-only and never match.
+
+    Args:
+        user_id: The user's ID.
+
+    Returns:
+        A JSON response containing the number of updated (or matching) charges.
+    """
+
+    request_json = request.get_json()
+    where, parameters = _build_charge_filter(user_id, request_json.get('filter'))
+    changes = request_json.get('set')
+
+    if not changes:
+        raise open_trs.InvalidUsage('No changes provided', 400)
+
+    assignments = []
+    assignment_parameters = []
+
+    if 'hours' in changes:
+        hours = changes['hours']
+
+        if hours is None or not isinstance(hours, int):
+            raise open_trs.InvalidUsage('Hours required', 400)
+        elif hours <= 0:
+            raise open_trs.InvalidUsage('Hours must be greater than 0', 400)
+
+        assignments.append('hours = ?')
+        assignment_parameters.append(hours)
+
+    if 'project' in changes:
+        project_id = changes['project']
+
+        if not project_id or not isinstance(project_id, int):
+            raise open_trs.InvalidUsage('Project required', 400)
+
+        assignments.append('project = ?')
+        assignment_parameters.append(project_id)
+
+    if 'date_charged' in changes and 'shift_days' in changes:
+        raise open_trs.InvalidUsage('Specify either date_charged or shift_days, not both', 400)
+    elif 'date_charged' in changes:
+        assignments.append('date_charged = ?')
+        assignment_parameters.append(_parse_day(changes['date_charged']))
+    elif 'shift_days' in changes:
+        shift_days = changes['shift_days']
+
+        if (not isinstance(shift_days, int) or isinstance(shift_days, bool)
+                or abs(shift_days) > _MAX_DAY - _MIN_DAY):
+            raise open_trs.InvalidUsage('Invalid shift_days, use a number of days', 400)
+
+        assignments.append('date_charged = date_charged + ?')
+        assignment_parameters.append(shift_days)
+
+    if not assignments:
+        raise open_trs.InvalidUsage('No changes provided', 400)
+
+    db = open_trs.db.get_db()
+
+    if 'project' in changes:
+        _validate_and_get_projects(db, user_id, [changes['project']])
+
+    # Charges cannot be moved into archived years
+    if 'date_charged' in changes:
+        open_trs.partitions.check_not_archived(db, [open_trs.db.day_to_date(
+            assignment_parameters[-1]).year])
+    elif 'shift_days' in changes:
+        first_day, last_day = db.execute(
+            f'SELECT MIN(date_charged), MAX(date_charged) FROM Charges WHERE {where}',
+            parameters).fetchone()
+
+        if first_day is not None:
+            if first_day + shift_days < _MIN_DAY or last_day + shift_days > _MAX_DAY:
+                raise open_trs.InvalidUsage('Invalid shift_days, charges would move past the'
+                                            ' supported dates', 400)
+
+            open_trs.partitions.check_not_archived(db, range(
+                open_trs.db.day_to_date(first_day + shift_days).year,
+                open_trs.db.day_to_date(last_day + shift_days).year + 1))
+
+    if request_json.get('dry_run'):
+        return _count_matching_charges(db, where, parameters)
+
+    try:
+        if 'shift_days' in changes:
+            count = _shift_charges(db, user_id, where, parameters, assignments,
+                                   assignment_parameters, changes.get('project'))
+        else:
+            count = db.execute(f'UPDATE Charges SET {", ".join(assignments)} WHERE {where}',
+                               (*assignment_parameters, *parameters)).rowcount
+    except db.IntegrityError:
+        db.rollback()
+        raise open_trs.InvalidUsage('Project already charged for this date', 400)
+
+    if count:
+        open_trs.events.publish(db, user_id, 'charges', {'action': 'updated', 'count': count})
+
+    db.commit()
+
+    return jsonify({'message': f'Successfully updated {count} charges', 'count': count}), 200
+
+
 @bp.route('/delete', methods=['DELETE'])
 @open_trs.auth.login_required
 def delete_charges(user_id: int):
@@ -267,10 +909,9 @@ def delete_charges(user_id: int):
     db = open_trs.db.get_db()
 
     # Check that charges exist and are owned by the user
-    data = (*charge_ids,)
-    charges = db.execute(
-        f'SELECT id, user FROM Charges WHERE id IN ({", ".join("?" * len(charge_ids))})',
-        data).fetchall()
+    ids_sql, ids_parameters = open_trs.db.bind_values(db, charge_ids)
+    charges = db.execute(f'SELECT id, user FROM Charges WHERE id IN {ids_sql} AND {_NOT_DELETED}',
+                         (*ids_parameters, user_id)).fetchall()
 
     if len(charges) != len(charge_ids):
         raise open_trs.InvalidUsage('Charge not found', 404)
@@ -279,7 +920,43 @@ def delete_charges(user_id: int):
         if charge['user'] != user_id:
             raise open_trs.InvalidUsage('Forbidden', 403)
 
-    db.execute(f'DELETE FROM Charges WHERE id IN ({", ".join("?" * len(charge_ids))})', data)
+    db.execute(f'DELETE FROM Charges WHERE id IN {ids_sql}', ids_parameters)
+    open_trs.events.publish(db, user_id, 'charges',
+                            {'action': 'deleted', 'ids': sorted(set(charge_ids))})
     db.commit()
 
     return jsonify({'message': f'Successfully deleted {len(charge_ids)} charges'}), 200
+
+
+@bp.route('/bulk_delete', methods=['DELETE'])
+@open_trs.auth.login_required
+def bulk_delete_charges(user_id: int):
+    """
+    Delete all of the user's charges matching a filter with a single statement.
+
+    With `dry_run` the matching charges are only counted. Charges of archived years are read-only
+    and never match.
+
+    Args:
+        user_id: The user's ID.
+
+    Returns:
+        A JSON response containing the number of deleted (or matching) charges.
+    """
+
+    request_json = request.get_json()
+    where, parameters = _build_charge_filter(user_id, request_json.get('filter'))
+
+    db = open_trs.db.get_db()
+
+    if request_json.get('dry_run'):
+        return _count_matching_charges(db, where, parameters)
+
+    count = db.execute(f'DELETE FROM Charges WHERE {where}', parameters).rowcount
+
+    if count:
+        open_trs.events.publish(db, user_id, 'charges', {'action': 'deleted', 'count': count})
+
+    db.commit()
+
+    return jsonify({'message': f'Successfully deleted {count} charges', 'count': count}), 200
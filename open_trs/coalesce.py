@@ -0,0 +1,124 @@
+import functools
+import json
+import os
+import threading
+
+from flask import current_app, make_response, request
+
+import open_trs.db
+import open_trs.events
+import open_trs.metrics
+
+# Requests being answered by this worker process, keyed by `_get_key`
+_in_flight = {}
+_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """
+    Forget the requests in flight in the parent of a forked child, e.g. a gunicorn worker, whose
+    threads are not running in the child.
+    """
+
+    global _lock
+
+    _in_flight.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class _Flight:
+    """
+    A request being answered, whose response is shared with identical requests arriving meanwhile.
+    """
+
+    def __init__(self):
+        """
+        Initialize a new _Flight.
+        """
+
+        self.done = threading.Event()
+        self.response = None
+
+
+def _get_key(user_id: int, view_args: dict) -> tuple:
+    """
+    Identify a read request by everything its response depends on.
+
+    The user's data version is part of the key, so a request arriving after a change was committed
+    never shares the response of one that may have started before it.
+
+    Args:
+        user_id: The user's ID.
+        view_args: The view's keyword arguments, e.g. a project's ID from the URL.
+
+    Returns:
+        The request's key.
+    """
+
+    body = request.get_json(silent=True)
+
+    return (user_id, request.endpoint, tuple(sorted(view_args.items())),
+            tuple(sorted(request.args.items(multi=True))),
+            json.dumps(body, sort_keys=True, separators=(',', ':')),
+            open_trs.events.get_data_version(open_trs.db.get_db(), user_id))
+
+
+def coalesced(view: callable):
+    """
+    Decorator that answers identical concurrent read requests with a single execution.
+
+    The first request runs the view while identical requests of the same user, arriving before it
+    is done, wait for its response and are answered with a copy instead of querying the database
+    themselves. If the first request fails, or takes longer than the config's `COALESCE_TIMEOUT`
+    seconds, the waiting requests run the view on their own. Disabled unless the config's
+    `COALESCE_READS` is set.
+
+    Must be applied below `open_trs.auth.login_required`, since requests are only shared between
+    the same user's requests, and only to views that do not change data.
+
+    Args:
+        view (callable): The view function to be decorated.
+
+    Returns:
+        callable: The decorated view function.
+    """
+
+    @functools.wraps(view)
+    def wrapped_view(user_id: int, *args, **kwargs):
+        if not current_app.config['COALESCE_READS']:
+            return view(user_id, *args, **kwargs)
+
+        key = _get_key(user_id, kwargs)
+
+        with _lock:
+            flight = _in_flight.get(key)
+            leader = flight is None
+
+            if leader:
+                flight = _in_flight[key] = _Flight()
+
+        if not leader:
+            if flight.done.wait(current_app.config['COALESCE_TIMEOUT']) and flight.response:
+                open_trs.metrics.increment('requests_coalesced', {'endpoint': request.endpoint})
+                body, status, headers = flight.response
+
+                return current_app.response_class(body, status=status, headers=headers)
+
+            return view(user_id, *args, **kwargs)
+
+        try:
+            response = make_response(view(user_id, *args, **kwargs))
+            flight.response = (response.get_data(), response.status_code,
+                               list(response.headers))
+
+            return response
+        finally:
+            with _lock:
+                del _in_flight[key]
+
+            flight.done.set()
+
+    return wrapped_view
@@ -2,22 +2,150 @@ class Config:
     DEBUG = False
     TESTING = False
     JWT_EXPIRATION = 3600
+    # Years added to the Calendar table by init-db, and the most years a summary may span; summaries
+    # of other years add them on first use
+    CALENDAR_YEARS = (2000, 2040)
+    CALENDAR_MAX_YEARS = 100
+    # Mapping of shard names to SQLite paths; users' projects and charges are spread across them
+    DATABASE_SHARDS = {}
+    # Maximum connections per worker process for client-server databases such as PostgreSQL
+    DATABASE_POOL_SIZE = 10
+    # Seconds stored responses are replayed for retries with the same Idempotency-Key header
+    IDEMPOTENCY_KEY_TTL = 86400
+    # Seconds after which a retry takes over a key whose request never finished, e.g. because its
+    # worker was killed; longer than any request may run
+    IDEMPOTENCY_CLAIM_LEASE = 60
+    # Maximum number of idempotency keys remembered per user
+    IDEMPOTENCY_MAX_KEYS = 1000
+    # Charges deleted per transaction when purging a deleted project, and seconds between them
+    PURGE_CHUNK_SIZE = 500
+    PURGE_PAUSE = 0.05
+    # Background jobs: attempts before failing, base retry delay in seconds (doubled per attempt),
+    # seconds a worker may hold a job without reporting progress, and worker poll interval
+    JOBS_MAX_ATTEMPTS = 3
+    JOBS_RETRY_BACKOFF = 30
+    JOBS_LEASE = 300
+    JOBS_POLL_INTERVAL = 1
+    # Mapping of job kinds to the maximum number running at once, overriding their handlers
+    JOBS_CONCURRENCY = {}
+    # Run jobs within the request that queues them instead of in `flask worker`
+    JOBS_EAGER = False
+    # Snapshot directory (defaults to instance/backups), pages copied per backup step and seconds
+    # between steps, seconds between scheduled backups (None to disable), and snapshots kept
+    BACKUP_DIR = None
+    BACKUP_PAGES = 1024
+    BACKUP_PAUSE = 0.005
+    BACKUP_INTERVAL = None
+    BACKUP_KEEP = 7
+    # Serve summaries and timesheets from read-only snapshots in REPORTING_DIR (defaults to
+    # instance/reporting), refreshed every REPORTING_REFRESH_INTERVAL seconds once scheduled
+    REPORTING_SNAPSHOT = False
+    REPORTING_DIR = None
+    REPORTING_REFRESH_INTERVAL = 300
+    # Database maintenance: run PRAGMA optimize when connections close, rows sampled per index by
+    # ANALYZE, pages freed per incremental vacuum, and seconds between scheduled maintenance runs
+    MAINTENANCE_OPTIMIZE_ON_CLOSE = True
+    MAINTENANCE_ANALYSIS_LIMIT = 400
+    MAINTENANCE_VACUUM_PAGES = 1000
+    MAINTENANCE_INTERVAL = 3600
+    # Charges of years before the newest PARTITIONS_HOT_YEARS are moved by `flask archive-charges`
+    # to per-year files in PARTITIONS_DIR (defaults to instance/partitions)
+    PARTITIONS_DIR = None
+    PARTITIONS_HOT_YEARS = 2
+    # Change events: seconds they are kept for resuming streams, seconds between polls for events
+    # published by other processes, seconds between keepalive comments, seconds before a stream
+    # is closed, seconds clients wait before reconnecting, and streams served at once by a worker
+    # process, each holding one of its SERVER_THREADS threads
+    EVENTS_TTL = 86400
+    EVENTS_POLL_INTERVAL = 1
+    EVENTS_HEARTBEAT = 15
+    EVENTS_STREAM_TIMEOUT = 300
+    EVENTS_RETRY = 1
+    EVENTS_MAX_STREAMS = 4
+    # Token bucket rate limits as (requests per second, burst) by endpoint, with "default" shared
+    # by all other endpoints and (0, 0) blocking an endpoint; counted per user, or per IP address
+    # for the /auth routes, in a SQLite store shared by all workers (RATELIMIT_STORAGE, defaults to
+    # instance/ratelimit.sqlite)
+    RATELIMIT_ENABLED = True
+    RATELIMIT_STORAGE = None
+    RATELIMIT_LIMITS = {
+        'default': (20, 100),
+        'auth.login': (1, 10),
+        'auth.register': (0.1, 5),
+        'charges.create_charges': (5, 50),
+    }
+    # Seconds a request's queries may run before they are aborted with status code 503 (None for
+    # no limit), and overrides by endpoint; event streams wait between their short queries
+    REQUEST_DEADLINE = 10
+    REQUEST_DEADLINES = {'events.stream': None}
+    # Answer identical concurrent reads of a user with one execution, and seconds duplicates wait
+    COALESCE_READS = True
+    COALESCE_TIMEOUT = 10
+    # Serve the worker process' counters, e.g. of aborted queries, at GET /metrics; the endpoint
+    # is not authenticated, so only enable it where the app is not reachable from the internet
+    METRICS_ENABLED = False
+    # Profile requests whose X-Profile header holds PROFILING_TOKEN (None to disable) with cProfile
+    # and tracemalloc, and sample the stacks of a PROFILING_SAMPLE_RATE fraction of all requests
+    # every PROFILING_INTERVAL seconds; the newest PROFILING_KEEP files are kept in PROFILING_DIR
+    # (defaults to instance/profiles)
+    PROFILING_TOKEN = None
+    PROFILING_SAMPLE_RATE = 0
+    PROFILING_INTERVAL = 0.005
+    PROFILING_DIR = None
+    PROFILING_KEEP = 100
+    # Append the anonymized shapes and timings of a CAPTURE_SAMPLE_RATE fraction of requests to
+    # CAPTURE_PATH (None to disable), for replay with benchmarks/replay.py
+    CAPTURE_PATH = None
+    CAPTURE_SAMPLE_RATE = 1
+    # Warm the app up in create_app, so that the first requests do not pay for it: see
+    # open_trs.warmup.warm_up; reads up to WARMUP_CACHE_BYTES of every database file
+    WARMUP = False
+    WARMUP_CACHE_BYTES = 64 * 1024 * 1024
+    # Charge statistics (GET /charges/stats): users whose charges each worker keeps in memory,
+    # default days of the rolling average, percentiles of the hours per day charged, and whether
+    # to compute with NumPy when it is installed (pip install .[analytics]) rather than in Python
+    ANALYTICS_CACHE_USERS = 256
+    ANALYTICS_WINDOW = 7
+    ANALYTICS_PERCENTILES = (50, 90, 99)
+    ANALYTICS_NUMPY = True
+    # Production server (python -m open_trs.server): address, worker processes (None for two per
+    # CPU plus one), threads per worker, connections waiting to be accepted, seconds idle
+    # keep-alive connections are kept, seconds a worker may be unresponsive before it is
+    # restarted, seconds in-flight requests get to finish on reload or shutdown, and requests
+    # after which a worker is replaced (plus up to the jitter, so that workers are not replaced at
+    # once)
+    SERVER_BIND = '0.0.0.0:8000'
+    SERVER_WORKERS = None
+    SERVER_THREADS = 8
+    SERVER_BACKLOG = 2048
+    SERVER_KEEPALIVE = 5
+    SERVER_TIMEOUT = 30
+    SERVER_GRACEFUL_TIMEOUT = 30
+    SERVER_MAX_REQUESTS = 10000
+    SERVER_MAX_REQUESTS_JITTER = 1000
+    # Connections of all workers to each client-server database (None for one per thread), which
+    # the server divides between workers
+    DATABASE_MAX_CONNECTIONS = None
 
 
 class ProductionConfig(Config):
-    # TODO: Look at common production configurations
-    pass
+    # SECRET_KEY and DATABASE are expected from the environment, e.g. OPEN_TRS_SECRET_KEY
+    WARMUP = True
 
 
 class DevelopmentConfig(Config):
     DEBUG = True
     SECRET_KEY = 'secret'
+    METRICS_ENABLED = True
 
 
 class TestingConfig(Config):
     TESTING = True
     DATABASE = 'file::memory:?cache=shared'
     SECRET_KEY = 'secret'
+    CALENDAR_YEARS = (2024, 2024)
+    JOBS_EAGER = True
+    RATELIMIT_ENABLED = False
 
 
 class GitHubActionsConfig(TestingConfig):
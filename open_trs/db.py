@@ -1,31 +1,266 @@
+import bisect
+import datetime
+import hashlib
+import json
+import os
+import time
+from typing import Iterator, List, Sequence, Tuple
+
 import click
 import sqlite3
 
-from flask import Flask, g, current_app
+from flask import Flask, g, current_app, request
+
+import open_trs.backends
+import open_trs.metrics
+
+EPOCH = datetime.date(1970, 1, 1)
+SCHEMA_VERSION = 11
+
+# Tables holding per-user data and the column identifying the user, moved between shards together
+SHARDED_TABLES = [('Projects', 'owner'), ('Charges', 'user'), ('IdempotencyKeys', 'user'),
+                  ('Purges', 'user'), ('Events', 'user'), ('DataVersions', 'user')]
+
+# Each shard allocates IDs from its own range so rows keep their IDs when moved between shards
+_SHARD_ID_STRIDE = 2 ** 40
+_RING_REPLICAS = 64
+# SQLite virtual machine instructions between checks of the request's deadline
+_DEADLINE_CHECK_INSTRUCTIONS = 10000
+
+
+class HashRing:
+    """
+    Consistent hash ring mapping user IDs to shard names.
+
+    Each shard is placed on the ring at several points so that adding or removing a shard only
+    moves roughly `1 / len(shards)` of the users.
+    """
+
+    def __init__(self, shard_names: List[str], replicas: int = _RING_REPLICAS):
+        """
+        Initialize a new HashRing.
+
+        Args:
+            shard_names: The names of the shards on the ring.
+            replicas (int, optional): The number of ring points per shard; defaults to
+                `_RING_REPLICAS`.
+        """
+
+        points = sorted((self._hash(f'{name}#{replica}'), name)
+                        for name in shard_names for replica in range(replicas))
+
+        self._keys = [key for key, _ in points]
+        self._names = [name for _, name in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode('utf8')).digest()[:8], 'big')
+
+    def get_shard(self, user_id: int) -> str:
+        """
+        Get the shard responsible for a user.
 
+        Args:
+            user_id: The user's ID.
 
-def get_db() -> sqlite3.Connection:
+        Returns:
+            The name of the shard.
+        """
+
+        index = bisect.bisect(self._keys, self._hash(str(user_id))) % len(self._keys)
+
+        return self._names[index]
+
+
+def start_deadline():
+    """
+    Set the deadline of the current request from the config's `REQUEST_DEADLINE` seconds, or the
+    endpoint's entry in `REQUEST_DEADLINES`; None means the request has no deadline.
+    """
+
+    budget = current_app.config['REQUEST_DEADLINES'].get(
+        request.endpoint, current_app.config['REQUEST_DEADLINE'])
+
+    if budget is not None:
+        g.deadline = time.monotonic() + budget
+
+
+def apply_deadline(db: open_trs.backends.Connection):
+    """
+    Make a SQLite connection abort statements still running after the current request's deadline.
+
+    Aborted statements raise `sqlite3.OperationalError`, which `handle_deadline_exceeded` turns
+    into an error response. Connections opened outside of requests, or to other backends, are left
+    as they are.
+
+    Args:
+        db: The database connection.
     """
-    Get the SQLite database connection for the `current_app`.
 
-    NOTE: This utilizes `flask.current_app` to identify the config's `DATABASE`.
+    deadline = g.get('deadline')
+
+    if deadline is not None and open_trs.backends.is_sqlite(db):
+        db.set_progress_handler(lambda: time.monotonic() > deadline, _DEADLINE_CHECK_INSTRUCTIONS)
+
+
+def handle_deadline_exceeded(e: sqlite3.OperationalError):
+    """
+    Handle a statement aborted because its request ran past its deadline.
+
+    Args:
+        e: The exception raised by the aborted statement.
+
+    Returns:
+        A JSON response with status code 503.
+    """
+
+    deadline = g.get('deadline')
+
+    if str(e) != 'interrupted' or deadline is None or time.monotonic() <= deadline:
+        raise e
+
+    open_trs.metrics.increment('queries_aborted', {'endpoint': request.endpoint})
+    current_app.logger.warning('Aborted query of %s after its deadline', request.endpoint)
+
+    return open_trs.handle_invalid_usage(open_trs.InvalidUsage(
+        'The request took too long and was cancelled, try a smaller range', 503))
+
+
+def _connect(database: str) -> open_trs.backends.Connection:
+    """
+    Open a new database connection configured the way Open TRS expects.
+
+    Args:
+        database: The path or URL of the database.
 
     Returns:
-        sqlite3.Connection: The SQLite database connection.
+        The database connection.
+    """
+
+    db = open_trs.backends.connect(database, current_app.config['DATABASE_POOL_SIZE'])
+    apply_deadline(db)
+
+    return db
+
+
+def get_directory_db() -> open_trs.backends.Connection:
+    """
+    Get the connection to the config's `DATABASE`.
+
+    When sharding is disabled this database holds everything; otherwise it is the directory
+    database holding Users and their shard placements.
+
+    Returns:
+        The database connection.
     """
 
     if 'db' not in g:
-        g.db = sqlite3.connect(
-            current_app.config['DATABASE'],
-            detect_types=sqlite3.PARSE_DECLTYPES)
-        g.db.row_factory = sqlite3.Row
+        g.db = _connect(current_app.config['DATABASE'])
 
     return g.db
 
 
+def get_shard_name(user_id: int) -> str:
+    """
+    Get the name of the shard holding a user's projects and charges.
+
+    Users are placed on a shard when they register; users without a placement (e.g. registered
+    before sharding was enabled) fall back to the consistent hash ring.
+
+    Args:
+        user_id: The user's ID.
+
+    Returns:
+        The shard's name, a key of the config's `DATABASE_SHARDS`.
+    """
+
+    shard_names = g.setdefault('shard_names', {})
+
+    if user_id not in shard_names:
+        placement = get_directory_db().execute(
+            'SELECT shard FROM UserShards WHERE user = ?', (user_id,)).fetchone()
+
+        if placement is not None and placement['shard'] in current_app.config['DATABASE_SHARDS']:
+            shard_names[user_id] = placement['shard']
+        else:
+            ring = HashRing(list(current_app.config['DATABASE_SHARDS']))
+            shard_names[user_id] = ring.get_shard(user_id)
+
+    return shard_names[user_id]
+
+
+def get_db() -> open_trs.backends.Connection:
+    """
+    Get the database connection for the `current_app`.
+
+    NOTE: This utilizes `flask.current_app` to identify the config's `DATABASE`. If the config's
+    `DATABASE_SHARDS` is set and a user was authenticated by `open_trs.auth.login_required`, the
+    connection to that user's shard is returned instead. The backend is chosen from the database
+    URL, see `open_trs.backends.connect`.
+
+    Returns:
+        The database connection.
+    """
+
+    user_id = g.get('user_id')
+
+    if user_id is None or not current_app.config['DATABASE_SHARDS']:
+        return get_directory_db()
+
+    if 'shard_dbs' not in g:
+        g.shard_dbs = {}
+
+    shard_name = get_shard_name(user_id)
+
+    if shard_name not in g.shard_dbs:
+        g.shard_dbs[shard_name] = _connect(current_app.config['DATABASE_SHARDS'][shard_name])
+
+    return g.shard_dbs[shard_name]
+
+
+def iter_dbs() -> Iterator[open_trs.backends.Connection]:
+    """
+    Iterate over the connections to the config's `DATABASE` and to every configured shard, e.g. for
+    maintenance that has to visit all users' data.
+
+    Shard connections are opened for the iteration only and closed once it moves past them.
+
+    Yields:
+        The database connections.
+    """
+
+    yield get_directory_db()
+
+    for path in current_app.config['DATABASE_SHARDS'].values():
+        db = _connect(path)
+
+        try:
+            yield db
+        finally:
+            db.close()
+
+
+def assign_shard(db: open_trs.backends.Connection, user_id: int):
+    """
+    Record the shard placement of a newly registered user; does nothing when sharding is disabled.
+
+    The placement is written without committing so it is part of the registration transaction.
+
+    Args:
+        db: The directory database connection.
+        user_id: The user's ID.
+    """
+
+    shards = current_app.config['DATABASE_SHARDS']
+
+    if shards:
+        db.execute('INSERT INTO UserShards (user, shard) VALUES (?, ?)',
+                   (user_id, HashRing(list(shards)).get_shard(user_id)))
+
+
 def close_db(e: Exception = None):
     """
-    Close the SQLite database connection.
+    Close the database connections.
 
     Args:
         e (Exception, optional): The exception that occurred, if any.
@@ -36,17 +271,348 @@ def close_db(e: Exception = None):
     if db is not None:
         db.close()
 
+    for shard_db in g.pop('shard_dbs', {}).values():
+        shard_db.close()
 
-def init_db():
+
+def bind_values(db: open_trs.backends.Connection, values: Sequence) -> Tuple[str, list]:
     """
-    Initialize the database by executing the schema.sql file.
+    Bind a list of values for an `IN` expression.
+
+    SQLite receives the values as a single JSON parameter read by `json_each`, so the statement
+    text is the same for any number of values: it is prepared once and then reused from the
+    connection's statement cache, and it is not bound by SQLite's variable limit. Other backends
+    receive one placeholder per value.
+
+    Args:
+        db: The database connection.
+        values: The values, e.g. IDs or names.
+
+    Returns:
+        A tuple containing the parenthesized SQL to follow `IN` and its parameters.
     """
 
-    db = get_db()
+    if open_trs.backends.is_sqlite(db):
+        return '(SELECT value FROM json_each(?))', [json.dumps(list(values))]
+
+    return f'({", ".join("?" * len(values))})', list(values)
+
+
+def bind_rows(db: open_trs.backends.Connection, rows: Sequence[Sequence],
+              num_columns: int) -> Tuple[str, list]:
+    """
+    Bind rows of values as the source of an `INSERT` statement.
+
+    Like `bind_values`, SQLite receives all rows as a single JSON parameter, so the statement has
+    one prepared form for any number of rows. The source may be followed by an `ON CONFLICT`
+    clause.
+
+    Args:
+        db: The database connection.
+        rows: The rows, each with `num_columns` values.
+        num_columns: The number of values per row.
+
+    Returns:
+        A tuple containing the SQL to follow `INSERT INTO table (columns)` and its parameters.
+    """
+
+    if open_trs.backends.is_sqlite(db):
+        columns = ', '.join(f"json_extract(value, '$[{index}]')" for index in range(num_columns))
+
+        # `WHERE true` keeps SQLite from parsing a following ON CONFLICT as part of the join
+        return (f'SELECT {columns} FROM json_each(?) WHERE true',
+                [json.dumps([list(row) for row in rows])])
+
+    placeholders = f'({", ".join("?" * num_columns)})'
+
+    return (f'VALUES {", ".join([placeholders] * len(rows))}',
+            [value for row in rows for value in row])
+
+
+def date_to_day(date: datetime.date) -> int:
+    """
+    Convert a date to its day number, the number of days since `EPOCH`.
+
+    Args:
+        date: The date to convert.
+
+    Returns:
+        The date's day number.
+    """
+
+    return (date - EPOCH).days
+
+
+def day_to_date(day: int) -> datetime.date:
+    """
+    Convert a day number back to a date.
+
+    Args:
+        day: The number of days since `EPOCH`.
+
+    Returns:
+        The corresponding date.
+    """
+
+    return EPOCH + datetime.timedelta(days=day)
+
+
+def day_to_iso(day: int) -> str:
+    """
+    Convert a day number to an ISO formatted (YYYY-MM-DD) date string.
+
+    Args:
+        day: The number of days since `EPOCH`.
+
+    Returns:
+        The ISO formatted date.
+    """
+
+    return day_to_date(day).isoformat()
+
+
+def get_missing_calendar_years(db: open_trs.backends.Connection, first_year: int,
+                               last_year: int) -> List[int]:
+    """
+    Find the years that have not been added to the Calendar dimension table yet.
+
+    Args:
+        db: The database connection.
+        first_year: The first year to check.
+        last_year: The last year to check, inclusive.
+
+    Returns:
+        The missing years, in order.
+    """
+
+    years = range(first_year, last_year + 1)
+    first_days = [date_to_day(datetime.date(year, 1, 1)) for year in years]
+    days_sql, days_parameters = bind_values(db, first_days)
+    present = {row['day'] for row in db.execute(
+        f'SELECT day FROM Calendar WHERE day IN {days_sql}', days_parameters)}
+
+    return [year for year, day in zip(years, first_days) if day not in present]
+
+
+def populate_calendar(db: open_trs.backends.Connection, first_year: int, last_year: int):
+    """
+    Fill the Calendar dimension table with every day of the given years.
+
+    Years that are already present are skipped, so this is cheap to call before any query that
+    joins Calendar for an arbitrary range.
+
+    Args:
+        db: The database connection.
+        first_year: The first year to populate.
+        last_year: The last year to populate, inclusive.
+    """
+
+    new_days = []
+
+    for year in get_missing_calendar_years(db, first_year, last_year):
+        # Days are counted by number, since adding a day to December 31, 9999 overflows
+        for day in range(date_to_day(datetime.date(year, 1, 1)),
+                         date_to_day(datetime.date(year, 12, 31)) + 1):
+            date = day_to_date(day)
+            iso_year, iso_week, _ = date.isocalendar()
+            new_days.append((day, date.isoformat(), f'{iso_year}-W{iso_week:02}',
+                             f'{year}-{date.month:02}', f'{year}-Q{(date.month - 1) // 3 + 1}',
+                             year))
+
+    if new_days:
+        db.executemany(
+            'INSERT INTO Calendar (day, date, iso_week, month, quarter, year)'
+            ' VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT DO NOTHING', new_days)
+        db.commit()
+
+
+def _init_schema(db: open_trs.backends.Connection, id_offset: int = 0):
+    """
+    Create the tables of a single database and precompute its calendar.
+
+    Args:
+        db: The database connection.
+        id_offset (int, optional): The value AUTOINCREMENT IDs start after; defaults to 0.
+    """
 
     with current_app.open_resource('schema.sql') as f:
         db.executescript(f.read().decode('utf8'))
 
+    if id_offset and open_trs.backends.is_sqlite(db):
+        db.executemany('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)',
+                       [('Projects', id_offset), ('Charges', id_offset), ('Events', id_offset)])
+        db.commit()
+
+    populate_calendar(db, *current_app.config['CALENDAR_YEARS'])
+
+
+def init_db():
+    """
+    Initialize the database, and any configured shards, by executing the schema.sql file and
+    precomputing the calendar.
+    """
+
+    _init_schema(get_directory_db())
+
+    for index, path in enumerate(current_app.config['DATABASE_SHARDS'].values(), start=1):
+        db = _connect(path)
+
+        try:
+            _init_schema(db, index * _SHARD_ID_STRIDE)
+        finally:
+            db.close()
+
+
+def _migrate(db: open_trs.backends.Connection) -> List[str]:
+    """
+    Apply pending migration scripts to a single database.
+
+    Args:
+        db: The database connection.
+
+    Returns:
+        The names of the applied migrations.
+    """
+
+    if not open_trs.backends.is_sqlite(db):
+        raise RuntimeError('Migrations are only supported for SQLite databases')
+
+    if db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'Charges'"
+                  ).fetchone() is None:
+        raise RuntimeError('Database has not been initialized, run init-db instead')
+
+    version = max(db.execute('PRAGMA user_version').fetchone()[0], 1)
+    migrations_path = os.path.join(current_app.root_path, 'migrations')
+    applied = []
+
+    for name in sorted(os.listdir(migrations_path)):
+        migration_version = int(name.split('_')[0])
+
+        if migration_version <= version:
+            continue
+
+        with current_app.open_resource(os.path.join('migrations', name)) as f:
+            script = f.read().decode('utf8')
+
+        try:
+            db.executescript(
+                f'BEGIN;\n{script}\nPRAGMA user_version = {migration_version};\nCOMMIT;')
+        except sqlite3.Error:
+            db.rollback()
+            raise
+
+        version = migration_version
+        applied.append(name)
+
+    return applied
+
+
+def migrate_db() -> List[str]:
+    """
+    Upgrade an existing database, and any configured shards, to `SCHEMA_VERSION` by applying
+    pending migration scripts.
+
+    Migration scripts live in the `migrations` directory and are named after the schema version
+    they produce (e.g. `0002_integer_dates.sql`). Databases created before schema versioning have
+    a `user_version` of 0 and are treated as version 1. Each script is applied in its own
+    transaction along with the `user_version` bump.
+
+    Returns:
+        The names of the migrations applied to the config's `DATABASE`.
+    """
+
+    applied = _migrate(get_directory_db())
+
+    for path in current_app.config['DATABASE_SHARDS'].values():
+        db = _connect(path)
+
+        try:
+            _migrate(db)
+        finally:
+            db.close()
+
+    return applied
+
+
+def rebalance_shards(dry_run: bool = False) -> List[Tuple[int, str, str]]:
+    """
+    Move users whose placement differs from the consistent hash ring to their ring shard.
+
+    Run this after adding or removing entries in the config's `DATABASE_SHARDS`. Users that have
+    never been placed (e.g. their data predates sharding) are moved out of the config's `DATABASE`.
+    Each user's rows are copied and deleted in a single transaction across both databases before
+    their placement is updated, so an interrupted rebalance can simply be run again.
+
+    Args:
+        dry_run (bool, optional): Only report the moves without performing them; defaults to
+            False.
+
+    Returns:
+        A list of `(user_id, source, target)` tuples, where `source` is None for the `DATABASE`.
+    """
+
+    shards = current_app.config['DATABASE_SHARDS']
+
+    if not shards:
+        raise RuntimeError('Sharding is not enabled, set DATABASE_SHARDS first')
+
+    for db in iter_dbs():
+        if db.execute('SELECT 1 FROM Partitions LIMIT 1').fetchone() is not None:
+            raise RuntimeError('Archived charges cannot be moved between shards, rebalance before'
+                               ' running archive-charges')
+
+    directory = get_directory_db()
+    ring = HashRing(list(shards))
+    placements = {row['user']: row['shard']
+                  for row in directory.execute('SELECT user, shard FROM UserShards')}
+    moves = []
+
+    for user in directory.execute('SELECT id FROM Users ORDER BY id').fetchall():
+        user_id = user['id']
+        source = placements.get(user_id)
+        target = ring.get_shard(user_id)
+
+        if source == target:
+            continue
+
+        if source is not None and source not in shards:
+            raise RuntimeError(f'User {user_id} is placed on shard "{source}", which is not'
+                               ' configured; add it back to DATABASE_SHARDS to move its users')
+
+        moves.append((user_id, source, target))
+
+        if dry_run:
+            continue
+
+        source_db = directory if source is None else _connect(shards[source])
+
+        try:
+            source_db.execute('ATTACH DATABASE ? AS target', (shards[target],))
+
+            try:
+                for table, column in SHARDED_TABLES:
+                    source_db.execute(f'INSERT INTO target.{table}'
+                                      f' SELECT * FROM main.{table} WHERE {column} = ?',
+                                      (user_id,))
+                    source_db.execute(f'DELETE FROM main.{table} WHERE {column} = ?', (user_id,))
+
+                source_db.commit()
+            except sqlite3.Error:
+                source_db.rollback()
+                raise
+            finally:
+                source_db.execute('DETACH DATABASE target')
+        finally:
+            if source_db is not directory:
+                source_db.close()
+
+        directory.execute('INSERT INTO UserShards (user, shard) VALUES (?, ?)'
+                          ' ON CONFLICT (user) DO UPDATE SET shard = excluded.shard',
+                          (user_id, target))
+        directory.commit()
+
+    return moves
+
 
 @click.command('init-db')
 def init_db_command():
@@ -60,6 +626,41 @@ def init_db_command():
     click.echo('Initialized the database.')
 
 
+@click.command('migrate-db')
+def migrate_db_command():
+    """
+    Click command to upgrade the database schema in place, keeping existing data.
+    """
+
+    try:
+        applied = migrate_db()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    for name in applied:
+        click.echo(f'Applied {name}.')
+
+    click.echo(f'Database is at schema version {SCHEMA_VERSION}.')
+
+
+@click.command('rebalance-shards')
+@click.option('--dry-run', is_flag=True, help='Only list the users that would be moved.')
+def rebalance_shards_command(dry_run: bool):
+    """
+    Click command to move users to the shards assigned by the consistent hash ring.
+    """
+
+    try:
+        moves = rebalance_shards(dry_run)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    for user_id, source, target in moves:
+        click.echo(f'User {user_id}: {source or "DATABASE"} -> {target}')
+
+    click.echo(f'{"Would move" if dry_run else "Moved"} {len(moves)} users.')
+
+
 def init_app(app: Flask):
     """
     Initialize the Flask application.
@@ -68,5 +669,9 @@ def init_app(app: Flask):
         app (Flask): The Flask application instance.
     """
 
+    app.before_request(start_deadline)
+    app.register_error_handler(sqlite3.OperationalError, handle_deadline_exceeded)
     app.teardown_appcontext(close_db)
     app.cli.add_command(init_db_command)
+    app.cli.add_command(migrate_db_command)
+    app.cli.add_command(rebalance_shards_command)
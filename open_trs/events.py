@@ -0,0 +1,279 @@
+import json
+import math
+import os
+import threading
+import time
+from typing import Iterator, Optional
+
+from flask import Blueprint, Flask, Response, current_app, g, request, stream_with_context
+
+import open_trs
+import open_trs.auth
+import open_trs.backends
+import open_trs.db
+
+# Events sent per query while a stream catches up
+_BATCH_SIZE = 100
+
+# Wakes this process' streams as soon as one of its requests has published an event; streams
+# served by other processes notice new events at their next poll of the Events table
+_published = threading.Condition()
+# Streams this process is serving, each holding one of its threads; guarded by `_published`
+_open_streams = 0
+
+bp = Blueprint('events', __name__, url_prefix='/events')
+
+
+def _reset_after_fork():
+    """
+    Replace `_published` in a forked child, e.g. a gunicorn worker: the parent's streams waiting on
+    it do not exist in the child, so neither do those counted in `_open_streams`, and `publish`
+    may have held it while the child was forked.
+    """
+
+    global _published, _open_streams
+
+    _published = threading.Condition()
+    _open_streams = 0
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def publish(db: open_trs.backends.Connection, user_id: int, topic: str, data: dict):
+    """
+    Record a change to a user's data for their event streams.
+
+    The event is written without committing, so it becomes visible to streams together with the
+    change it describes, or not at all if the change is rolled back. Events older than the config's
+    `EVENTS_TTL` are expired along the way. The user's data version, see `get_data_version`, is
+    bumped in the same transaction.
+
+    Args:
+        db: The database connection the change was made on.
+        user_id: The ID of the user whose data changed.
+        topic: What changed, e.g. "charges" or "projects".
+        data: JSON serializable details of the change, e.g. its `action` and the affected `ids`.
+    """
+
+    now = int(time.time())
+
+    db.execute('DELETE FROM Events WHERE created < ?', (now - current_app.config['EVENTS_TTL'],))
+    db.execute('INSERT INTO Events (user, topic, data, created) VALUES (?, ?, ?, ?)',
+               (user_id, topic, json.dumps(data), now))
+    db.execute('INSERT INTO DataVersions (user, version) VALUES (?, 1) ON CONFLICT (user)'
+               ' DO UPDATE SET version = DataVersions.version + 1', (user_id,))
+    g.events_published = True
+
+
+def get_data_version(db: open_trs.backends.Connection, user_id: int) -> int:
+    """
+    Get a counter of the changes to the user's data, for caches to tell whether it changed.
+
+    Every change publishes an event, which bumps the counter in the same transaction. Unlike the
+    IDs of events, which expire, the counter only ever goes up.
+
+    Args:
+        db: The database connection.
+        user_id: The user's ID.
+
+    Returns:
+        The user's data version, 0 if their data never changed.
+    """
+
+    row = db.execute('SELECT version FROM DataVersions WHERE user = ?', (user_id,)).fetchone()
+
+    return row[0] if row is not None else 0
+
+
+def notify_streams(e: Exception = None):
+    """
+    Wake the streams of this process if the request published events.
+
+    Runs when the application context is torn down, after the request's changes were committed.
+
+    Args:
+        e (Exception, optional): The exception that occurred, if any.
+    """
+
+    if g.pop('events_published', False):
+        with _published:
+            _published.notify_all()
+
+
+def _release_db(db: open_trs.backends.Connection):
+    if not open_trs.backends.is_sqlite(db):
+        open_trs.db.close_db()
+
+
+def _fetch_events(user_id: int, last_event_id: int) -> list:
+    """
+    Get a batch of a user's events following the last one sent.
+
+    Pooled connections, e.g. to PostgreSQL, are returned right away, so idle streams do not hold
+    on to them.
+
+    Args:
+        user_id: The user's ID.
+        last_event_id: The ID of the last event sent.
+
+    Returns:
+        The events, in order.
+    """
+
+    db = open_trs.db.get_db()
+
+    try:
+        return db.execute(
+            'SELECT id, topic, data FROM Events WHERE user = ? AND id > ? ORDER BY id LIMIT ?',
+            (user_id, last_event_id, _BATCH_SIZE)).fetchall()
+    finally:
+        _release_db(db)
+
+
+def _generate_stream(user_id: int, last_event_id: int, reset: bool) -> Iterator[str]:
+    """
+    Generate the messages of an event stream.
+
+    Args:
+        user_id: The user's ID.
+        last_event_id: The ID of the last event the client has seen.
+        reset: Whether events the client has not seen have expired, in which case it is told to
+            reload its data.
+
+    Yields:
+        The stream's messages.
+    """
+
+    config = current_app.config
+    deadline = time.monotonic() + config['EVENTS_STREAM_TIMEOUT']
+    last_message = time.monotonic()
+
+    yield f'retry: {int(config["EVENTS_RETRY"] * 1000)}\n\n'
+
+    if reset:
+        yield f'id: {last_event_id}\nevent: reset\ndata: {{}}\n\n'
+
+    while True:
+        events = _fetch_events(user_id, last_event_id)
+
+        for event in events:
+            last_event_id = event['id']
+            yield f'id: {event["id"]}\nevent: {event["topic"]}\ndata: {event["data"]}\n\n'
+
+        if events:
+            last_message = time.monotonic()
+        elif time.monotonic() - last_message >= config['EVENTS_HEARTBEAT']:
+            yield ': keepalive\n\n'
+            last_message = time.monotonic()
+
+        if time.monotonic() >= deadline:
+            return
+
+        if len(events) < _BATCH_SIZE:
+            with _published:
+                _published.wait(min(config['EVENTS_POLL_INTERVAL'],
+                                    max(deadline - time.monotonic(), 0)))
+
+
+def _open_stream():
+    """
+    Count a new stream of this process, unless it already serves the config's `EVENTS_MAX_STREAMS`.
+
+    Raises:
+        InvalidUsage: If the process has no stream to spare, with the status 503 and a
+            `Retry-After` header.
+    """
+
+    global _open_streams
+
+    config = current_app.config
+
+    with _published:
+        if _open_streams >= config['EVENTS_MAX_STREAMS']:
+            raise open_trs.InvalidUsage(
+                'Too many event streams, try again later', 503,
+                headers={'Retry-After': str(max(math.ceil(config['EVENTS_RETRY']), 1))})
+
+        _open_streams += 1
+
+
+def _close_stream():
+    global _open_streams
+
+    with _published:
+        _open_streams -= 1
+
+
+def _parse_last_event_id(value: Optional[str]) -> Optional[int]:
+    if value is None:
+        return None
+
+    try:
+        return int(value)
+    except ValueError:
+        raise open_trs.InvalidUsage('Invalid Last-Event-ID', 400)
+
+
+@bp.route('/stream', methods=['GET'])
+@open_trs.auth.login_required
+def stream(user_id: int):
+    """
+    Stream changes to the user's charges and projects as Server-Sent Events.
+
+    Each event's type is the topic that changed and its data describes the change, e.g.
+    `{"action": "created", "ids": [1, 2]}`. Clients resume after the last event they received
+    with the `Last-Event-ID` header, which browsers send when reconnecting, or the `last_event_id`
+    query parameter; without either the stream starts with the next change. If events the client
+    missed have already expired, a `reset` event asks it to reload its data instead.
+
+    Streams are closed after the config's `EVENTS_STREAM_TIMEOUT` seconds, and clients reconnect
+    after `EVENTS_RETRY` seconds without missing events. Every stream holds a server thread, so a
+    worker process serves at most `EVENTS_MAX_STREAMS` at once and refuses more with the status
+    503, keeping its other threads for the remaining requests.
+
+    Args:
+        user_id: The user's ID.
+
+    Returns:
+        A `text/event-stream` response.
+    """
+
+    last_event_id = _parse_last_event_id(
+        request.headers.get('Last-Event-ID', request.args.get('last_event_id')))
+    reset = False
+    _open_stream()
+
+    try:
+        db = open_trs.db.get_db()
+
+        try:
+            if last_event_id is None:
+                last_event_id = db.execute('SELECT COALESCE(MAX(id), 0) FROM Events').fetchone()[0]
+            else:
+                first_id = db.execute('SELECT MIN(id) FROM Events').fetchone()[0]
+                reset = first_id is not None and first_id > last_event_id + 1
+        finally:
+            _release_db(db)
+    except Exception:
+        _close_stream()
+        raise
+
+    response = Response(stream_with_context(_generate_stream(user_id, last_event_id, reset)),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # The server closes the response once the stream ends or its client disconnects
+    response.call_on_close(_close_stream)
+
+    return response
+
+
+def init_app(app: Flask):
+    """
+    Initialize the Flask application.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+
+    app.teardown_appcontext(notify_streams)
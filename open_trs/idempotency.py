@@ -0,0 +1,145 @@
+import functools
+import hashlib
+import time
+from typing import Optional
+
+from flask import current_app, make_response, request
+
+import open_trs
+import open_trs.backends
+import open_trs.db
+
+_MAX_KEY_LENGTH = 255
+
+
+def _release_key(db: open_trs.backends.Connection, user_id: int, key: str, claimed: int):
+    """
+    Forget an in-flight idempotency key so that the request can be retried.
+
+    Args:
+        db: The database connection.
+        user_id: The user's ID.
+        key: The idempotency key.
+        claimed: The time the key was claimed, so that a claim taken over since is kept.
+    """
+
+    db.rollback()
+    db.execute('DELETE FROM IdempotencyKeys WHERE user = ? AND idempotency_key = ? AND created = ?',
+               (user_id, key, claimed))
+    db.commit()
+
+
+def _claim_key(db: open_trs.backends.Connection, user_id: int, key: str,
+               request_hash: str) -> Optional[int]:
+    """
+    Record a new in-flight idempotency key, expiring old keys so that the table stays bounded.
+
+    A key still in flight after the config's `IDEMPOTENCY_CLAIM_LEASE` seconds is taken over, since
+    the request that claimed it most likely died with its worker.
+
+    Args:
+        db: The database connection.
+        user_id: The user's ID.
+        key: The idempotency key.
+        request_hash: Hash identifying the request made with the key.
+
+    Returns:
+        The time the key was claimed at, or None if it is already known.
+    """
+
+    now = int(time.time())
+
+    db.execute('DELETE FROM IdempotencyKeys WHERE created < ?',
+               (now - current_app.config['IDEMPOTENCY_KEY_TTL'],))
+    db.execute('DELETE FROM IdempotencyKeys WHERE user = ? AND idempotency_key = ?'
+               ' AND status_code IS NULL AND created < ?',
+               (user_id, key, now - current_app.config['IDEMPOTENCY_CLAIM_LEASE']))
+
+    try:
+        db.execute('INSERT INTO IdempotencyKeys (user, idempotency_key, request_hash, created)'
+                   ' VALUES (?, ?, ?, ?)', (user_id, key, request_hash, now))
+    except db.IntegrityError:
+        db.rollback()
+        return None
+
+    db.execute('DELETE FROM IdempotencyKeys WHERE user = ? AND created < ('
+               '  SELECT created FROM IdempotencyKeys WHERE user = ?'
+               '  ORDER BY created DESC LIMIT 1 OFFSET ?)',
+               (user_id, user_id, current_app.config['IDEMPOTENCY_MAX_KEYS'] - 1))
+    db.commit()
+
+    return now
+
+
+def idempotent(view: callable):
+    """
+    Decorator that makes a view safe to retry by honoring the `Idempotency-Key` request header.
+
+    The first request with a key runs the view and stores its response; retries with the same key
+    and body replay the stored response without running the view again. A retry arriving while the
+    first request is still in flight is refused with status code 409, unless it has been in flight
+    for longer than `IDEMPOTENCY_CLAIM_LEASE` seconds, and reusing a key for a
+    different request is refused with status code 422. Requests that fail release their key.
+
+    Must be applied below `open_trs.auth.login_required`, since keys are scoped to the user.
+
+    Args:
+        view (callable): The view function to be decorated.
+
+    Returns:
+        callable: The decorated view function.
+    """
+
+    @functools.wraps(view)
+    def wrapped_view(user_id: int, *args, **kwargs):
+        key = request.headers.get('Idempotency-Key')
+
+        if key is None:
+            return view(user_id, *args, **kwargs)
+        elif not key or len(key) > _MAX_KEY_LENGTH:
+            raise open_trs.InvalidUsage(
+                f'Idempotency key must be between 1 and {_MAX_KEY_LENGTH} characters', 400)
+
+        request_hash = hashlib.sha256(
+            b'\n'.join((request.method.encode(), request.path.encode(), request.get_data()))
+        ).hexdigest()
+        db = open_trs.db.get_db()
+
+        claimed = _claim_key(db, user_id, key, request_hash)
+
+        if claimed is None:
+            stored = db.execute(
+                'SELECT request_hash, status_code, response FROM IdempotencyKeys'
+                ' WHERE user = ? AND idempotency_key = ?', (user_id, key)).fetchone()
+
+            if stored is None or stored['status_code'] is None:
+                raise open_trs.InvalidUsage(
+                    'A request with this idempotency key is already in progress', 409)
+            elif stored['request_hash'] != request_hash:
+                raise open_trs.InvalidUsage(
+                    'Idempotency key was already used for a different request', 422)
+
+            response = current_app.response_class(
+                stored['response'], status=stored['status_code'], mimetype='application/json')
+            response.headers['Idempotent-Replayed'] = 'true'
+
+            return response
+
+        try:
+            response = make_response(view(user_id, *args, **kwargs))
+        except Exception:
+            _release_key(db, user_id, key, claimed)
+            raise
+
+        if response.status_code >= 500:
+            _release_key(db, user_id, key, claimed)
+            return response
+
+        db.execute('UPDATE IdempotencyKeys SET status_code = ?, response = ?'
+                   ' WHERE user = ? AND idempotency_key = ? AND created = ?',
+                   (response.status_code, response.get_data(as_text=True), user_id, key, claimed))
+        db.commit()
+
+        return response
+
+    return wrapped_view
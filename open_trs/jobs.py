@@ -0,0 +1,331 @@
+import json
+import os
+import socket
+import time
+import traceback
+from typing import Callable, Optional
+
+import click
+from flask import Blueprint, Flask, current_app, g, jsonify
+
+import open_trs
+import open_trs.auth
+import open_trs.backends
+import open_trs.db
+
+# Job handlers and their concurrency limits, keyed by job kind; filled in by `handler`
+_HANDLERS = {}
+
+bp = Blueprint('jobs', __name__, url_prefix='/jobs')
+
+
+def handler(kind: str, concurrency: Optional[int] = None):
+    """
+    Decorator registering a function as the handler of a kind of job.
+
+    Handlers are called with the job's payload and a `report_progress` callable accepting the
+    fraction of the work done (0 to 1), inside an application context where `open_trs.db.get_db`
+    returns the connection for the job's user. Their return value, which must be JSON serializable,
+    is stored as the job's result; raising an exception fails the attempt.
+
+    Args:
+        kind: The kind of job handled.
+        concurrency (int, optional): The maximum number of jobs of this kind running at once,
+            unless overridden by the config's `JOBS_CONCURRENCY`; defaults to no limit.
+
+    Returns:
+        callable: The decorator.
+    """
+
+    def decorator(function: Callable):
+        _HANDLERS[kind] = (function, concurrency)
+
+        return function
+
+    return decorator
+
+
+def _get_queue_db() -> open_trs.backends.Connection:
+    # The queue lives in the config's DATABASE, next to Users, even when sharding is enabled
+    return open_trs.db.get_directory_db()
+
+
+def _job_to_dict(job: open_trs.backends.Row) -> dict:
+    """
+    Convert a job row to its API representation.
+
+    Args:
+        job: A row from the Jobs table.
+
+    Returns:
+        A dictionary of the job with its payload and result decoded.
+    """
+
+    job = dict(job)
+    job['payload'] = json.loads(job['payload'])
+    job['result'] = None if job['result'] is None else json.loads(job['result'])
+
+    return job
+
+
+def enqueue(kind: str, payload: dict, user_id: Optional[int] = None, priority: int = 0,
+            max_attempts: Optional[int] = None, delay: int = 0,
+            unique: bool = False) -> Optional[int]:
+    """
+    Add a job to the queue and commit it.
+
+    When the config's `JOBS_EAGER` is enabled (e.g. for testing) jobs without a delay are also run
+    before returning, instead of waiting for a worker.
+
+    Recurring jobs, which queue their next run themselves, are queued with `unique`, so that
+    scheduling them again does not start a second chain of runs.
+
+    Args:
+        kind: The kind of job, which must have a registered `handler`.
+        payload: The JSON serializable arguments of the job.
+        user_id (int, optional): The user the job works for; defaults to None.
+        priority (int, optional): Jobs with a higher priority are run first; defaults to 0.
+        max_attempts (int, optional): The number of attempts before the job fails; defaults to the
+            config's `JOBS_MAX_ATTEMPTS`.
+        delay (int, optional): Seconds to wait before the job may run; defaults to 0.
+        unique (bool, optional): Skip the job if one of its kind is already queued or running,
+            other than the job calling this; defaults to False.
+
+    Returns:
+        The job's ID, or None if it was skipped.
+    """
+
+    if kind not in _HANDLERS:
+        raise ValueError(f'No handler registered for job kind "{kind}"')
+
+    db = _get_queue_db()
+    now = int(time.time())
+
+    if unique and db.execute(
+            "SELECT 1 FROM Jobs WHERE kind = ? AND status IN ('queued', 'running') AND id != ?",
+            (kind, g.get('job_id', 0))).fetchone() is not None:
+        return None
+
+    job = db.execute(
+        'INSERT INTO Jobs (kind, user, payload, priority, max_attempts, run_after, created)'
+        ' VALUES (?, ?, ?, ?, ?, ?, ?) RETURNING id',
+        (kind, user_id, json.dumps(payload), priority,
+         max_attempts or current_app.config['JOBS_MAX_ATTEMPTS'], now + delay, now)).fetchone()
+    db.commit()
+
+    if current_app.config['JOBS_EAGER'] and not delay:
+        claimed = db.execute(
+            "UPDATE Jobs SET status = 'running', attempts = attempts + 1, worker = 'eager',"
+            ' started = ?, lease_expires = ? WHERE id = ? RETURNING *',
+            (now, now + current_app.config['JOBS_LEASE'], job['id'])).fetchone()
+        db.commit()
+        run_job(claimed)
+
+    return job['id']
+
+
+def get_job(job_id: int) -> Optional[dict]:
+    """
+    Get a job by its ID.
+
+    Args:
+        job_id: The job's ID.
+
+    Returns:
+        A dictionary of the job, or None if it does not exist.
+    """
+
+    job = _get_queue_db().execute('SELECT * FROM Jobs WHERE id = ?', (job_id,)).fetchone()
+
+    return None if job is None else _job_to_dict(job)
+
+
+def claim_job(worker: str) -> Optional[open_trs.backends.Row]:
+    """
+    Atomically claim the next runnable job for a worker.
+
+    Runnable jobs are queued jobs whose `run_after` has passed, and running jobs whose lease of the
+    config's `JOBS_LEASE` seconds has expired because their worker died. Jobs are picked by
+    descending priority, then in the order they were queued, skipping kinds that already have as
+    many jobs running as their concurrency limit allows. The claim is a single `UPDATE` that
+    re-checks the job is still runnable, so concurrent workers never run the same job.
+
+    Args:
+        worker: The name of the worker claiming the job.
+
+    Returns:
+        The claimed job's row, or None if no job is runnable.
+    """
+
+    db = _get_queue_db()
+    now = int(time.time())
+    limits = {kind: concurrency for kind, (_, concurrency) in _HANDLERS.items()}
+    limits.update(current_app.config['JOBS_CONCURRENCY'])
+    limits = {kind: limit for kind, limit in limits.items() if limit is not None}
+
+    # Jobs whose worker died on their last attempt are not retried again
+    db.execute("UPDATE Jobs SET status = 'failed', finished = ?, error = 'Lease expired'"
+               " WHERE status = 'running' AND lease_expires < ? AND attempts >= max_attempts",
+               (now, now))
+
+    limit_clause = ''
+    limit_parameters = []
+
+    if limits:
+        limit_clause = (
+            ' AND (SELECT COUNT(*) FROM Jobs AS running WHERE running.kind = queued.kind'
+            "  AND running.status = 'running' AND running.lease_expires >= ?)"
+            f' < CASE queued.kind {"WHEN ? THEN CAST(? AS INTEGER) " * len(limits)}'
+            ' ELSE CAST(? AS INTEGER) END')
+        limit_parameters = [now, *(value for item in limits.items() for value in item), 2 ** 62]
+
+    job = db.execute(
+        "UPDATE Jobs SET status = 'running', attempts = attempts + 1, worker = ?, started = ?,"
+        '  lease_expires = ?'
+        ' WHERE id = ('
+        '  SELECT id FROM Jobs AS queued'
+        "  WHERE ((status = 'queued' AND run_after <= ?)"
+        "   OR (status = 'running' AND lease_expires < ?))"
+        f'  {limit_clause}'
+        '  ORDER BY priority DESC, id LIMIT 1'
+        ") AND (status = 'queued' OR (status = 'running' AND lease_expires < ?)) RETURNING *",
+        (worker, now, now + current_app.config['JOBS_LEASE'], now, now, *limit_parameters, now)
+    ).fetchone()
+    db.commit()
+
+    return job
+
+
+def run_job(job: open_trs.backends.Row):
+    """
+    Run a claimed job and record its outcome.
+
+    Failed attempts are retried after an exponential backoff of the config's `JOBS_RETRY_BACKOFF`
+    seconds, doubled for every attempt, until the job's `max_attempts` are used up.
+
+    Args:
+        job: The claimed job's row.
+    """
+
+    db = _get_queue_db()
+    function, _ = _HANDLERS[job['kind']]
+
+    def report_progress(progress: float):
+        # Reporting progress also renews the lease, so long jobs are not taken over by others
+        db.execute('UPDATE Jobs SET progress = ?, lease_expires = ? WHERE id = ?',
+                   (max(0.0, min(1.0, progress)),
+                    int(time.time()) + current_app.config['JOBS_LEASE'], job['id']))
+        db.commit()
+
+    if job['user'] is not None:
+        # Select the user's shard the same way an authenticated request does
+        g.user_id = job['user']
+
+    # Lets recurring jobs queue their next run while they still count as running, see `enqueue`
+    g.job_id = job['id']
+
+    try:
+        result = function(json.loads(job['payload']), report_progress)
+    except Exception:
+        open_trs.db.get_db().rollback()
+        db.rollback()
+
+        now = int(time.time())
+        error = traceback.format_exc(limit=5)
+
+        if job['attempts'] < job['max_attempts']:
+            backoff = current_app.config['JOBS_RETRY_BACKOFF'] * 2 ** (job['attempts'] - 1)
+            db.execute("UPDATE Jobs SET status = 'queued', run_after = ?, error = ? WHERE id = ?",
+                       (now + backoff, error, job['id']))
+        else:
+            db.execute("UPDATE Jobs SET status = 'failed', finished = ?, error = ? WHERE id = ?",
+                       (now, error, job['id']))
+
+        current_app.logger.exception('Job %s (%s) failed', job['id'], job['kind'])
+    else:
+        db.execute("UPDATE Jobs SET status = 'succeeded', progress = 1, result = ?, finished = ?"
+                   ' WHERE id = ?', (json.dumps(result), int(time.time()), job['id']))
+
+    db.commit()
+
+
+def work(worker: str, burst: bool = False) -> int:
+    """
+    Run jobs as they become runnable.
+
+    Every job runs in its own application context, so connections do not outlive it.
+
+    Args:
+        worker: The name of the worker.
+        burst (bool, optional): Stop once no job is runnable instead of polling every
+            `JOBS_POLL_INTERVAL` seconds; defaults to False.
+
+    Returns:
+        The number of jobs run.
+    """
+
+    app = current_app._get_current_object()
+    count = 0
+
+    while True:
+        with app.app_context():
+            job = claim_job(worker)
+
+            if job is not None:
+                run_job(job)
+                count += 1
+                continue
+
+        if burst:
+            return count
+
+        time.sleep(app.config['JOBS_POLL_INTERVAL'])
+
+
+@bp.route('/<int:job_id>', methods=['GET'])
+@open_trs.auth.login_required
+def get_job_status(user_id: int, job_id: int):
+    """
+    Get the status of one of the user's background jobs.
+
+    Args:
+        user_id: The user's ID.
+        job_id: The job's ID.
+
+    Returns:
+        A JSON response containing the job's status (queued, running, succeeded, or failed),
+        progress, attempts, and result.
+    """
+
+    job = get_job(job_id)
+
+    if job is None:
+        raise open_trs.InvalidUsage(f'Job {job_id} does not exist', 404)
+
+    if job['user'] != user_id:
+        raise open_trs.InvalidUsage('Forbidden', 403)
+
+    return jsonify({'job': job}), 200
+
+
+@click.command('worker')
+@click.option('--name', default=None, help='Name recorded on claimed jobs; defaults to host:pid.')
+@click.option('--burst', is_flag=True, help='Exit once the queue has no runnable jobs.')
+def worker_command(name: Optional[str], burst: bool):
+    """
+    Click command to run background jobs from the queue.
+    """
+
+    count = work(name or f'{socket.gethostname()}:{os.getpid()}', burst)
+    click.echo(f'Ran {count} jobs.')
+
+
+def init_app(app: Flask):
+    """
+    Initialize the Flask application.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+
+    app.cli.add_command(worker_command)
@@ -0,0 +1,174 @@
+import sqlite3
+import time
+from typing import Callable
+
+import click
+from flask import Flask, current_app, g
+
+import open_trs.backends
+import open_trs.db
+import open_trs.jobs
+
+# `PRAGMA auto_vacuum` value of databases whose free pages are reclaimed by incremental_vacuum
+_AUTO_VACUUM_INCREMENTAL = 2
+
+
+def optimize(db: open_trs.backends.Connection):
+    """
+    Let SQLite refresh the statistics of tables whose query plans may have drifted.
+
+    This is cheap enough to run whenever a connection is closed; the rows sampled per index are
+    bounded by the config's `MAINTENANCE_ANALYSIS_LIMIT`.
+
+    Args:
+        db: The database connection.
+    """
+
+    db.execute(f'PRAGMA analysis_limit = {int(current_app.config["MAINTENANCE_ANALYSIS_LIMIT"])}')
+    db.execute('PRAGMA optimize')
+
+
+def optimize_on_close(e: Exception = None):
+    """
+    Run `optimize` on the request's SQLite connections before `open_trs.db.close_db` closes them,
+    as SQLite recommends for short-lived connections, if the config's
+    `MAINTENANCE_OPTIMIZE_ON_CLOSE` is enabled.
+
+    Args:
+        e (Exception, optional): The exception that occurred, if any.
+    """
+
+    if not current_app.config['MAINTENANCE_OPTIMIZE_ON_CLOSE']:
+        return
+
+    for db in [g.get('db'), *g.get('shard_dbs', {}).values()]:
+        if db is None or not open_trs.backends.is_sqlite(db):
+            continue
+
+        try:
+            optimize(db)
+        except sqlite3.Error:
+            # A busy database is optimized by a later connection instead
+            current_app.logger.debug('Skipped PRAGMA optimize', exc_info=True)
+
+
+def maintain(db: open_trs.backends.Connection, full: bool = False) -> dict:
+    """
+    Run the periodic maintenance of a SQLite database.
+
+    Refreshes the query planner's statistics with `ANALYZE`, checkpoints and truncates the WAL if
+    the database uses one, and frees at most the config's `MAINTENANCE_VACUUM_PAGES` unused pages
+    with `incremental_vacuum`. A `full` maintenance instead rebuilds the database with `VACUUM`,
+    which blocks writers for its duration but converts databases created before incremental
+    vacuuming was enabled.
+
+    Args:
+        db: The database connection.
+        full (bool, optional): Rebuild the database with `VACUUM`; defaults to False.
+
+    Returns:
+        A dictionary of statistics: the `seconds` spent, the number of `bytes_reclaimed`, and the
+        `free_bytes` left in the database file.
+    """
+
+    start = time.perf_counter()
+    page_size = db.execute('PRAGMA page_size').fetchone()[0]
+
+    db.execute(f'PRAGMA analysis_limit = {int(current_app.config["MAINTENANCE_ANALYSIS_LIMIT"])}')
+    db.execute('ANALYZE')
+    db.commit()
+
+    if db.execute('PRAGMA journal_mode').fetchone()[0] == 'wal':
+        db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    page_count = db.execute('PRAGMA page_count').fetchone()[0]
+
+    if full:
+        db.execute(f'PRAGMA auto_vacuum = {_AUTO_VACUUM_INCREMENTAL}')
+        db.execute('VACUUM')
+    elif db.execute('PRAGMA auto_vacuum').fetchone()[0] == _AUTO_VACUUM_INCREMENTAL:
+        pages = int(current_app.config['MAINTENANCE_VACUUM_PAGES'])
+        # incremental_vacuum frees one page per step; unlike execute, executescript steps to the end
+        db.executescript(f'PRAGMA incremental_vacuum({pages});')
+
+    reclaimed_pages = page_count - db.execute('PRAGMA page_count').fetchone()[0]
+    free_pages = db.execute('PRAGMA freelist_count').fetchone()[0]
+
+    return {'seconds': time.perf_counter() - start,
+            'bytes_reclaimed': reclaimed_pages * page_size,
+            'free_bytes': free_pages * page_size}
+
+
+def maintain_all(full: bool = False) -> list:
+    """
+    Run `maintain` on the database and every shard, logging the time spent and bytes reclaimed.
+
+    Client-server databases are skipped, since they maintain themselves (e.g. PostgreSQL's
+    autovacuum).
+
+    Args:
+        full (bool, optional): Rebuild the databases with `VACUUM`; defaults to False.
+
+    Returns:
+        The statistics of every SQLite database maintained, in order, see `maintain`.
+    """
+
+    results = []
+
+    for db in open_trs.db.iter_dbs():
+        if not open_trs.backends.is_sqlite(db):
+            continue
+
+        stats = maintain(db, full)
+        results.append(stats)
+        current_app.logger.info('Database maintenance took %.3fs and reclaimed %d bytes',
+                                stats['seconds'], stats['bytes_reclaimed'])
+
+    return results
+
+
+@open_trs.jobs.handler('maintenance', concurrency=1)
+def _maintenance_job(payload: dict, report_progress: Callable[[float], None]) -> list:
+    try:
+        results = maintain_all()
+    finally:
+        # The next run is queued even if this one failed, so that free pages keep being returned
+        interval = current_app.config['MAINTENANCE_INTERVAL']
+
+        if interval:
+            open_trs.jobs.enqueue('maintenance', {}, delay=interval, unique=True)
+
+    return results
+
+
+@click.command('maintain')
+@click.option('--full', is_flag=True, help='Rebuild the databases with VACUUM, blocking writers.')
+@click.option('--schedule', is_flag=True, help='Queue a background job that repeats every'
+              ' MAINTENANCE_INTERVAL seconds.')
+def maintain_command(full: bool, schedule: bool):
+    """
+    Click command to analyze, checkpoint, and vacuum the database.
+    """
+
+    if schedule:
+        job_id = open_trs.jobs.enqueue('maintenance', {}, unique=True)
+        click.echo('A maintenance job is already scheduled.' if job_id is None
+                   else f'Queued maintenance job {job_id}.')
+        return
+
+    for stats in maintain_all(full):
+        click.echo(f'Maintenance took {stats["seconds"]:.2f}s, reclaimed'
+                   f' {stats["bytes_reclaimed"]} bytes, {stats["free_bytes"]} bytes still free.')
+
+
+def init_app(app: Flask):
+    """
+    Initialize the Flask application.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+
+    # Registered after `open_trs.db.init_app`, so it runs before the connections are closed
+    app.teardown_appcontext(optimize_on_close)
+    app.cli.add_command(maintain_command)
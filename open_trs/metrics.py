@@ -0,0 +1,80 @@
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from flask import Blueprint, current_app
+
+import open_trs
+
+# Counters of this worker process, keyed by name and sorted label pairs
+_counters = {}
+_lock = threading.Lock()
+
+bp = Blueprint('metrics', __name__)
+
+
+def _reset_after_fork():
+    """
+    Start the counters of a forked child, e.g. a gunicorn worker, from zero, so that each worker
+    only reports its own increments, and replace `_lock`, which a thread of the parent may have
+    held in `increment` while the child was forked.
+    """
+
+    global _lock
+
+    _counters.clear()
+    _lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def increment(name: str, labels: Optional[Dict[str, str]] = None, value: int = 1):
+    """
+    Add to a counter of this worker process.
+
+    Args:
+        name: The counter's name, e.g. "queries_aborted".
+        labels (dict, optional): Labels telling apart series of the counter, e.g. the endpoint;
+            defaults to None.
+        value (int, optional): The amount to add; defaults to 1.
+    """
+
+    key = (name, tuple(sorted((labels or {}).items())))
+
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def get_counters() -> Dict[Tuple[str, tuple], int]:
+    """
+    Get a copy of the counters of this worker process.
+
+    Returns:
+        The counters' values, keyed by name and sorted `(label, value)` pairs.
+    """
+
+    with _lock:
+        return dict(_counters)
+
+
+@bp.route('/metrics', methods=['GET'])
+def get_metrics():
+    """
+    Get the counters of the worker process serving the request, if the config's `METRICS_ENABLED`
+    is set.
+
+    Returns:
+        The counters in the Prometheus text exposition format.
+    """
+
+    if not current_app.config['METRICS_ENABLED']:
+        raise open_trs.InvalidUsage('Metrics are disabled', 404)
+
+    lines = []
+
+    for (name, labels), value in sorted(get_counters().items()):
+        label_text = ','.join(f'{label}="{label_value}"' for label, label_value in labels)
+        lines.append(f'open_trs_{name}_total{{{label_text}}} {value}')
+
+    return '\n'.join([*lines, '']), 200, {'Content-Type': 'text/plain; version=0.0.4'}
@@ -0,0 +1,39 @@
+-- Schema version 2: store Charges.date_charged as an integer day number (days since 1970-01-01)
+-- and key the Calendar dimension table by it.
+
+DROP TABLE IF EXISTS Calendar;
+
+CREATE TABLE Calendar (
+    day INTEGER PRIMARY KEY,
+    date TEXT UNIQUE NOT NULL,
+    iso_week TEXT NOT NULL,
+    month TEXT NOT NULL,
+    quarter TEXT NOT NULL,
+    year INTEGER NOT NULL
+);
+
+CREATE TABLE Charges_v2 (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project INTEGER NOT NULL,
+    user INTEGER NOT NULL,
+    hours INTEGER NOT NULL,
+    date_charged INTEGER NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (project) REFERENCES Projects (id),
+    FOREIGN KEY (user) REFERENCES Users (id)
+);
+
+INSERT INTO Charges_v2 (id, project, user, hours, date_charged, created)
+SELECT id, project, user, hours, CAST(julianday(date_charged) - 2440587.5 AS INTEGER), created
+FROM Charges;
+
+-- Keep AUTOINCREMENT from reusing the IDs of charges deleted before the migration
+UPDATE sqlite_sequence SET seq = (SELECT seq FROM sqlite_sequence WHERE name = 'Charges')
+WHERE name = 'Charges_v2' AND EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'Charges');
+
+DROP TABLE Charges;
+ALTER TABLE Charges_v2 RENAME TO Charges;
+
+CREATE INDEX IF NOT EXISTS idx_projects_owner ON Projects (owner);
+CREATE INDEX idx_charges_user_date ON Charges (user, date_charged);
+CREATE INDEX idx_charges_project_date ON Charges (project, date_charged);
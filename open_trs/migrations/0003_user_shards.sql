@@ -0,0 +1,7 @@
+-- Schema version 3: record which shard holds each user's projects and charges.
+
+CREATE TABLE IF NOT EXISTS UserShards (
+    user INTEGER PRIMARY KEY,
+    shard TEXT NOT NULL,
+    FOREIGN KEY (user) REFERENCES Users (id)
+);
@@ -0,0 +1,16 @@
+-- Schema version 4: allow a single charge per user, project and date so that charges can be
+-- upserted atomically.
+
+-- Fold duplicate charges into the oldest one before adding the constraint
+UPDATE Charges
+SET hours = (SELECT SUM(duplicate.hours) FROM Charges AS duplicate
+             WHERE duplicate.user = Charges.user AND duplicate.project = Charges.project
+             AND duplicate.date_charged = Charges.date_charged)
+WHERE id IN (SELECT MIN(id) FROM Charges GROUP BY user, project, date_charged HAVING COUNT(*) > 1);
+
+DELETE FROM Charges
+WHERE id NOT IN (SELECT MIN(id) FROM Charges GROUP BY user, project, date_charged);
+
+-- The unique index also serves every query idx_charges_project_date was used for
+DROP INDEX IF EXISTS idx_charges_project_date;
+CREATE UNIQUE INDEX idx_charges_user_project_date ON Charges (user, project, date_charged);
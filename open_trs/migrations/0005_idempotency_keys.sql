@@ -0,0 +1,14 @@
+-- Schema version 5: remember responses of create requests by their Idempotency-Key header.
+
+CREATE TABLE IdempotencyKeys (
+    user INTEGER NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    request_hash TEXT NOT NULL,
+    status_code INTEGER,
+    response TEXT,
+    created INTEGER NOT NULL,
+    PRIMARY KEY (user, idempotency_key),
+    FOREIGN KEY (user) REFERENCES Users (id)
+);
+
+CREATE INDEX idx_idempotency_keys_created ON IdempotencyKeys (created);
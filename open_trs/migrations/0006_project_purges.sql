@@ -0,0 +1,16 @@
+-- Schema version 6: soft-delete projects and purge their charges in the background.
+
+ALTER TABLE Projects ADD COLUMN deleted TIMESTAMP;
+
+CREATE TABLE Purges (
+    project INTEGER PRIMARY KEY,
+    user INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    deleted_charges INTEGER NOT NULL DEFAULT 0,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished TIMESTAMP,
+    FOREIGN KEY (user) REFERENCES Users (id)
+);
+
+CREATE INDEX idx_projects_deleted ON Projects (owner) WHERE deleted IS NOT NULL;
+CREATE INDEX idx_purges_status ON Purges (status);
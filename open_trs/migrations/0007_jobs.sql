@@ -0,0 +1,25 @@
+-- Schema version 7: durable queue of background jobs run by `flask worker`.
+
+CREATE TABLE Jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    user INTEGER,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    progress REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after INTEGER NOT NULL,
+    lease_expires INTEGER,
+    worker TEXT,
+    result TEXT,
+    error TEXT,
+    created INTEGER NOT NULL,
+    started INTEGER,
+    finished INTEGER,
+    FOREIGN KEY (user) REFERENCES Users (id)
+);
+
+CREATE INDEX idx_jobs_queue ON Jobs (status, priority DESC, id);
+CREATE INDEX idx_jobs_kind ON Jobs (kind, status);
@@ -0,0 +1,10 @@
+-- Schema version 8: closed years of charges archived to per-year files by `flask archive-charges`.
+
+CREATE TABLE Partitions (
+    year INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    first_day INTEGER NOT NULL,
+    last_day INTEGER NOT NULL,
+    charges INTEGER NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
@@ -0,0 +1,13 @@
+-- Schema version 9: change events streamed to clients by `GET /events/stream`.
+
+CREATE TABLE Events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user INTEGER NOT NULL,
+    topic TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created INTEGER NOT NULL,
+    FOREIGN KEY (user) REFERENCES Users (id)
+);
+
+CREATE INDEX idx_events_user ON Events (user, id);
+CREATE INDEX idx_events_created ON Events (created);
@@ -0,0 +1,12 @@
+-- Schema version 10: events move between shards with their user's projects and charges, so a
+-- shard allocates event IDs from its own range too, found from that of its project IDs.
+
+UPDATE Events SET id = id + (SELECT COALESCE(MAX(seq), 0) / 1099511627776 * 1099511627776
+                             FROM sqlite_sequence WHERE name = 'Projects');
+
+DELETE FROM sqlite_sequence WHERE name = 'Events';
+
+INSERT INTO sqlite_sequence (name, seq)
+SELECT 'Events', MAX(COALESCE((SELECT MAX(id) FROM Events), 0),
+                     (SELECT COALESCE(MAX(seq), 0) / 1099511627776 * 1099511627776
+                      FROM sqlite_sequence WHERE name = 'Projects'));
@@ -0,0 +1,8 @@
+-- Schema version 11: per-user counters of changes, which unlike events are never expired, for
+-- caches of users' data to tell whether it changed.
+
+CREATE TABLE DataVersions (
+    user INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    FOREIGN KEY (user) REFERENCES Users (id)
+);
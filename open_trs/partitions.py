@@ -0,0 +1,354 @@
+import datetime
+import os
+import sqlite3
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+import click
+from flask import Flask, current_app
+
+import open_trs.backends
+import open_trs.db
+
+# Columns copied to and read from archived partitions, in the order of the Charges table
+_CHARGE_COLUMNS = 'id, project, user, hours, date_charged, created'
+# SQLite's default SQLITE_MAX_ATTACHED, the most partitions a single query can read
+_MAX_ATTACHED = 10
+
+
+def get_partitions_dir() -> str:
+    """
+    Get the directory of archived partitions, whose paths in the Partitions table are relative to
+    it.
+
+    Returns:
+        The config's `PARTITIONS_DIR`, or `partitions` in the instance folder if it is not set.
+    """
+
+    return (current_app.config['PARTITIONS_DIR']
+            or os.path.join(current_app.instance_path, 'partitions'))
+
+
+def _get_first_hot_year() -> int:
+    return datetime.date.today().year - current_app.config['PARTITIONS_HOT_YEARS'] + 1
+
+
+def _attach(db: open_trs.backends.Connection, year: int, path: str) -> str:
+    """
+    Attach a year's partition to a connection, unless it already is.
+
+    Args:
+        db: The database connection.
+        year: The partition's year.
+        path: The partition's file, relative to the config's `PARTITIONS_DIR`.
+
+    Returns:
+        The schema name the partition is attached as.
+    """
+
+    schema = f'partition_{int(year)}'
+
+    if schema not in {row['name'] for row in db.execute('PRAGMA database_list')}:
+        db.execute(f'ATTACH DATABASE ? AS {schema}', (os.path.join(get_partitions_dir(), path),))
+
+    return schema
+
+
+def _attach_all(db: open_trs.backends.Connection,
+                partitions: List[open_trs.backends.Row]) -> List[Tuple[int, str]]:
+    for partition in partitions:
+        path = os.path.join(get_partitions_dir(), partition['path'])
+
+        if not os.path.exists(path):
+            raise RuntimeError(f'Archived partition {path} is missing')
+
+    return [(partition['year'], _attach(db, partition['year'], partition['path']))
+            for partition in partitions]
+
+
+def _detach_all(db: open_trs.backends.Connection):
+    for row in db.execute('PRAGMA database_list').fetchall():
+        if row['name'].startswith('partition_'):
+            db.execute(f'DETACH DATABASE {row["name"]}')
+
+
+def attach_partitions(db: open_trs.backends.Connection, first_day: Optional[int] = None,
+                      last_day: Optional[int] = None) -> List[Tuple[int, str]]:
+    """
+    Attach the archived partitions overlapping a range of days to a connection.
+
+    Args:
+        db: The database connection.
+        first_day (int, optional): The first day of the range; defaults to the first partition.
+        last_day (int, optional): The last day of the range; defaults to the last partition.
+
+    Returns:
+        A list of `(year, schema)` tuples, one per attached partition in order.
+    """
+
+    if not open_trs.backends.is_sqlite(db):
+        return []
+
+    partitions = db.execute(
+        'SELECT year, path FROM Partitions WHERE last_day >= ? AND first_day <= ? ORDER BY year',
+        (first_day if first_day is not None else -2 ** 62,
+         last_day if last_day is not None else 2 ** 62)).fetchall()
+
+    if len(partitions) > _MAX_ATTACHED:
+        raise open_trs.InvalidUsage(f'Date range cannot span more than {_MAX_ATTACHED} archived'
+                                    ' years', 400)
+
+    return _attach_all(db, partitions)
+
+
+def iter_partition_groups(db: open_trs.backends.Connection) -> Iterator[List[Tuple[int, str]]]:
+    """
+    Attach every archived partition to a connection, however many there are, at most
+    `_MAX_ATTACHED` at a time.
+
+    Partitions attached before are detached first, and every group is detached before the next
+    one is attached, which SQLite does not allow within a transaction: commit writes to a group
+    before asking for the next.
+
+    Args:
+        db: The database connection.
+
+    Yields:
+        Lists of `(year, schema)` tuples, one per attached partition in order.
+    """
+
+    if not open_trs.backends.is_sqlite(db):
+        return
+
+    partitions = db.execute('SELECT year, path FROM Partitions ORDER BY year').fetchall()
+    _detach_all(db)
+
+    for i in range(0, len(partitions), _MAX_ATTACHED):
+        yield _attach_all(db, partitions[i:i + _MAX_ATTACHED])
+        _detach_all(db)
+
+
+def _copy_partitions(db: open_trs.backends.Connection, user_id: Optional[int]) -> List[str]:
+    """
+    Copy the charges of all archived partitions into temporary tables, one per group of
+    partitions that can be attached together.
+
+    Args:
+        db: The database connection.
+        user_id (int, optional): The user whose charges are copied; defaults to all users.
+
+    Returns:
+        The names of the temporary tables.
+    """
+
+    user_clause, parameters = ('', []) if user_id is None else (' WHERE user = ?', [user_id])
+    tables = []
+
+    for i, partitions in enumerate(iter_partition_groups(db)):
+        table = f'temp.archived_charges_{i}'
+        selects = [f'SELECT {_CHARGE_COLUMNS} FROM {schema}.Charges{user_clause}'
+                   for _, schema in partitions]
+
+        # Creating a table from a query does not begin a transaction, which would keep the next
+        # group from being attached
+        db.execute(f'DROP TABLE IF EXISTS {table}')
+        db.execute(f'CREATE TABLE {table} AS {" UNION ALL ".join(selects)}',
+                   parameters * len(partitions))
+        tables.append(table)
+
+    return tables
+
+
+def get_charges_source(db: open_trs.backends.Connection, first_day: Optional[int] = None,
+                       last_day: Optional[int] = None, user_id: Optional[int] = None) -> str:
+    """
+    Get the `FROM` expression reading the charges of a range of days.
+
+    This is just the Charges table unless the range reaches into archived years, in which case
+    their partitions are attached and combined with it under the alias Charges, so queries can
+    filter and join it as usual. A range may overlap at most `_MAX_ATTACHED` archived years;
+    without a range, the charges of more archived years than that are copied into temporary
+    tables first, a group of partitions at a time.
+
+    Args:
+        db: The database connection.
+        first_day (int, optional): The first day read; defaults to all archived years.
+        last_day (int, optional): The last day read; defaults to all archived years.
+        user_id (int, optional): The user whose charges are read, which limits what is copied
+            without a range; defaults to all users.
+
+    Returns:
+        The `FROM` expression.
+    """
+
+    if (first_day is None and last_day is None and open_trs.backends.is_sqlite(db)
+            and db.execute('SELECT COUNT(*) FROM Partitions').fetchone()[0] > _MAX_ATTACHED):
+        selects = [f'SELECT {_CHARGE_COLUMNS} FROM main.Charges',
+                   *(f'SELECT {_CHARGE_COLUMNS} FROM {table}'
+                     for table in _copy_partitions(db, user_id))]
+
+        return f'({" UNION ALL ".join(selects)}) AS Charges'
+
+    partitions = attach_partitions(db, first_day, last_day)
+
+    if not partitions:
+        return 'Charges'
+
+    selects = [f'SELECT {_CHARGE_COLUMNS} FROM main.Charges',
+               *(f'SELECT {_CHARGE_COLUMNS} FROM {schema}.Charges' for _, schema in partitions)]
+
+    return f'({" UNION ALL ".join(selects)}) AS Charges'
+
+
+def check_not_archived(db: open_trs.backends.Connection, years: Iterable[int]):
+    """
+    Reject writes to charges of archived years, which are read-only.
+
+    Args:
+        db: The database connection.
+        years: The years of the charges written.
+    """
+
+    years = sorted(set(years))
+
+    if not years:
+        return
+
+    years_sql, years_parameters = open_trs.db.bind_values(db, years)
+    archived = db.execute(f'SELECT year FROM Partitions WHERE year IN {years_sql}'
+                          ' ORDER BY year LIMIT 1', years_parameters).fetchone()
+
+    if archived is not None:
+        raise open_trs.InvalidUsage(f'Charges of {archived["year"]} are archived and cannot be'
+                                    ' changed', 400)
+
+
+def archive_year(db: open_trs.backends.Connection, name: str, year: int) -> int:
+    """
+    Move the charges of a year out of the Charges table into the year's partition file.
+
+    The copy and the delete run in a single transaction. Archiving a year again, e.g. after
+    restoring charges into it, appends to its partition.
+
+    Args:
+        db: The database connection.
+        name: The database's name, "main" or a key of the config's `DATABASE_SHARDS`; partitions
+            of different databases are kept apart.
+        year: The year to archive.
+
+    Returns:
+        The number of charges moved.
+    """
+
+    first_day = open_trs.db.date_to_day(datetime.date(year, 1, 1))
+    last_day = open_trs.db.date_to_day(datetime.date(year, 12, 31))
+    path = os.path.join(name, f'charges-{year}.sqlite')
+
+    if db.execute('SELECT 1 FROM main.Charges WHERE date_charged BETWEEN ? AND ? LIMIT 1',
+                  (first_day, last_day)).fetchone() is None:
+        return 0
+
+    os.makedirs(os.path.join(get_partitions_dir(), name), exist_ok=True)
+
+    schema = _attach(db, year, path)
+
+    try:
+        db.execute(f'CREATE TABLE IF NOT EXISTS {schema}.Charges AS'
+                   f' SELECT {_CHARGE_COLUMNS} FROM main.Charges WHERE 0')
+        db.execute(f'CREATE INDEX IF NOT EXISTS {schema}.idx_charges_user_date'
+                   ' ON Charges (user, date_charged)')
+
+        count = db.execute(f'INSERT INTO {schema}.Charges ({_CHARGE_COLUMNS})'
+                           f' SELECT {_CHARGE_COLUMNS} FROM main.Charges'
+                           ' WHERE date_charged BETWEEN ? AND ?', (first_day, last_day)).rowcount
+        db.execute('DELETE FROM main.Charges WHERE date_charged BETWEEN ? AND ?',
+                   (first_day, last_day))
+        db.execute('INSERT INTO Partitions (year, path, first_day, last_day, charges)'
+                   ' VALUES (?, ?, ?, ?, ?)'
+                   ' ON CONFLICT (year) DO UPDATE SET charges = charges + excluded.charges',
+                   (year, path, first_day, last_day, count))
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+    finally:
+        db.execute(f'DETACH DATABASE {schema}')
+
+    return count
+
+
+def archive(year: Optional[int] = None) -> List[Tuple[str, int, int]]:
+    """
+    Archive closed years of the database and every shard.
+
+    Only years before the newest `PARTITIONS_HOT_YEARS` can be archived, so the Charges table and
+    its indexes stay the size of those years however much history accumulates.
+
+    Args:
+        year (int, optional): The year to archive; defaults to every closed year with charges.
+
+    Returns:
+        A list of `(name, year, charges)` tuples, one per archived year of each database.
+    """
+
+    first_hot_year = _get_first_hot_year()
+
+    if year is not None and year >= first_hot_year:
+        raise RuntimeError(f'Only years before {first_hot_year} can be archived')
+
+    names = ['main', *current_app.config['DATABASE_SHARDS']]
+    results = []
+
+    for name, db in zip(names, open_trs.db.iter_dbs()):
+        if not open_trs.backends.is_sqlite(db):
+            raise RuntimeError('Archiving is only supported for SQLite databases, use the'
+                               " database server's own partitioning instead")
+
+        if year is not None:
+            years = [year]
+        else:
+            cutoff = open_trs.db.date_to_day(datetime.date(first_hot_year, 1, 1))
+            first_day = db.execute('SELECT MIN(date_charged) FROM Charges WHERE date_charged < ?',
+                                   (cutoff,)).fetchone()[0]
+
+            if first_day is None:
+                continue
+
+            years = range(open_trs.db.day_to_date(first_day).year, first_hot_year)
+
+        for archived_year in years:
+            count = archive_year(db, name, archived_year)
+
+            if count:
+                results.append((name, archived_year, count))
+
+    return results
+
+
+@click.command('archive-charges')
+@click.option('--year', type=int, default=None,
+              help='Year to archive; defaults to every year before PARTITIONS_HOT_YEARS.')
+def archive_charges_command(year: Optional[int]):
+    """
+    Click command to move charges of closed years into per-year partition files.
+    """
+
+    try:
+        results = archive(year)
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    for name, archived_year, count in results:
+        click.echo(f'Archived {count} charges of {archived_year} from {name}.')
+
+    click.echo(f'Archived {len(results)} partitions.')
+
+
+def init_app(app: Flask):
+    """
+    Initialize the Flask application.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+
+    app.cli.add_command(archive_charges_command)
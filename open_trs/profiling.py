@@ -0,0 +1,283 @@
+import collections
+import hmac
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+
+from flask import Flask, current_app, g, request
+from werkzeug.wrappers import Response
+
+import open_trs.metrics
+
+# Allocation sites listed in the summary of a profiled request
+_TOP_ALLOCATIONS = 25
+
+# Requests currently tracing allocations; tracing is process-wide, so it runs while any does
+_tracing_requests = 0
+_tracing_lock = threading.Lock()
+
+
+def _reset_after_fork():
+    """
+    Stop the tracing inherited by a forked child, e.g. a gunicorn worker, from requests of the
+    parent, which never finish in the child, and replace `_tracing_lock`, which one of them may
+    have held while the child was forked.
+    """
+
+    global _tracing_requests, _tracing_lock
+
+    if _tracing_requests:
+        import tracemalloc
+
+        tracemalloc.stop()
+
+    _tracing_requests = 0
+    _tracing_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class _Sampler(threading.Thread):
+    """
+    Thread sampling the stack of a request's thread at a fixed interval, counting collapsed stacks.
+    """
+
+    def __init__(self, thread_id: int, interval: float):
+        """
+        Initialize a new _Sampler.
+
+        Args:
+            thread_id: The identifier of the thread to sample.
+            interval: Seconds between samples.
+        """
+
+        super().__init__(name='open_trs-profiling-sampler', daemon=True)
+
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+
+            while frame is not None:
+                names.append(f'{frame.f_globals.get("__name__", "?")}:{frame.f_code.co_name}')
+                frame = frame.f_back
+
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def stop(self) -> str:
+        """
+        Stop sampling.
+
+        Returns:
+            The samples as collapsed stacks, one `frame;frame;... count` line per distinct stack,
+            as read by flame graph tools.
+        """
+
+        self.stopped.set()
+        self.join()
+
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class _Profile:
+    """
+    The profile of a single request: deterministic with allocations when requested, sampled
+    otherwise.
+    """
+
+    def __init__(self, detailed: bool):
+        """
+        Initialize and start a new _Profile.
+
+        Args:
+            detailed: Whether to trace every call with `cProfile` and allocations with
+                `tracemalloc`, instead of sampling the stack.
+        """
+
+        global _tracing_requests
+
+        self.id = f'{time.strftime("%Y%m%dT%H%M%S")}-{request.endpoint}-{uuid.uuid4().hex[:8]}'
+        self.profiler = None
+        self.sampler = None
+        self.snapshot = None
+
+        if not detailed:
+            self.sampler = _Sampler(threading.get_ident(),
+                                    current_app.config['PROFILING_INTERVAL'])
+            self.sampler.start()
+            return
+
+        # The profilers are only loaded by workers that are asked for a detailed profile
+        import cProfile
+        import tracemalloc
+
+        with _tracing_lock:
+            if _tracing_requests == 0:
+                tracemalloc.start()
+
+            _tracing_requests += 1
+
+        self.snapshot = tracemalloc.take_snapshot()
+        self.profiler = cProfile.Profile()
+
+        try:
+            self.profiler.enable()
+        except ValueError:
+            # Interpreters with a single process-wide profiler refuse concurrent profiles
+            self.profiler = None
+
+    def stop(self, directory: str):
+        """
+        Stop profiling and write the profile's files, named after its ID, to a directory.
+
+        Sampled profiles are written as collapsed stacks (`.collapsed`); detailed ones as `pstats`
+        data (`.pstats`) and a summary of the largest allocation sites (`.allocations.txt`).
+
+        Args:
+            directory: The directory to write to.
+        """
+
+        global _tracing_requests
+
+        path = os.path.join(directory, self.id)
+
+        if self.sampler is not None:
+            stacks = self.sampler.stop()
+
+            with open(f'{path}.collapsed', 'w') as file:
+                file.write(stacks)
+
+            return
+
+        import tracemalloc
+
+        if self.profiler is not None:
+            self.profiler.disable()
+            self.profiler.dump_stats(f'{path}.pstats')
+
+        statistics = tracemalloc.take_snapshot().compare_to(self.snapshot, 'lineno')
+
+        with _tracing_lock:
+            _tracing_requests -= 1
+
+            if _tracing_requests == 0:
+                tracemalloc.stop()
+
+        with open(f'{path}.allocations.txt', 'w') as file:
+            file.writelines(f'{statistic}\n' for statistic in statistics[:_TOP_ALLOCATIONS])
+
+
+def _get_profiles_dir() -> str:
+    """
+    Get the directory profiles are written to, creating it if needed.
+
+    Returns:
+        The config's `PROFILING_DIR`, or `instance/profiles` if it is not set.
+    """
+
+    directory = (current_app.config['PROFILING_DIR']
+                 or os.path.join(current_app.instance_path, 'profiles'))
+    os.makedirs(directory, exist_ok=True)
+
+    return directory
+
+
+def _prune_profiles(directory: str):
+    """
+    Delete the oldest profiles beyond the config's `PROFILING_KEEP`.
+
+    Args:
+        directory: The directory profiles are written to.
+    """
+
+    paths = sorted((entry.path for entry in os.scandir(directory) if entry.is_file()),
+                   key=os.path.getmtime)
+
+    for path in paths[:-current_app.config['PROFILING_KEEP'] or None]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def start_profile():
+    """
+    Start profiling the current request, if it was asked for or it is sampled.
+
+    Requests whose `X-Profile` header holds the config's `PROFILING_TOKEN` get a detailed profile,
+    while a `PROFILING_SAMPLE_RATE` fraction of all requests get a low-overhead sampled one.
+    """
+
+    token = current_app.config['PROFILING_TOKEN']
+    header = request.headers.get('X-Profile')
+
+    if token and header and hmac.compare_digest(header.encode(), token.encode()):
+        g.profile = _Profile(detailed=True)
+    elif random.random() < current_app.config['PROFILING_SAMPLE_RATE']:
+        g.profile = _Profile(detailed=False)
+
+
+def add_profile_header(response: Response) -> Response:
+    """
+    Tell the client the ID of the profile of the current request, if any.
+
+    Args:
+        response: The response to the request.
+
+    Returns:
+        The response, with an `X-Profile-Id` header if the request is profiled.
+    """
+
+    if 'profile' in g:
+        response.headers['X-Profile-Id'] = g.profile.id
+
+    return response
+
+
+def stop_profile(e: Exception = None):
+    """
+    Stop profiling the current request, if it is profiled, and store its profile.
+
+    Args:
+        e (Exception, optional): The exception that occurred, if any.
+    """
+
+    profile = g.pop('profile', None)
+
+    if profile is None:
+        return
+
+    try:
+        directory = _get_profiles_dir()
+        profile.stop(directory)
+        _prune_profiles(directory)
+    except OSError:
+        current_app.logger.warning('Unable to store profile %s', profile.id, exc_info=True)
+        return
+
+    open_trs.metrics.increment('requests_profiled', {'endpoint': request.endpoint})
+
+
+def init_app(app: Flask):
+    """
+    Initialize the Flask application.
+
+    Must be called before other modules register request hooks, so that profiles cover them.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+
+    app.before_request(start_profile)
+    app.after_request(add_profile_header)
+    app.teardown_request(stop_profile)
@@ -1,15 +1,59 @@
+from typing import Dict, List, Set
+
 from flask import Blueprint, jsonify, request
 
+import open_trs.backends
+import open_trs.coalesce
 import open_trs.db
+import open_trs.events
 import open_trs.auth
+import open_trs.idempotency
+import open_trs.purge
 
 _UPDATABLE_FIELDS = [('name', str), ('description', str), ('category', int)]
+# Rows per INSERT statement of bulk requests, bounding the parameters of backends binding each value
+_INSERT_CHUNK_SIZE = 200
 
 bp = Blueprint('projects', __name__, url_prefix='/projects')
 
 
+def _soft_delete_projects(db: open_trs.backends.Connection, user_id: int, project_ids: List[int]):
+    """
+    Hide projects and their charges, and queue the charges for purging, without committing.
+
+    Args:
+        db: The database connection.
+        user_id: The user's ID.
+        project_ids: The IDs of the projects to delete.
+    """
+
+    ids_sql, ids_parameters = open_trs.db.bind_values(db, project_ids)
+    db.execute('UPDATE Projects SET deleted = CURRENT_TIMESTAMP'
+               f' WHERE owner = ? AND id IN {ids_sql}', (user_id, *ids_parameters))
+    db.executemany('INSERT INTO Purges (project, user) VALUES (?, ?)',
+                   [(project_id, user_id) for project_id in project_ids])
+
+
+def _get_purge(db: open_trs.backends.Connection, project_id: int) -> dict:
+    """
+    Get the status of a project's purge.
+
+    Args:
+        db: The database connection.
+        project_id: The project's ID.
+
+    Returns:
+        A dictionary of the Purges row, or None if the project has not been deleted.
+    """
+
+    purge = db.execute('SELECT * FROM Purges WHERE project = ?', (project_id,)).fetchone()
+
+    return None if purge is None else dict(purge)
+
+
 @bp.route('/', methods=['GET'])
 @open_trs.auth.login_required
+@open_trs.coalesce.coalesced
 def get_projects(user_id: int):
     """
     Get all projects owned by the user.
@@ -20,7 +64,7 @@ def get_projects(user_id: int):
 
     db = open_trs.db.get_db()
 
-    projects = db.execute('SELECT * FROM Projects WHERE owner = ? ORDER BY id',
+    projects = db.execute('SELECT * FROM Projects WHERE owner = ? AND deleted IS NULL ORDER BY id',
                           (user_id,)).fetchall()
 
     return jsonify({'projects': [dict(project) for project in projects]}), 200
@@ -40,7 +84,7 @@ def get_project(user_id: int, project_id: int):
     db = open_trs.db.get_db()
 
     project = db.execute(
-        'SELECT * FROM Projects WHERE id = ?', (project_id, )).fetchone()
+        'SELECT * FROM Projects WHERE id = ? AND deleted IS NULL', (project_id, )).fetchone()
 
     if project is None:
         raise open_trs.InvalidUsage(f'Project {project_id} does not exist', 404)
@@ -53,6 +97,7 @@ def get_project(user_id: int, project_id: int):
 
 @bp.route('/create', methods=['POST'])
 @open_trs.auth.login_required
+@open_trs.idempotency.idempotent
 def create_project(user_id: int):
     """
     Create a new project.
@@ -74,19 +119,18 @@ def create_project(user_id: int):
 
     db = open_trs.db.get_db()
     existing_project = db.execute(
-        'SELECT name FROM Projects WHERE name = ? AND owner = ?', (name, user_id)).fetchone()
+        'SELECT name FROM Projects WHERE name = ? AND owner = ? AND deleted IS NULL',
+        (name, user_id)).fetchone()
 
     if existing_project is not None:
         raise open_trs.InvalidUsage(f'A project named "{name}" already exists for this user', 400)
 
-    db.execute(
+    project = db.execute(
         'INSERT INTO Projects (owner, name, category, description)'
-        ' VALUES (?, ?, ?, ?)', (user_id, name, category, description))
+        ' VALUES (?, ?, ?, ?) RETURNING *', (user_id, name, category, description)).fetchone()
+    open_trs.events.publish(db, user_id, 'projects', {'action': 'created', 'ids': [project['id']]})
     db.commit()
 
-    project = db.execute('SELECT * FROM Projects WHERE name = ? AND owner = ?',
-                         (name, user_id)).fetchone()
-
     return jsonify({'message': 'Project created successfully', 'project': dict(project)}), 201
 
 
@@ -104,7 +148,7 @@ def update_project(user_id: int, project_id: int):
     request_json = request.get_json()
 
     db = open_trs.db.get_db()
-    project = db.execute('SELECT * FROM Projects WHERE id = ?',
+    project = db.execute('SELECT * FROM Projects WHERE id = ? AND deleted IS NULL',
                          (project_id,)).fetchone()
 
     if project is None:
@@ -131,6 +175,7 @@ def update_project(user_id: int, project_id: int):
     update_values.extend([user_id, project_id])
 
     db.execute(update_query, update_values)
+    open_trs.events.publish(db, user_id, 'projects', {'action': 'updated', 'ids': [project_id]})
     db.commit()
 
     return jsonify({'message': f'Project {project_id} updated successfully',
@@ -143,13 +188,20 @@ def delete_project(user_id: int, project_id: int):
     """
     Delete a project and its associated charges.
 
+    The project is hidden immediately, along with its charges, which are then purged in small
+    chunks by a background job (see `open_trs.purge`) so that deleting a large project does not
+    stall other writers.
+
     Args:
         user_id: The user's ID.
         project_id: The project's ID.
+
+    Returns:
+        A JSON response containing the status of the purge and the ID of the job running it.
     """
 
     db = open_trs.db.get_db()
-    project = db.execute('SELECT * FROM Projects WHERE id = ?',
+    project = db.execute('SELECT * FROM Projects WHERE id = ? AND deleted IS NULL',
                          (project_id,)).fetchone()
 
     if project is None:
@@ -158,8 +210,255 @@ def delete_project(user_id: int, project_id: int):
     if project['owner'] != user_id:
         raise open_trs.InvalidUsage('Forbidden', 403)
 
-    db.execute('DELETE FROM Charges WHERE project = ? and user = ?', (project_id, user_id))
-    db.execute('DELETE FROM Projects WHERE owner = ? AND id = ?', (user_id, project_id))
+    _soft_delete_projects(db, user_id, [project_id])
+    open_trs.events.publish(db, user_id, 'projects', {'action': 'deleted', 'ids': [project_id]})
     db.commit()
 
-    return jsonify({'message': f'Project {project_id} deleted successfully'}), 200
+    job_id = open_trs.purge.start_purge(user_id, project_id)
+
+    return jsonify({'message': f'Project {project_id} deleted successfully',
+                    'purge': _get_purge(db, project_id),
+                    'job': job_id}), 200
+
+
+@bp.route('/<int:project_id>/purge', methods=['GET'])
+@open_trs.auth.login_required
+def get_purge(user_id: int, project_id: int):
+    """
+    Get the status of the purge of a deleted project's charges.
+
+    Args:
+        user_id: The user's ID.
+        project_id: The project's ID.
+
+    Returns:
+        A JSON response containing the purge's status (pending, running, or done) and the number
+        of charges deleted so far.
+    """
+
+    db = open_trs.db.get_db()
+    purge = _get_purge(db, project_id)
+
+    if purge is None:
+        raise open_trs.InvalidUsage(f'Project {project_id} has not been deleted', 404)
+
+    if purge['user'] != user_id:
+        raise open_trs.InvalidUsage('Forbidden', 403)
+
+    return jsonify({'purge': purge}), 200
+
+
+def _validate_bulk_creates(creates: List[dict]) -> List[tuple]:
+    """
+    Validate the projects to be created by a bulk request.
+
+    Args:
+        creates: List of new projects.
+
+    Returns:
+        A list of `(name, category, description)` tuples.
+    """
+
+    new_projects = []
+
+    for project in creates:
+        if not isinstance(project, dict):
+            raise open_trs.InvalidUsage('Invalid project, use an object', 400)
+
+        name = project.get('name')
+        category = project.get('category', 0)
+        description = project.get('description')
+
+        if not name or not isinstance(name, str):
+            raise open_trs.InvalidUsage('Project name is required', 400)
+        elif not isinstance(category, int) or isinstance(category, bool) or category < 0:
+            raise open_trs.InvalidUsage('Invalid category', 400)
+        elif description is not None and not isinstance(description, str):
+            raise open_trs.InvalidUsage('Invalid description', 400)
+
+        new_projects.append((name, category, description))
+
+    return new_projects
+
+
+def _validate_bulk_updates(updates: List[dict]) -> Dict[int, dict]:
+    """
+    Validate the project updates of a bulk request, keeping only the fields that would be updated
+    by `update_project`.
+
+    Args:
+        updates: List of project updates, each containing the project's `id`.
+
+    Returns:
+        A dictionary of the fields to update, keyed by project ID.
+    """
+
+    updated_projects = {}
+
+    for project in updates:
+        if not isinstance(project, dict):
+            raise open_trs.InvalidUsage('Invalid project, use an object', 400)
+
+        project_id = project.get('id')
+
+        if not project_id or not isinstance(project_id, int):
+            raise open_trs.InvalidUsage('Project ID required', 400)
+        elif project_id in updated_projects:
+            raise open_trs.InvalidUsage(f'Project {project_id} is updated more than once', 400)
+
+        fields = {field: project[field] for field, type in _UPDATABLE_FIELDS
+                  if project.get(field) and isinstance(project[field], type)}
+
+        if not fields:
+            raise open_trs.InvalidUsage(f'Nothing to update for project {project_id}', 400)
+
+        updated_projects[project_id] = fields
+
+    return updated_projects
+
+
+def _check_bulk_names(db: open_trs.backends.Connection, user_id: int, new_projects: List[tuple],
+                      updated_projects: Dict[int, dict], deleted_ids: Set[int]):
+    """
+    Check that a bulk request leaves the user with uniquely named projects, using one query for
+    all of the names it assigns.
+
+    Args:
+        db: The database connection.
+        user_id: The user's ID.
+        new_projects: The validated projects to be created.
+        updated_projects: The validated project updates.
+        deleted_ids: The IDs of the projects to be deleted.
+    """
+
+    assigned_names = [name for name, _, _ in new_projects]
+    assigned_names.extend(fields['name'] for fields in updated_projects.values()
+                          if 'name' in fields)
+
+    if not assigned_names:
+        return
+
+    seen_names = set()
+
+    for name in assigned_names:
+        if name in seen_names:
+            raise open_trs.InvalidUsage(f'Project name "{name}" is used more than once', 400)
+
+        seen_names.add(name)
+
+    names_sql, names_parameters = open_trs.db.bind_values(db, list(seen_names))
+    existing_projects = db.execute(
+        'SELECT id, name FROM Projects WHERE owner = ? AND deleted IS NULL'
+        f' AND name IN {names_sql}', (user_id, *names_parameters)).fetchall()
+
+    for project in existing_projects:
+        # Names held by projects that this request deletes or renames are checked above instead
+        new_name = updated_projects.get(project['id'], {}).get('name')
+
+        if project['id'] in deleted_ids or new_name is not None:
+            continue
+
+        raise open_trs.InvalidUsage(
+            f'A project named "{project["name"]}" already exists for this user', 400)
+
+
+@bp.route('/bulk', methods=['POST'])
+@open_trs.auth.login_required
+@open_trs.idempotency.idempotent
+def bulk_projects(user_id: int):
+    """
+    Create, update, and delete many projects in a single transaction.
+
+    The request may contain `create` (a list of new projects), `update` (a list of project updates,
+    each with the project's `id`), and `delete` (a list of project IDs). Deletes are applied first,
+    then updates, then creates, so a request may reuse the names it frees; if any operation is
+    invalid nothing is changed. Deleted projects' charges are purged like by `delete_project`.
+
+    Args:
+        user_id: The user's ID.
+
+    Returns:
+        A JSON response containing the created and updated projects and the deleted project IDs.
+    """
+
+    request_json = request.get_json()
+    creates = request_json.get('create') or []
+    updates = request_json.get('update') or []
+    deletes = request_json.get('delete') or []
+
+    if not creates and not updates and not deletes:
+        raise open_trs.InvalidUsage('No operations provided', 400)
+    elif not all(isinstance(operations, list) for operations in (creates, updates, deletes)):
+        raise open_trs.InvalidUsage('Create, update, and delete must be lists', 400)
+    elif not all(isinstance(project_id, int) and not isinstance(project_id, bool)
+                 for project_id in deletes):
+        raise open_trs.InvalidUsage('Project ID required', 400)
+
+    new_projects = _validate_bulk_creates(creates)
+    updated_projects = _validate_bulk_updates(updates)
+    deleted_ids = set(deletes)
+
+    if deleted_ids & updated_projects.keys():
+        raise open_trs.InvalidUsage('A project cannot be both updated and deleted', 400)
+
+    db = open_trs.db.get_db()
+
+    # Check that all referenced projects exist and are owned by the user
+    project_ids = deleted_ids | updated_projects.keys()
+
+    if project_ids:
+        ids_sql, ids_parameters = open_trs.db.bind_values(db, list(project_ids))
+        projects = db.execute(
+            f'SELECT id, owner FROM Projects WHERE id IN {ids_sql} AND deleted IS NULL',
+            ids_parameters).fetchall()
+
+        missing_ids = project_ids - {project['id'] for project in projects}
+
+        if missing_ids:
+            raise open_trs.InvalidUsage(f'Project {min(missing_ids)} does not exist', 404)
+
+        for project in projects:
+            if project['owner'] != user_id:
+                raise open_trs.InvalidUsage('Forbidden', 403)
+
+    _check_bulk_names(db, user_id, new_projects, updated_projects, deleted_ids)
+
+    if deleted_ids:
+        _soft_delete_projects(db, user_id, sorted(deleted_ids))
+
+    updated = []
+
+    for project_id, fields in updated_projects.items():
+        updated.append(db.execute(
+            'UPDATE Projects SET name = COALESCE(?, name), description = COALESCE(?, description),'
+            ' category = COALESCE(?, category) WHERE owner = ? AND id = ? RETURNING *',
+            (fields.get('name'), fields.get('description'), fields.get('category'), user_id,
+             project_id)).fetchone())
+
+    created = []
+
+    for i in range(0, len(new_projects), _INSERT_CHUNK_SIZE):
+        rows_sql, rows_parameters = open_trs.db.bind_rows(
+            db, [(user_id, *project) for project in new_projects[i:i + _INSERT_CHUNK_SIZE]], 4)
+        created.extend(db.execute(
+            f'INSERT INTO Projects (owner, name, category, description) {rows_sql} RETURNING *',
+            rows_parameters).fetchall())
+
+    for action, ids in (('deleted', sorted(deleted_ids)),
+                        ('updated', sorted(updated_projects)),
+                        ('created', sorted(project['id'] for project in created))):
+        if ids:
+            open_trs.events.publish(db, user_id, 'projects', {'action': action, 'ids': ids})
+
+    db.commit()
+
+    for project_id in sorted(deleted_ids):
+        open_trs.purge.start_purge(user_id, project_id)
+
+    return jsonify({'message': f'Successfully created {len(created)}, updated {len(updated)},'
+                               f' and deleted {len(deleted_ids)} projects',
+                    'created': sorted((dict(project) for project in created),
+                                      key=lambda project: project['id']),
+                    'updated': sorted((dict(project) for project in updated),
+                                      key=lambda project: project['id']),
+                    'deleted': sorted(deleted_ids)}), 200
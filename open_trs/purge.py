@@ -0,0 +1,102 @@
+import time
+from typing import Callable, Optional
+
+from flask import current_app
+
+import open_trs.backends
+import open_trs.db
+import open_trs.jobs
+import open_trs.partitions
+
+
+def purge_project(db: open_trs.backends.Connection, user_id: int, project_id: int,
+                  report_progress: Optional[Callable[[float], None]] = None) -> int:
+    """
+    Delete the charges of a soft-deleted project in small chunks, then the project itself.
+
+    Every chunk is committed on its own and followed by a pause of the config's `PURGE_PAUSE`
+    seconds, so the write lock is only ever held briefly and other writers are not stalled by
+    large projects. Charges of archived years are deleted from their partitions last. The progress
+    is recorded in the Purges table; an interrupted purge can simply be run again.
+
+    Args:
+        db: The database connection.
+        user_id: The ID of the project's owner.
+        project_id: The project's ID.
+        report_progress (callable, optional): Called with the fraction of charges deleted after
+            every chunk; defaults to None.
+
+    Returns:
+        The number of charges deleted.
+    """
+
+    chunk_size = current_app.config['PURGE_CHUNK_SIZE']
+    total = db.execute('SELECT COUNT(*) FROM Charges WHERE user = ? AND project = ?',
+                       (user_id, project_id)).fetchone()[0]
+    deleted = 0
+
+    db.execute("UPDATE Purges SET status = 'running' WHERE project = ?", (project_id,))
+    db.commit()
+
+    while True:
+        count = db.execute(
+            'DELETE FROM Charges WHERE id IN ('
+            '  SELECT id FROM Charges WHERE user = ? AND project = ? LIMIT ?)',
+            (user_id, project_id, chunk_size)).rowcount
+        db.execute('UPDATE Purges SET deleted_charges = deleted_charges + ? WHERE project = ?',
+                   (count, project_id))
+        db.commit()
+
+        deleted += count
+
+        if count < chunk_size:
+            break
+
+        if report_progress is not None:
+            report_progress(deleted / max(total, 1))
+
+        time.sleep(current_app.config['PURGE_PAUSE'])
+
+    for partitions in open_trs.partitions.iter_partition_groups(db):
+        for year, schema in partitions:
+            count = db.execute(f'DELETE FROM {schema}.Charges WHERE user = ? AND project = ?',
+                               (user_id, project_id)).rowcount
+            db.execute('UPDATE Partitions SET charges = charges - ? WHERE year = ?',
+                       (count, year))
+            db.execute('UPDATE Purges SET deleted_charges = deleted_charges + ?'
+                       ' WHERE project = ?', (count, project_id))
+            db.commit()
+
+            deleted += count
+
+    db.execute('DELETE FROM Projects WHERE owner = ? AND id = ?', (user_id, project_id))
+    db.execute("UPDATE Purges SET status = 'done', finished = CURRENT_TIMESTAMP"
+               ' WHERE project = ?', (project_id,))
+    db.commit()
+
+    return deleted
+
+
+# Purges are throttled anyway; running them one at a time keeps write latency flat for others
+@open_trs.jobs.handler('purge_project', concurrency=1)
+def _purge_project_job(payload: dict, report_progress: Callable[[float], None]) -> dict:
+    deleted = purge_project(open_trs.db.get_db(), payload['user'], payload['project'],
+                            report_progress)
+
+    return {'deleted_charges': deleted}
+
+
+def start_purge(user_id: int, project_id: int) -> int:
+    """
+    Queue the purge of a soft-deleted project whose Purges row has been committed.
+
+    Args:
+        user_id: The ID of the project's owner.
+        project_id: The project's ID.
+
+    Returns:
+        The ID of the background job running the purge.
+    """
+
+    return open_trs.jobs.enqueue('purge_project', {'user': user_id, 'project': project_id},
+                                 user_id=user_id)
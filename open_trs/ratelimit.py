@@ -0,0 +1,147 @@
+import math
+import os
+import sqlite3
+import time
+
+from flask import Flask, current_app, g, request
+
+import open_trs
+import open_trs.metrics
+
+# Takes a token from a bucket, refilling it for the time since it was last used first; the bucket
+# is left untouched and nothing is returned when less than one token is available
+_TAKE_TOKEN = (
+    'INSERT INTO RateBuckets (key, tokens, updated) VALUES (:key, :burst - 1, :now)'
+    ' ON CONFLICT (key) DO UPDATE SET'
+    '  tokens = MIN(:burst, tokens + (:now - updated) * :rate) - 1, updated = :now'
+    ' WHERE MIN(:burst, tokens + (:now - updated) * :rate) >= 1'
+    ' RETURNING tokens')
+
+_SCHEMA = '''
+PRAGMA journal_mode = WAL;
+CREATE TABLE IF NOT EXISTS RateBuckets (
+    key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_rate_buckets_updated ON RateBuckets (updated);
+'''
+
+
+def _get_store() -> sqlite3.Connection:
+    """
+    Get the connection to the store of token buckets shared by all worker processes.
+
+    The store is a SQLite database of its own, so counting requests never waits for writers of the
+    application's database. Losing recent counts in a crash is harmless, so writes are not synced.
+
+    Returns:
+        The store's connection.
+    """
+
+    if 'ratelimit_store' not in g:
+        path = (current_app.config['RATELIMIT_STORAGE']
+                or os.path.join(current_app.instance_path, 'ratelimit.sqlite'))
+        store = sqlite3.connect(path, timeout=1, isolation_level=None)
+        store.execute('PRAGMA synchronous = OFF')
+
+        if store.execute("SELECT 1 FROM sqlite_master WHERE name = 'RateBuckets'"
+                         ).fetchone() is None:
+            store.executescript(_SCHEMA)
+
+        g.ratelimit_store = store
+
+    return g.ratelimit_store
+
+
+def close_store(e: Exception = None):
+    """
+    Close the connection to the store of token buckets.
+
+    Args:
+        e (Exception, optional): The exception that occurred, if any.
+    """
+
+    store = g.pop('ratelimit_store', None)
+
+    if store is not None:
+        store.close()
+
+
+def limit(subject: str):
+    """
+    Admit the current request or refuse it with status code 429.
+
+    Every subject (e.g. a user or an IP address) has a token bucket per route listed in the
+    config's `RATELIMIT_LIMITS` and one shared by the remaining routes, under "default". A limit of
+    `(rate, burst)` allows `burst` requests at once, refilled at `rate` requests per second, and a
+    limit of `(0, 0)` blocks the route. Refused requests carry a `Retry-After` header with the
+    seconds until a token is available, unless the route is blocked.
+
+    Args:
+        subject: Who the request is counted against, e.g. "user:1" or "ip:127.0.0.1".
+    """
+
+    if not current_app.config['RATELIMIT_ENABLED']:
+        return
+
+    limits = current_app.config['RATELIMIT_LIMITS']
+    route = request.endpoint if request.endpoint in limits else 'default'
+
+    if route not in limits:
+        return
+
+    rate, burst = limits[route]
+
+    if burst < 1:
+        open_trs.metrics.increment('requests_rate_limited', {'endpoint': request.endpoint})
+        raise open_trs.InvalidUsage('Too many requests, slow down', 429)
+
+    key = f'{route}:{subject}'
+    now = time.time()
+    store = _get_store()
+
+    try:
+        store.execute('BEGIN IMMEDIATE')
+
+        try:
+            # Buckets idle for long enough to have refilled are no different from new ones
+            store.execute('DELETE FROM RateBuckets WHERE updated < ?',
+                          (now - max((size / refill for refill, size in limits.values() if refill),
+                                     default=0),))
+
+            if store.execute(_TAKE_TOKEN, {'key': key, 'burst': burst, 'rate': rate, 'now': now}
+                             ).fetchone() is not None:
+                return
+
+            tokens, updated = store.execute(
+                'SELECT tokens, updated FROM RateBuckets WHERE key = ?', (key,)).fetchone()
+        finally:
+            store.commit()
+    except sqlite3.OperationalError:
+        # An unavailable store must not take the application down with it
+        current_app.logger.warning('Rate limit store unavailable', exc_info=True)
+        return
+
+    open_trs.metrics.increment('requests_rate_limited', {'endpoint': request.endpoint})
+    available = min(burst, tokens + (now - updated) * rate)
+    retry_after = math.ceil((1 - available) / rate)
+
+    raise open_trs.InvalidUsage('Too many requests, slow down', 429,
+                                headers={'Retry-After': str(max(retry_after, 1))})
+
+
+def init_app(app: Flask):
+    """
+    Initialize the Flask application.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+
+    for route, (rate, burst) in app.config['RATELIMIT_LIMITS'].items():
+        if rate < 0 or burst < 0 or (rate == 0 and burst != 0):
+            raise ValueError(f'Invalid rate limit {(rate, burst)} of "{route}", rates and bursts'
+                             ' cannot be negative and a rate of 0 needs a burst of 0')
+
+    app.teardown_appcontext(close_store)
@@ -0,0 +1,144 @@
+import datetime
+import os
+import pathlib
+from typing import Callable, List, Optional, Tuple
+
+import click
+from flask import Flask, current_app, g
+
+import open_trs.backends
+import open_trs.backup
+import open_trs.db
+import open_trs.jobs
+
+
+def _get_snapshot_path(name: str) -> str:
+    reporting_dir = (current_app.config['REPORTING_DIR']
+                     or os.path.join(current_app.instance_path, 'reporting'))
+
+    return os.path.join(reporting_dir, f'{name}.sqlite')
+
+
+def refresh() -> List[Tuple[str, dict]]:
+    """
+    Refresh the reporting snapshots of the database and its shards.
+
+    Each snapshot is copied with the online backup API to a temporary file that then replaces the
+    previous snapshot, so connections reading the previous snapshot are not disturbed.
+
+    Returns:
+        The `(name, statistics)` of every database copied, see `open_trs.backup.copy_database`.
+    """
+
+    results = []
+
+    for name, database in open_trs.backup.get_databases():
+        path = _get_snapshot_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        stats = open_trs.backup.copy_database(database, f'{path}.tmp',
+                                              current_app.config['BACKUP_PAGES'],
+                                              current_app.config['BACKUP_PAUSE'])
+        os.replace(f'{path}.tmp', path)
+        results.append((name, stats))
+
+    return results
+
+
+def get_reporting_db() -> Tuple[open_trs.backends.Connection, Optional[str]]:
+    """
+    Get the connection heavy read-only queries should use.
+
+    If the config's `REPORTING_SNAPSHOT` is enabled and a snapshot has been taken, this is a
+    read-only connection to the snapshot of the database (or the user's shard), so reporting does
+    not compete with writes. Otherwise it is the connection from `open_trs.db.get_db`.
+
+    Returns:
+        A tuple containing the connection and the ISO formatted time the snapshot was taken, or
+        None when reading the live database.
+    """
+
+    if not current_app.config['REPORTING_SNAPSHOT']:
+        return open_trs.db.get_db(), None
+
+    if g.get('user_id') is not None and current_app.config['DATABASE_SHARDS']:
+        name = open_trs.db.get_shard_name(g.user_id)
+    else:
+        name = 'main'
+
+    path = _get_snapshot_path(name)
+
+    if not os.path.exists(path):
+        return open_trs.db.get_db(), None
+
+    reporting_dbs = g.setdefault('reporting_dbs', {})
+
+    if name not in reporting_dbs:
+        reporting_dbs[name] = open_trs.backends.connect(
+            f'{pathlib.Path(path).absolute().as_uri()}?mode=ro')
+        open_trs.db.apply_deadline(reporting_dbs[name])
+
+    as_of = datetime.datetime.fromtimestamp(os.path.getmtime(path), datetime.timezone.utc)
+
+    return reporting_dbs[name], as_of.isoformat(timespec='seconds')
+
+
+def close_reporting_dbs(e: Exception = None):
+    """
+    Close the reporting snapshot connections.
+
+    Args:
+        e (Exception, optional): The exception that occurred, if any.
+    """
+
+    for db in g.pop('reporting_dbs', {}).values():
+        db.close()
+
+
+@open_trs.jobs.handler('refresh_reporting', concurrency=1)
+def _refresh_job(payload: dict, report_progress: Callable[[float], None]) -> dict:
+    try:
+        results = refresh()
+    finally:
+        # The next refresh is queued even if this one failed, so that snapshots keep being renewed
+        interval = current_app.config['REPORTING_REFRESH_INTERVAL']
+
+        if interval:
+            open_trs.jobs.enqueue('refresh_reporting', {}, delay=interval, unique=True)
+
+    return {'databases': dict(results)}
+
+
+@click.command('refresh-reporting')
+@click.option('--schedule', is_flag=True, help='Queue a background job that repeats every'
+              ' REPORTING_REFRESH_INTERVAL seconds.')
+def refresh_reporting_command(schedule: bool):
+    """
+    Click command to refresh the read-only reporting snapshots.
+    """
+
+    if schedule:
+        job_id = open_trs.jobs.enqueue('refresh_reporting', {}, unique=True)
+        click.echo('A refresh job is already scheduled.' if job_id is None
+                   else f'Queued refresh job {job_id}.')
+        return
+
+    try:
+        results = refresh()
+    except RuntimeError as e:
+        raise click.ClickException(str(e))
+
+    for name, stats in results:
+        click.echo(f'Refreshed {name}: {stats["pages"]} pages in {stats["seconds"]:.2f}s.')
+
+
+def init_app(app: Flask):
+    """
+    Initialize the Flask application.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+
+    app.teardown_appcontext(close_reporting_dbs)
+    app.cli.add_command(refresh_reporting_command)
@@ -1,6 +1,17 @@
+-- Free pages are returned to the OS in bounded steps by open_trs.maintenance
+PRAGMA auto_vacuum = INCREMENTAL;
+
 DROP TABLE IF EXISTS Users;
 DROP TABLE IF EXISTS Projects;
 DROP TABLE IF EXISTS Charges;
+DROP TABLE IF EXISTS Calendar;
+DROP TABLE IF EXISTS UserShards;
+DROP TABLE IF EXISTS IdempotencyKeys;
+DROP TABLE IF EXISTS Purges;
+DROP TABLE IF EXISTS Jobs;
+DROP TABLE IF EXISTS Partitions;
+DROP TABLE IF EXISTS Events;
+DROP TABLE IF EXISTS DataVersions;
 
 CREATE TABLE Users (
     id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -17,6 +28,7 @@ CREATE TABLE Projects (
     category INTEGER NOT NULL DEFAULT 0,
     description TEXT,
     created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    deleted TIMESTAMP,
     FOREIGN KEY (owner) REFERENCES Users (id)
 );
 
@@ -25,8 +37,102 @@ CREATE TABLE Charges (
     project INTEGER NOT NULL,
     user INTEGER NOT NULL,
     hours INTEGER NOT NULL,
-    date_charged DATE NOT NULL,
+    date_charged INTEGER NOT NULL,
     created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
     FOREIGN KEY (project) REFERENCES Projects (id),
     FOREIGN KEY (user) REFERENCES Users (id)
 );
+
+CREATE TABLE UserShards (
+    user INTEGER PRIMARY KEY,
+    shard TEXT NOT NULL,
+    FOREIGN KEY (user) REFERENCES Users (id)
+);
+
+CREATE TABLE IdempotencyKeys (
+    user INTEGER NOT NULL,
+    idempotency_key TEXT NOT NULL,
+    request_hash TEXT NOT NULL,
+    status_code INTEGER,
+    response TEXT,
+    created INTEGER NOT NULL,
+    PRIMARY KEY (user, idempotency_key),
+    FOREIGN KEY (user) REFERENCES Users (id)
+);
+
+CREATE TABLE Purges (
+    project INTEGER PRIMARY KEY,
+    user INTEGER NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    deleted_charges INTEGER NOT NULL DEFAULT 0,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    finished TIMESTAMP,
+    FOREIGN KEY (user) REFERENCES Users (id)
+);
+
+CREATE TABLE Jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    user INTEGER,
+    payload TEXT NOT NULL,
+    priority INTEGER NOT NULL DEFAULT 0,
+    status TEXT NOT NULL DEFAULT 'queued',
+    progress REAL NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    run_after INTEGER NOT NULL,
+    lease_expires INTEGER,
+    worker TEXT,
+    result TEXT,
+    error TEXT,
+    created INTEGER NOT NULL,
+    started INTEGER,
+    finished INTEGER,
+    FOREIGN KEY (user) REFERENCES Users (id)
+);
+
+CREATE TABLE Partitions (
+    year INTEGER PRIMARY KEY,
+    path TEXT NOT NULL,
+    first_day INTEGER NOT NULL,
+    last_day INTEGER NOT NULL,
+    charges INTEGER NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE Events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user INTEGER NOT NULL,
+    topic TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created INTEGER NOT NULL,
+    FOREIGN KEY (user) REFERENCES Users (id)
+);
+
+CREATE TABLE DataVersions (
+    user INTEGER PRIMARY KEY,
+    version INTEGER NOT NULL,
+    FOREIGN KEY (user) REFERENCES Users (id)
+);
+
+CREATE TABLE Calendar (
+    day INTEGER PRIMARY KEY,
+    date TEXT UNIQUE NOT NULL,
+    iso_week TEXT NOT NULL,
+    month TEXT NOT NULL,
+    quarter TEXT NOT NULL,
+    year INTEGER NOT NULL
+);
+
+CREATE INDEX idx_projects_owner ON Projects (owner);
+CREATE INDEX idx_projects_deleted ON Projects (owner) WHERE deleted IS NOT NULL;
+CREATE INDEX idx_charges_user_date ON Charges (user, date_charged);
+CREATE UNIQUE INDEX idx_charges_user_project_date ON Charges (user, project, date_charged);
+CREATE INDEX idx_idempotency_keys_created ON IdempotencyKeys (created);
+CREATE INDEX idx_purges_status ON Purges (status);
+CREATE INDEX idx_jobs_queue ON Jobs (status, priority DESC, id);
+CREATE INDEX idx_jobs_kind ON Jobs (kind, status);
+CREATE INDEX idx_events_user ON Events (user, id);
+CREATE INDEX idx_events_created ON Events (created);
+
+PRAGMA user_version = 11;
@@ -0,0 +1,162 @@
+"""
+Production server: runs Open TRS with gunicorn's pre-fork server, with threaded workers.
+
+Start it with `python -m open_trs.server` (or `open-trs-server` once installed); it requires the
+optional `gunicorn` dependency from `pip install .[production]`.
+"""
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+from flask import Flask
+
+import open_trs
+import open_trs.warmup
+
+
+def get_cpu_count() -> int:
+    """
+    Get the number of CPUs this process may run on.
+
+    Returns:
+        The number of CPUs in the process' affinity mask where supported, e.g. a container's
+        cpuset, or else all of the machine's CPUs.
+    """
+
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
+
+
+def get_options(app: Flask, cpu_count: Optional[int] = None) -> dict:
+    """
+    Derive the gunicorn settings from the app's config.
+
+    Unless `SERVER_WORKERS` is set there are two workers per CPU plus one, so that a CPU has work
+    while another worker waits for I/O, each running `SERVER_THREADS` threads. A worker's threads
+    need at most one connection each, so the config's `DATABASE_POOL_SIZE` is set to the number of
+    threads, or to a worker's share of `DATABASE_MAX_CONNECTIONS` if that is smaller.
+
+    Args:
+        app (Flask): The Flask application instance.
+        cpu_count (int, optional): The number of CPUs to size the server for; defaults to None,
+            i.e. those of this process.
+
+    Returns:
+        The gunicorn settings.
+    """
+
+    config = app.config
+    workers = config['SERVER_WORKERS'] or 2 * (cpu_count or get_cpu_count()) + 1
+    threads = config['SERVER_THREADS']
+    pool_size = threads
+
+    if config['DATABASE_MAX_CONNECTIONS']:
+        pool_size = max(1, min(pool_size, config['DATABASE_MAX_CONNECTIONS'] // workers))
+
+    config['DATABASE_POOL_SIZE'] = pool_size
+
+    options = {
+        'bind': config['SERVER_BIND'],
+        'workers': workers,
+        'worker_class': 'gthread',
+        'threads': threads,
+        'backlog': config['SERVER_BACKLOG'],
+        'keepalive': config['SERVER_KEEPALIVE'],
+        'timeout': config['SERVER_TIMEOUT'],
+        'graceful_timeout': config['SERVER_GRACEFUL_TIMEOUT'],
+        'max_requests': config['SERVER_MAX_REQUESTS'],
+        'max_requests_jitter': config['SERVER_MAX_REQUESTS_JITTER'],
+        # The app is created, and warmed up, once before forking
+        'preload_app': True,
+        'accesslog': '-',
+    }
+
+    # Workers report their liveness through a file, which should not be on a disk-backed directory
+    if os.path.isdir('/dev/shm'):
+        options['worker_tmp_dir'] = '/dev/shm'
+
+    return options
+
+
+def run(app: Flask, options: dict):
+    """
+    Serve the app with gunicorn until it is shut down.
+
+    `SIGHUP` replaces the workers with new ones, and `SIGTERM` shuts down; either way, workers stop
+    accepting connections and get `SERVER_GRACEFUL_TIMEOUT` seconds to finish their requests. The
+    app is loaded once before forking, so `SIGHUP` does not load new code: upgrade by sending
+    `SIGUSR2`, which starts a new server sharing the listening socket, and then `SIGTERM` to the
+    old one once the new workers are up.
+
+    Args:
+        app (Flask): The Flask application instance.
+        options: The gunicorn settings, see `get_options`.
+    """
+
+    try:
+        import gunicorn.app.base
+    except ImportError:
+        raise RuntimeError('The production server requires gunicorn, install open-trs[production]')
+
+    class Application(gunicorn.app.base.BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+            # Connection pools are not shared with forked workers, so they are opened by each
+            self.cfg.set('post_worker_init', lambda worker: open_trs.warmup.warm_up_databases(
+                app, load_page_cache=False))
+
+        def load(self):
+            return app
+
+    Application().run()
+
+
+def main(argv: Optional[List[str]] = None):
+    """
+    Run the production server, using the production configuration unless `FLASK_ENV` is set.
+
+    Args:
+        argv (list, optional): The command line arguments; defaults to None, i.e. `sys.argv`.
+    """
+
+    parser = argparse.ArgumentParser(description='Run Open TRS with a production server.')
+    parser.add_argument('--bind', help='Address to listen on, e.g. 0.0.0.0:8000.')
+    parser.add_argument('--workers', type=int, help='Worker processes.')
+    parser.add_argument('--threads', type=int, help='Threads per worker.')
+    parser.add_argument('--print-options', action='store_true',
+                        help='Print the derived server settings and exit.')
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault('FLASK_ENV', 'production')
+    overrides = {'SERVER_BIND': args.bind, 'SERVER_WORKERS': args.workers,
+                 'SERVER_THREADS': args.threads}
+    # Warming up opens every database, so it waits until the config is known to be usable
+    app = open_trs.create_app(
+        config={key: value for key, value in overrides.items() if value is not None},
+        warm_up=False)
+
+    if not app.config.get('SECRET_KEY'):
+        sys.exit('SECRET_KEY is not set, e.g. set the OPEN_TRS_SECRET_KEY environment variable')
+
+    options = get_options(app)
+
+    if args.print_options:
+        for key, value in sorted(options.items()):
+            print(f'{key} = {value!r}')
+
+        print(f'database_pool_size = {app.config["DATABASE_POOL_SIZE"]!r}')
+        return
+
+    if app.config['WARMUP']:
+        open_trs.warmup.warm_up(app)
+
+    run(app, options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import gc
+import time
+
+import jwt
+from flask import Flask
+
+import open_trs.analytics
+import open_trs.backends
+import open_trs.db
+
+# Bytes read at once while loading database files into the page cache
+_READ_SIZE = 1024 * 1024
+
+
+def _load_page_cache(db: open_trs.backends.Connection, max_bytes: int):
+    """
+    Read the file of a SQLite database, so that the first queries find its pages in the operating
+    system's page cache instead of on disk.
+
+    Args:
+        db: The database connection.
+        max_bytes: The maximum number of bytes to read.
+    """
+
+    if not open_trs.backends.is_sqlite(db):
+        return
+
+    path = db.execute("SELECT file FROM pragma_database_list WHERE name = 'main'").fetchone()[0]
+
+    # In-memory databases have no file
+    if not path:
+        return
+
+    with open(path, 'rb', buffering=0) as file:
+        while max_bytes > 0 and file.read(min(_READ_SIZE, max_bytes)):
+            max_bytes -= _READ_SIZE
+
+
+def warm_up_databases(app: Flask, load_page_cache: bool = True):
+    """
+    Open a connection to every database, reading its schema, and close it again.
+
+    Connection pools of client-server databases keep their connections open for later requests.
+
+    Args:
+        app (Flask): The Flask application instance.
+        load_page_cache (bool, optional): Whether to also read up to `WARMUP_CACHE_BYTES` of every
+            SQLite database file into the page cache; defaults to True.
+    """
+
+    with app.app_context():
+        for db in open_trs.db.iter_dbs():
+            db.execute('SELECT COUNT(*) FROM sqlite_master' if open_trs.backends.is_sqlite(db)
+                       else 'SELECT 1').fetchone()
+
+            if load_page_cache:
+                _load_page_cache(db, app.config['WARMUP_CACHE_BYTES'])
+
+
+def warm_up(app: Flask):
+    """
+    Do the work that would otherwise slow down the first requests of a new worker.
+
+    A request is sent through the WSGI stack so that Flask and Werkzeug load what they load on
+    first use, a JWT is signed and verified, NumPy is imported if charge statistics use it, and a
+    connection to every database is opened, reading its schema and up to `WARMUP_CACHE_BYTES` of
+    its file. No connection is left open, so the app may be created before forking, e.g. by
+    `gunicorn --preload`; the objects created so far are then frozen out of garbage collection,
+    which would otherwise write to, and so copy, the memory pages that forked workers share.
+    Connection pools of client-server databases are not shared with forked workers, so
+    `warm_up_databases` has to be called again in each worker.
+
+    Args:
+        app (Flask): The Flask application instance.
+    """
+
+    start = time.perf_counter()
+    app.test_client().get('/_warmup')
+
+    if app.config.get('SECRET_KEY'):
+        token = jwt.encode({'sub': 0}, app.config['SECRET_KEY'])
+        jwt.decode(token, app.config['SECRET_KEY'], algorithms=['HS256'])
+
+    warm_up_databases(app)
+
+    with app.app_context():
+        open_trs.analytics.import_numpy()
+
+    gc.freeze()
+    app.logger.info('Warmed up in %.1f ms', (time.perf_counter() - start) * 1000)
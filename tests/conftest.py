@@ -1,4 +1,5 @@
 import os
+import string
 
 import pytest
 from flask import Flask
@@ -69,6 +70,51 @@ def app() -> Flask:
         yield app
 
 
+def _resolve_fixtures(value, request: pytest.FixtureRequest):
+    """
+    Replace `{name}` placeholders in a config value with the values of the fixtures named.
+    """
+
+    if isinstance(value, dict):
+        return {key: _resolve_fixtures(item, request) for key, item in value.items()}
+    elif isinstance(value, str):
+        names = {name for _, name, _, _ in string.Formatter().parse(value) if name}
+
+        return value.format(**{name: request.getfixturevalue(name) for name in names})
+
+    return value
+
+
+@pytest.fixture
+def file_app(request: pytest.FixtureRequest, tmp_path) -> Flask:
+    """
+    Creates and initializes a Flask app backed by a database file in `tmp_path`, so that every
+    request opens its own connection, e.g. for concurrent requests, CLI commands or snapshots.
+
+    Config overrides are passed by indirect parametrization, e.g.
+    `@pytest.mark.parametrize('file_app', [{'BACKUP_DIR': '{tmp_path}/backups'}], indirect=True)`;
+    `{name}` placeholders in strings are replaced by the value of the fixture named. With
+    `'init_db': False` the database is left uninitialized.
+
+    Args:
+        request: The fixture request, whose `param` holds the overrides.
+        tmp_path: The test's temporary directory.
+
+    Returns:
+        Flask: The Flask app object.
+    """
+
+    config = {'DATABASE': '{tmp_path}/open_trs.sqlite', **getattr(request, 'param', {})}
+    init_db = config.pop('init_db', True)
+    app = open_trs.create_app(testing=True, config=_resolve_fixtures(config, request))
+
+    if init_db:
+        with app.app_context():
+            open_trs.db.init_db()
+
+    return app
+
+
 @pytest.fixture
 def client(app: Flask) -> FlaskClient:
     """
@@ -46,27 +46,27 @@ VALUES
         1,
         1,
         5,
-        '2024-02-01',
+        CAST(julianday('2024-02-01') - 2440587.5 AS INTEGER),
         '2024-02-01 21:18:19'
     ),
     (
         1,
         1,
         3,
-        '2024-02-06',
+        CAST(julianday('2024-02-06') - 2440587.5 AS INTEGER),
         '2024-02-06 21:18:19'
     ),
     (
         2,
         1,
         8,
-        '2024-02-29',
+        CAST(julianday('2024-02-29') - 2440587.5 AS INTEGER),
         '2024-02-29 21:18:19'
     ),
     (
         3,
         2,
         2,
-        '2024-02-06',
+        CAST(julianday('2024-02-06') - 2440587.5 AS INTEGER),
         '2024-02-06 21:22:03'
     );
\ No newline at end of file
@@ -0,0 +1,119 @@
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+import open_trs.db
+import open_trs.events
+
+from tests.conftest import AuthActions
+
+
+def _get_stats(client: FlaskClient, token: str, request_json: dict):
+    return client.get(
+        '/charges/stats',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json=request_json)
+
+
+@pytest.mark.parametrize('use_numpy', (True, False))
+def test_get_stats(client: FlaskClient, auth: AuthActions, app: Flask, use_numpy: bool):
+    if use_numpy:
+        pytest.importorskip('numpy')
+
+    app.config['ANALYTICS_NUMPY'] = use_numpy
+    token = auth.login()
+
+    response = _get_stats(client, token, {'date_range': {'start': '2024-02-01',
+                                                         'end': '2024-02-29'}})
+
+    assert response.status_code == 200
+    stats = response.get_json()
+
+    assert stats['start'] == '2024-02-01'
+    assert stats['end'] == '2024-02-29'
+    assert stats['window'] == 7
+    # The first week starts with the range, on a Thursday, and the others on Mondays
+    assert stats['weeks'] == ['2024-02-01', '2024-02-05', '2024-02-12', '2024-02-19', '2024-02-26']
+    assert [series['project'] for series in stats['stats']] == [None, 1, 2]
+
+    total, project_1, _ = stats['stats']
+    assert total == {
+        'project': None,
+        'hours': 16,
+        'days': 3,
+        'daily_average': 0.5517,
+        'rolling_average': 1.1429,
+        'percentiles': {'50': 5, '90': 7.4, '99': 7.94},
+        'weekdays': [0, 3, 0, 13, 0, 0, 0],
+        'longest_streak': 1,
+        'current_streak': 1,
+        'week_hours': [5, 3, 0, 0, 8],
+        'week_changes': [None, -2, -3, 0, 8],
+    }
+    assert project_1['hours'] == 8
+    assert project_1['current_streak'] == 0
+
+    # Without a filter, the range spans the user's charges
+    stats = _get_stats(client, token, {'window': 3}).get_json()
+
+    assert (stats['start'], stats['end'], stats['window']) == ('2024-02-01', '2024-02-29', 3)
+    assert stats['stats'][0]['rolling_average'] == 2.6667
+
+
+def test_get_stats_after_changes(client: FlaskClient, auth: AuthActions):
+    token = auth.login()
+    request_json = {'date_range': {'start': '2024-02-01', 'end': '2024-02-29'}}
+
+    assert _get_stats(client, token, request_json).get_json()['stats'][0]['current_streak'] == 1
+
+    # The cached charges are reloaded once the user's data changes
+    client.post('/charges/create',
+                headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+                json={'charges': [{'project': 2, 'hours': 2, 'date_charged': '2024-02-28'}]})
+    total = _get_stats(client, token, request_json).get_json()['stats'][0]
+
+    assert total['hours'] == 18
+    assert (total['longest_streak'], total['current_streak']) == (2, 2)
+
+    for project_id in (1, 2):
+        client.delete(f'/projects/{project_id}/delete',
+                      headers={'Authorization': f'Bearer {token}'})
+
+    stats = _get_stats(client, token, {}).get_json()
+
+    # Charges of deleted projects are left out
+    assert stats['stats'] == [] and stats['start'] is None
+
+
+def test_get_stats_after_events_expire(client: FlaskClient, auth: AuthActions, app: Flask):
+    token = auth.login()
+
+    assert _get_stats(client, token, {}).get_json()['stats'][0]['hours'] == 16
+
+    client.post('/charges/create',
+                headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+                json={'charges': [{'project': 2, 'hours': 7, 'date_charged': '2024-02-28'}]})
+
+    # Another user's change expires all events, so the user has none left
+    with app.app_context():
+        db = open_trs.db.get_db()
+        db.execute('UPDATE Events SET created = 0')
+        open_trs.events.publish(db, 2, 'projects', {'action': 'created', 'ids': []})
+        db.commit()
+
+        assert db.execute('SELECT COUNT(*) FROM Events WHERE user = 1').fetchone()[0] == 0
+
+    assert _get_stats(client, token, {}).get_json()['stats'][0]['hours'] == 23
+
+
+@pytest.mark.parametrize('request_json, message', (
+    ({'window': 0}, b'Window must be from 1 to'),
+    ({'window': '7'}, b'Window must be from 1 to'),
+    ({'date_range': {'start': '2000-01-01', 'end': '2024-12-31'}}, b'Date range cannot exceed'),
+))
+def test_get_stats_validate_input(client: FlaskClient, auth: AuthActions, request_json: dict,
+                                  message: bytes):
+    response = _get_stats(client, auth.login(), request_json)
+
+    assert response.status_code == 400
+    assert message in response.data
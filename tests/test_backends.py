@@ -0,0 +1,170 @@
+import os
+import shutil
+import socket
+import subprocess
+
+import pytest
+from flask import Flask
+
+import open_trs
+import open_trs.backends
+import open_trs.db
+
+
+@pytest.fixture(scope='module')
+def postgres_url(tmp_path_factory: pytest.TempPathFactory) -> str:
+    """
+    Provides a PostgreSQL database URL for testing the client-server backend.
+
+    Uses `OPEN_TRS_TEST_POSTGRES_URL` if set; otherwise launches a throwaway local server with the
+    `initdb` and `pg_ctl` binaries found in `OPEN_TRS_TEST_POSTGRES_BIN` or on the `PATH`.
+
+    Yields:
+        The database URL.
+    """
+
+    pytest.importorskip('psycopg_pool')
+
+    url = os.getenv('OPEN_TRS_TEST_POSTGRES_URL')
+
+    if url:
+        yield url
+        return
+
+    bin_dir = os.getenv('OPEN_TRS_TEST_POSTGRES_BIN')
+    initdb = shutil.which('initdb', path=bin_dir)
+    pg_ctl = shutil.which('pg_ctl', path=bin_dir)
+
+    if initdb is None or pg_ctl is None:
+        pytest.skip('PostgreSQL server binaries not found')
+
+    server_dir = tmp_path_factory.mktemp('postgres')
+    data_dir = server_dir / 'data'
+
+    result = subprocess.run([initdb, '-D', str(data_dir), '-U', 'postgres', '--auth=trust',
+                             '--encoding=UTF8'],
+                            capture_output=True)
+
+    if result.returncode != 0:
+        pytest.skip(f'initdb failed: {result.stderr.decode(errors="replace").strip()}')
+
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        port = s.getsockname()[1]
+
+    subprocess.run([pg_ctl, '-D', str(data_dir), '-l', str(server_dir / 'server.log'), '-w',
+                    '-o', f'-p {port} -k {server_dir} -c listen_addresses=', 'start'],
+                   check=True, capture_output=True)
+
+    try:
+        yield f'postgresql://postgres@/postgres?host={server_dir}&port={port}'
+    finally:
+        subprocess.run([pg_ctl, '-D', str(data_dir), '-m', 'immediate', 'stop'],
+                       capture_output=True)
+
+
+@pytest.mark.parametrize('database, expected', (
+    ('instance/open_trs.sqlite', ('sqlite', 'instance/open_trs.sqlite')),
+    ('file::memory:?cache=shared', ('sqlite', 'file::memory:?cache=shared')),
+    ('sqlite:///open_trs.db', ('sqlite', 'open_trs.db')),
+    ('sqlite:////var/lib/open_trs.db', ('sqlite', '/var/lib/open_trs.db')),
+    ('postgresql://trs@localhost/trs', ('postgresql', 'postgresql://trs@localhost/trs')),
+    ('postgres://trs@localhost/trs', ('postgresql', 'postgres://trs@localhost/trs')),
+))
+def test_parse_database_url(database, expected):
+    assert open_trs.backends.parse_database_url(database) == expected
+
+
+def test_translate_sql():
+    translated = open_trs.backends.translate_sql(
+        "SELECT * FROM Charges WHERE user = ? AND Charges.user_id LIKE '5%' AND id IN (?, ?)")
+
+    assert translated == ('SELECT * FROM Charges WHERE "user" = %s'
+                          " AND Charges.user_id LIKE '5%%' AND id IN (%s, %s)")
+
+
+def test_translate_sql_schema():
+    translated = open_trs.backends.translate_sql(
+        'DROP TABLE IF EXISTS Users;\n'
+        'CREATE TABLE Users (id INTEGER PRIMARY KEY AUTOINCREMENT, user INTEGER NOT NULL);\n'
+        'PRAGMA user_version = 3;\n', parameters=False)
+
+    assert translated == (
+        'DROP TABLE IF EXISTS Users CASCADE;\n'
+        'CREATE TABLE Users (id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,'
+        ' "user" BIGINT NOT NULL);\n\n')
+
+
+def test_github_actions_database_url(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv('FLASK_ENV', 'ci')
+    app = open_trs.create_app()
+
+    with app.app_context():
+        db = open_trs.db.get_db()
+
+        assert open_trs.backends.is_sqlite(db)
+        assert db.execute('SELECT 1').fetchone()[0] == 1
+
+    assert (tmp_path / 'open_trs.db').exists()
+
+
+@pytest.mark.parametrize('file_app', [{'DATABASE': '{postgres_url}'}], indirect=True)
+def test_postgres_round_trip(file_app: Flask):
+    client = file_app.test_client()
+
+    credentials = {'username': 'pg', 'email': 'pg@test.com', 'password': 'pg'}
+    assert client.post('/auth/register', json=credentials).status_code == 201
+    assert client.post('/auth/register', json=credentials).status_code == 400
+
+    token = client.post('/auth/login', json=credentials).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    project = client.post('/projects/create', headers=headers,
+                          json={'name': 'Postgres Project', 'category': 0}).get_json()['project']
+
+    response = client.post('/charges/create', headers=headers, json={'charges': [
+        {'hours': 2, 'project': project['id'], 'date_charged': '2024-02-01'},
+        {'hours': 3, 'project': project['id'], 'date_charged': '2024-02-02'}]})
+    assert response.status_code == 201
+
+    response = client.post('/charges/create', headers=headers, json={
+        'mode': 'add_hours',
+        'charges': [{'hours': 1, 'project': project['id'], 'date_charged': '2024-02-02'}]})
+    assert response.get_json()['charges'][0]['hours'] == 4
+
+    response = client.post('/charges/create', headers=headers, json={
+        'mode': 'replace',
+        'charges': [{'hours': 3, 'project': project['id'], 'date_charged': '2024-02-02'}]})
+    assert response.get_json()['charges'][0]['hours'] == 3
+
+    charges = client.get('/charges/', headers=headers, json={'period': {'month': '2024-02'}}
+                         ).get_json()['charges']
+    assert [(charge['hours'], charge['date_charged']) for charge in charges] == [
+        (2, '2024-02-01'), (3, '2024-02-02')]
+
+    timesheet = client.get('/charges/timesheet', headers=headers,
+                           json={'date_range': {'start': '2024-02-01', 'end': '2024-02-07'}}
+                           ).get_json()
+    assert timesheet['hours'] == [[2, 3, 0, 0, 0, 0, 0]]
+
+    summary = client.get('/charges/summary', headers=headers, json={'group_by': 'month'}
+                         ).get_json()['summary']
+    assert summary == [{'period': '2024-02', 'project': project['id'], 'hours': 5}]
+
+    response = client.put('/charges/update', headers=headers,
+                          json={'charges': [{'id': charges[0]['id'], 'hours': 4}]})
+    assert response.get_json()['charges'][0]['hours'] == 4
+
+    response = client.put('/charges/bulk_update', headers=headers, json={
+        'filter': {'project': project['id'], 'hours': {'lt': 4}}, 'set': {'shift_days': 7}})
+    assert response.get_json()['count'] == 1
+
+    response = client.delete(f'/projects/{project["id"]}/delete', headers=headers)
+    assert response.status_code == 200
+    assert client.get('/charges/', headers=headers, json={}).get_json()['charges'] == []
+
+    response = client.post('/projects/bulk', headers=headers, json={
+        'create': [{'name': 'Postgres Project'}, {'name': 'Another Project'}]})
+    assert [project['name'] for project in response.get_json()['created']] == [
+        'Postgres Project', 'Another Project']
@@ -0,0 +1,173 @@
+import datetime
+import os
+import shutil
+import sqlite3
+
+import pytest
+from flask import Flask
+
+import open_trs.backup
+import open_trs.db
+import open_trs.jobs
+import open_trs.partitions
+from tests.conftest import AuthActions, _data_sql
+
+
+pytestmark = pytest.mark.parametrize('file_app', [{
+    'BACKUP_DIR': '{tmp_path}/backups', 'BACKUP_PAGES': 4, 'BACKUP_PAUSE': 0,
+    'PARTITIONS_DIR': '{tmp_path}/partitions'}], indirect=True)
+
+
+def test_backup_command(file_app: Flask):
+    with file_app.app_context():
+        result = file_app.test_cli_runner().invoke(args=['backup'])
+
+    assert result.exit_code == 0
+    assert 'Backed up main:' in result.output
+
+    snapshots = os.listdir(file_app.config['BACKUP_DIR'])
+    assert len(snapshots) == 1
+
+    snapshot = sqlite3.connect(os.path.join(file_app.config['BACKUP_DIR'], snapshots[0],
+                                            'main.sqlite'))
+    assert snapshot.execute('PRAGMA user_version').fetchone()[0] == open_trs.db.SCHEMA_VERSION
+    assert snapshot.execute('SELECT COUNT(*) FROM Calendar').fetchone()[0] == 366
+    snapshot.close()
+
+
+def test_copy_database_steps(file_app: Flask, tmp_path):
+    with file_app.app_context():
+        stats = open_trs.backup.copy_database(file_app.config['DATABASE'],
+                                              str(tmp_path / 'copy.sqlite'), 4, 0)
+
+    assert stats['steps'] == -(-stats['pages'] // 4)
+    assert stats['longest_step'] <= stats['seconds']
+
+
+def test_backup_keep(file_app: Flask):
+    file_app.config['BACKUP_KEEP'] = 2
+
+    with file_app.app_context():
+        paths = [open_trs.backup.backup()[0] for _ in range(3)]
+
+    assert sorted(os.listdir(file_app.config['BACKUP_DIR'])) == [
+        os.path.basename(path) for path in paths[1:]]
+
+
+def test_verify_and_restore_commands(file_app: Flask, tmp_path):
+    snapshot = str(tmp_path / 'snapshot')
+
+    with file_app.app_context():
+        runner = file_app.test_cli_runner()
+        runner.invoke(args=['backup', '--output', snapshot])
+
+        db = open_trs.db.get_db()
+        db.execute('DELETE FROM Calendar')
+        db.commit()
+
+        result = runner.invoke(args=['verify-backup', snapshot])
+        assert result.exit_code == 0
+        assert 'main: ok' in result.output
+
+        result = runner.invoke(args=['restore', snapshot, '--yes'])
+        assert 'Restored main:' in result.output
+
+        assert db.execute('SELECT COUNT(*) FROM Calendar').fetchone()[0] == 366
+
+
+def test_verify_backup_command_invalid(file_app: Flask, tmp_path):
+    snapshot = tmp_path / 'snapshot'
+    snapshot.mkdir()
+    db = sqlite3.connect(snapshot / 'main.sqlite')
+    db.execute('CREATE TABLE Outdated (id INTEGER)')
+    db.close()
+
+    with file_app.app_context():
+        runner = file_app.test_cli_runner()
+
+        result = runner.invoke(args=['verify-backup', str(snapshot)])
+        assert result.exit_code != 0
+        assert 'Schema version 0' in result.output
+
+        result = runner.invoke(args=['restore', str(snapshot), '--yes'])
+        assert result.exit_code != 0
+        assert 'failed verification' in result.output
+
+
+def test_scheduled_backup(file_app: Flask):
+    file_app.config['BACKUP_INTERVAL'] = 3600
+
+    with file_app.app_context():
+        result = file_app.test_cli_runner().invoke(args=['backup', '--schedule'])
+        assert 'Queued backup job 1.' in result.output
+
+        assert len(os.listdir(file_app.config['BACKUP_DIR'])) == 1
+
+        job = open_trs.jobs.get_job(1)
+        assert job['status'] == 'succeeded'
+        assert list(job['result']['databases']) == ['main']
+
+        next_job = open_trs.jobs.get_job(2)
+        assert next_job['status'] == 'queued'
+        assert next_job['run_after'] >= job['created'] + 3600
+
+        # Scheduling again, e.g. on the next deploy, does not start a second chain of backups
+        result = file_app.test_cli_runner().invoke(args=['backup', '--schedule'])
+        assert 'A backup job is already scheduled.' in result.output
+        assert open_trs.jobs.get_job(3) is None
+
+
+def test_scheduled_backup_failure(file_app: Flask, monkeypatch: pytest.MonkeyPatch):
+    file_app.config.update(BACKUP_INTERVAL=3600, JOBS_MAX_ATTEMPTS=1)
+
+    def fail(output=None):
+        raise RuntimeError('Disk full')
+
+    monkeypatch.setattr(open_trs.backup, 'backup', fail)
+
+    with file_app.app_context():
+        file_app.test_cli_runner().invoke(args=['backup', '--schedule'])
+
+        # The schedule outlives a backup that used up its attempts
+        assert open_trs.jobs.get_job(1)['status'] == 'failed'
+        assert open_trs.jobs.get_job(2)['status'] == 'queued'
+
+
+def test_backup_shards(file_app: Flask, tmp_path):
+    file_app.config['DATABASE_SHARDS'] = {'a': str(tmp_path / 'shard_a.sqlite')}
+
+    with file_app.app_context():
+        open_trs.db.init_db()
+        snapshot_dir, results = open_trs.backup.backup()
+
+        assert [name for name, _ in results] == ['main', 'a']
+        assert open_trs.backup.verify(snapshot_dir) == [('main', []), ('a', [])]
+
+
+def test_backup_partitions(file_app: Flask):
+    file_app.config['PARTITIONS_HOT_YEARS'] = datetime.date.today().year - 2024
+
+    with file_app.app_context():
+        open_trs.db.get_db().executescript(_data_sql)
+        open_trs.partitions.archive()
+        snapshot_dir, results = open_trs.backup.backup()
+
+        assert [name for name, _ in results] == ['main', os.path.join('main', 'charges-2024')]
+        assert [problems for _, problems in open_trs.backup.verify(snapshot_dir)] == [[], []]
+
+    # Archived years live only in their partition files, which the snapshot brings back
+    shutil.rmtree(file_app.config['PARTITIONS_DIR'])
+
+    with file_app.app_context():
+        open_trs.backup.restore(snapshot_dir)
+
+    response = file_app.test_client().get('/charges/timesheet', json={
+        'period': {'month': '2024-02'}}, headers={
+        'Authorization': f'Bearer {AuthActions(file_app.test_client()).login()}'})
+    assert response.get_json()['project_totals'] == [8, 8]
+
+    os.remove(os.path.join(snapshot_dir, 'partitions', 'main', 'charges-2024.sqlite'))
+
+    with file_app.app_context():
+        assert open_trs.backup.verify(snapshot_dir)[1] == (
+            os.path.join('main', 'charges-2024'), ['Missing from snapshot'])
@@ -0,0 +1,67 @@
+import datetime
+import json
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from tests.conftest import AuthActions
+
+
+@pytest.fixture
+def capture_path(app: Flask, tmp_path) -> str:
+    """
+    Enables capturing requests into a temporary file.
+    """
+
+    path = str(tmp_path / 'capture.jsonl')
+    app.config['CAPTURE_PATH'] = path
+
+    return path
+
+
+def _read_capture(path: str) -> list:
+    with open(path) as file:
+        return [json.loads(line) for line in file]
+
+
+def test_capture_request_shapes(capture_path: str, client: FlaskClient, auth: AuthActions):
+    headers = {'Authorization': f'Bearer {auth.login()}'}
+    today = datetime.date.today()
+    three_days_ago = today - datetime.timedelta(days=3)
+
+    client.post('/charges/create', headers=headers, json={'charges': [
+        {'project': 1, 'hours': 2, 'date_charged': three_days_ago.isoformat()},
+        {'project': 2, 'hours': 4, 'date_charged': today.isoformat()}]})
+    client.get('/charges/summary', headers=headers,
+               json={'group_by': 'week', 'period': {'month': '2024-02'}})
+    client.put('/projects/1/update', headers=headers, json={'name': 'Secret name'})
+
+    login, create, summary, update = _read_capture(capture_path)
+
+    assert login['endpoint'] == 'auth.login'
+    assert login['body'] is None and login['user'] is None
+
+    assert create['endpoint'] == 'charges.create_charges'
+    assert create['method'] == 'POST' and create['status'] == 201
+    assert create['body'] == {'charges': {'$list': 2, 'item': {
+        'project': {'$id': 'project'}, 'hours': 2, 'date_charged': {'$day': -3}}}}
+    assert create['user'] is not None and create['user'] == summary['user']
+    assert create['duration'] > 0
+
+    assert summary['body'] == {'group_by': 'week', 'period': {'month': '2024-02'}}
+
+    assert update['view_args'] == {'project_id': {'$id': 'project'}}
+    assert update['body'] == {'name': {'$str': 11}}
+
+
+def test_capture_sampled(app: Flask, capture_path: str, auth: AuthActions):
+    app.config['CAPTURE_SAMPLE_RATE'] = 0
+
+    auth.login()
+
+    app.config['CAPTURE_SAMPLE_RATE'] = 1
+
+    auth.login()
+
+    assert len(_read_capture(capture_path)) == 1
@@ -1,4 +1,5 @@
 import datetime
+from typing import List
 
 import pytest
 from flask import Flask
@@ -14,7 +15,7 @@ def _compare_charges(charges, db_charges):
             if key == 'created':
                 continue
             elif key == 'date_charged':
-                assert str(db_charge[key]) == charge[key]
+                assert open_trs.db.day_to_iso(db_charge[key]) == charge[key]
             else:
                 assert db_charge[key] == charge[key]
 
@@ -43,14 +44,15 @@ def test_create_charges(client: FlaskClient, auth: AuthActions, app: Flask):
         db = open_trs.db.get_db()
         db_charges = db.execute(
             'SELECT * FROM Charges WHERE user = ? AND date_charged BETWEEN ? AND ? ORDER BY date_charged, id',
-            (1, test_date, test_date_2)).fetchall()
+            (1, open_trs.db.date_to_day(datetime.date(2024, 1, 1)),
+             open_trs.db.date_to_day(datetime.date(2024, 1, 2)))).fetchall()
 
         assert len(db_charges) == 2
 
         for i, db_charge in enumerate(db_charges):
             assert db_charge['hours'] == inserted_charges[i]['hours'] == new_charges[i]['hours']
             assert db_charge['project'] == inserted_charges[i]['project'] == new_charges[i]['project']
-            assert str(
+            assert open_trs.db.day_to_iso(
                 db_charge['date_charged']) == inserted_charges[i]['date_charged'] == new_charges[i]['date_charged']
             assert db_charge['user'] == inserted_charges[i]['user'] == 1
 
@@ -91,6 +93,96 @@ def test_create_charges_validate_input(client: FlaskClient, auth: AuthActions, a
     assert message in response.data
 
 
+@pytest.mark.parametrize('mode, expected_hours, expected_status', (
+    ('skip', [(1, 5), (2, 1)], 201),
+    ('replace', [(1, 2), (2, 1)], 201),
+    ('add_hours', [(1, 7), (2, 1)], 201),
+    ('reject', [(1, 5)], 400),
+))
+def test_create_charges_mode(client: FlaskClient, auth: AuthActions, app: Flask, mode,
+                             expected_hours, expected_status):
+    token = auth.login()
+
+    response = client.post(
+        '/charges/create',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json={'mode': mode, 'charges': [
+            {'hours': 2, 'project': 1, 'date_charged': '2024-02-01'},
+            {'hours': 1, 'project': 2, 'date_charged': '2024-02-01'}]})
+
+    assert response.status_code == expected_status
+
+    with app.app_context():
+        db = open_trs.db.get_db()
+        db_charges = db.execute(
+            'SELECT project, hours FROM Charges WHERE user = ? AND date_charged = ?'
+            ' ORDER BY project',
+            (1, open_trs.db.date_to_day(datetime.date(2024, 2, 1)))).fetchall()
+
+        assert [tuple(charge) for charge in db_charges] == expected_hours
+
+    if expected_status == 201:
+        returned_projects = [charge['project'] for charge in response.get_json()['charges']]
+        assert returned_projects == ([2] if mode == 'skip' else [1, 2])
+
+
+@pytest.mark.parametrize('mode, hours, expected_hours, expected_status', (
+    ('reject', [2, 2], 2, 201),
+    ('reject', [2, 3], None, 400),
+    ('skip', [2, 3], 2, 201),
+    ('replace', [2, 3], 3, 201),
+    ('add_hours', [2, 3], 5, 201),
+))
+def test_create_charges_mode_duplicates_in_request(client: FlaskClient, auth: AuthActions, mode,
+                                                   hours, expected_hours, expected_status):
+    token = auth.login()
+
+    response = client.post(
+        '/charges/create',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json={'mode': mode, 'charges': [
+            {'hours': hours_charged, 'project': 1, 'date_charged': '2024-01-01'}
+            for hours_charged in hours]})
+
+    assert response.status_code == expected_status
+
+    if expected_status == 201:
+        assert [charge['hours'] for charge in response.get_json()['charges']] == [expected_hours]
+
+
+@pytest.mark.parametrize('mode', ('merge', ['skip'], {'skip': True}))
+def test_create_charges_invalid_mode(client: FlaskClient, auth: AuthActions, mode):
+    token = auth.login()
+
+    response = client.post(
+        '/charges/create',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json={'mode': mode, 'charges': [{'hours': 1, 'project': 1,
+                                            'date_charged': '2024-01-01'}]})
+
+    assert response.status_code == 400
+    assert b'Invalid mode' in response.data
+
+
+def test_create_charges_many(client: FlaskClient, auth: AuthActions):
+    token = auth.login()
+    start = datetime.date(2023, 1, 1)
+    new_charges = [{'hours': 1, 'project': 2,
+                    'date_charged': str(start + datetime.timedelta(days=day))}
+                   for day in range(365)]
+
+    response = client.post(
+        '/charges/create',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json={'charges': new_charges})
+
+    assert response.status_code == 201
+    charges = response.get_json()['charges']
+
+    assert [charge['date_charged'] for charge in charges] == [
+        charge['date_charged'] for charge in new_charges]
+
+
 def test_get_charges(client: FlaskClient, auth: AuthActions, app: Flask):
     token = auth.login()
 
@@ -109,7 +201,8 @@ def test_get_charges(client: FlaskClient, auth: AuthActions, app: Flask):
         db_charges = db.execute(
             'SELECT * FROM Charges WHERE user = ? AND date_charged BETWEEN ? AND ?'
             'ORDER BY date_charged, id',
-            (1, '2024-02-01', '2024-02-28')).fetchall()
+            (1, open_trs.db.date_to_day(datetime.date(2024, 2, 1)),
+             open_trs.db.date_to_day(datetime.date(2024, 2, 28)))).fetchall()
 
         _compare_charges(charges, db_charges)
 
@@ -261,3 +354,313 @@ def test_delete_charges_validate_input(client: FlaskClient, auth: AuthActions, i
 
     assert response.status_code == status
     assert message in response.data
+
+
+def test_get_timesheet(client: FlaskClient, auth: AuthActions):
+    token = auth.login()
+
+    response = client.get(
+        '/charges/timesheet',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json={'date_range': {'start': '2024-02-01', 'end': '2024-02-29'}})
+
+    assert response.status_code == 200
+    timesheet = response.get_json()
+
+    assert timesheet['start'] == '2024-02-01'
+    assert timesheet['end'] == '2024-02-29'
+    assert [project['id'] for project in timesheet['projects']] == [1, 2]
+    assert all(len(row) == 29 for row in timesheet['hours'])
+
+    assert timesheet['hours'][0][0] == 5
+    assert timesheet['hours'][0][5] == 3
+    assert timesheet['hours'][1][28] == 8
+    assert timesheet['project_totals'] == [8, 8]
+    assert timesheet['day_totals'][0] == 5
+    assert sum(timesheet['day_totals']) == timesheet['total'] == 16
+
+
+def test_get_timesheet_empty_range(client: FlaskClient, auth: AuthActions):
+    token = auth.login()
+
+    response = client.get(
+        '/charges/timesheet',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json={'date_range': {'start': '2024-03-04', 'end': '2024-03-10'}})
+
+    assert response.status_code == 200
+    timesheet = response.get_json()
+
+    assert len(timesheet['projects']) == 2
+    assert timesheet['hours'] == [[0] * 7, [0] * 7]
+    assert timesheet['total'] == 0
+
+
+@pytest.mark.parametrize('date_range, message, status', (
+    (None, b'Date range required', 400),
+    ({'start': '2024-02-01'}, b'End date required', 400),
+    ({'start': '2024-03-01', 'end': '2024-02-28'}, b'End date must be after start date', 400),
+    ({'start': '2023-01-01', 'end': '2024-12-31'}, b'Date range cannot exceed', 400),
+))
+def test_get_timesheet_validate_input(client: FlaskClient, auth: AuthActions, date_range, message,
+                                      status):
+    token = auth.login()
+
+    response = client.get(
+        '/charges/timesheet',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json={'date_range': date_range})
+
+    assert response.status_code == status
+    assert message in response.data
+
+
+@pytest.mark.parametrize('period, expected_ids', (
+    ({'week': '2024-W06'}, [2]),
+    ({'month': '2024-02'}, [1, 2, 3]),
+    ({'quarter': '2024-Q1'}, [1, 2, 3]),
+    ({'year': 2023}, []),
+    ({'last_days': 7}, []),
+))
+def test_get_charges_period(client: FlaskClient, auth: AuthActions, period, expected_ids):
+    token = auth.login()
+
+    response = client.get(
+        '/charges/',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json={'period': period})
+
+    assert response.status_code == 200
+    assert [charge['id'] for charge in response.get_json().get('charges')] == expected_ids
+
+
+@pytest.mark.parametrize('body, message', (
+    ({'period': {'week': '2024-W60'}}, b'Invalid week period'),
+    ({'period': {'month': '2024-13'}}, b'Invalid month period'),
+    ({'period': {'quarter': 'Q1'}}, b'Invalid quarter period'),
+    ({'period': {'last_days': 0}}, b'Invalid last_days period'),
+    ({'period': {'last_days': 10 ** 9}}, b'Invalid last_days period'),
+    ({'period': {'last_days': True}}, b'Invalid last_days period'),
+    ({'period': 'x'}, b'exactly one of'),
+    ({'date_range': 'x'}, b'Date range must be an object'),
+    ({'date_range': {'start': 1, 'end': 2}}, b'Invalid date format'),
+    ({'period': {'fortnight': '2024-01'}}, b'Unknown period'),
+    ({'period': {'month': '2024-01', 'year': 2024}}, b'exactly one of'),
+    ({'period': {'year': 2024}, 'date_range': {'start': '2024-01-01', 'end': '2024-01-02'}},
+     b'either a date range or a period'),
+))
+def test_get_charges_period_validate_input(client: FlaskClient, auth: AuthActions, body, message):
+    token = auth.login()
+
+    response = client.get(
+        '/charges/',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json=body)
+
+    assert response.status_code == 400
+    assert message in response.data
+
+
+@pytest.mark.parametrize('body, expected', (
+    ({'group_by': 'month'}, [{'period': '2024-02', 'project': 1, 'hours': 8},
+                             {'period': '2024-02', 'project': 2, 'hours': 8}]),
+    ({'group_by': 'week', 'period': {'month': '2024-02'}},
+     [{'period': '2024-W05', 'project': 1, 'hours': 5},
+      {'period': '2024-W06', 'project': 1, 'hours': 3},
+      {'period': '2024-W09', 'project': 2, 'hours': 8}]),
+    ({'group_by': 'day', 'date_range': {'start': '2024-02-02', 'end': '2024-02-29'}},
+     [{'period': '2024-02-06', 'project': 1, 'hours': 3},
+      {'period': '2024-02-29', 'project': 2, 'hours': 8}]),
+    ({'group_by': 'year', 'period': {'year': 2023}}, []),
+))
+def test_get_summary(client: FlaskClient, auth: AuthActions, body, expected):
+    token = auth.login()
+
+    response = client.get(
+        '/charges/summary',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json=body)
+
+    assert response.status_code == 200
+    assert response.get_json().get('summary') == expected
+
+
+@pytest.mark.parametrize('group_by', ('decade', ['month']))
+def test_get_summary_invalid_group_by(client: FlaskClient, auth: AuthActions, group_by):
+    token = auth.login()
+
+    response = client.get(
+        '/charges/summary',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json={'group_by': group_by})
+
+    assert response.status_code == 400
+    assert b'Invalid group_by' in response.data
+
+
+@pytest.mark.parametrize('body, status', (
+    ({'date_range': {'start': '9999-01-01', 'end': '9999-12-31'}}, 200),
+    ({'date_range': {'start': '1925-01-01', 'end': '2024-12-31'}}, 200),
+    ({'date_range': {'start': '1924-01-01', 'end': '2024-12-31'}}, 400),
+    ({'date_range': {'start': '1000-01-01', 'end': '9000-12-31'}}, 400),
+))
+def test_get_summary_span(client: FlaskClient, auth: AuthActions, body, status):
+    token = auth.login()
+
+    response = client.get(
+        '/charges/summary',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json=body)
+
+    assert response.status_code == status
+
+    if status == 400:
+        assert b'cannot span more than 100 years' in response.data
+
+
+def test_update_charges_move(client: FlaskClient, auth: AuthActions):
+    token = auth.login()
+
+    response = client.put(
+        '/charges/update',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json={'charges': [{'id': 1, 'project': 2, 'date_charged': '2024-02-02'}]})
+
+    assert response.status_code == 200
+    charge = response.get_json()['charges'][0]
+    assert (charge['id'], charge['project'], charge['hours'], charge['date_charged']) == (
+        1, 2, 5, '2024-02-02')
+
+
+@pytest.mark.parametrize('charge, message, status', (
+    ({'id': 1, 'project': 3}, b'Forbidden', 403),
+    ({'id': 1, 'date_charged': '2024-02-06'}, b'Project already charged for this date', 400),
+    ({'id': 1, 'date_charged': '02/06/2024'}, b'Invalid date format', 400),
+))
+def test_update_charges_move_validate_input(client: FlaskClient, auth: AuthActions, charge,
+                                            message, status):
+    token = auth.login()
+
+    response = client.put(
+        '/charges/update',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json={'charges': [charge]})
+
+    assert response.status_code == status
+    assert message in response.data
+
+
+@pytest.mark.parametrize('body, count, expected', (
+    ({'filter': {'project': 1}, 'set': {'hours': 1}},
+     2, [(1, 1, '2024-02-01', 1), (2, 1, '2024-02-06', 1), (3, 2, '2024-02-29', 8)]),
+    ({'filter': {'period': {'month': '2024-02'}, 'hours': {'gte': 5}}, 'set': {'shift_days': 1}},
+     2, [(1, 1, '2024-02-02', 5), (2, 1, '2024-02-06', 3), (3, 2, '2024-03-01', 8)]),
+    ({'filter': {'date_range': {'start': '2024-02-01', 'end': '2024-02-06'}},
+      'set': {'project': 2, 'date_charged': '2024-03-01'}, 'dry_run': True},
+     2, [(1, 1, '2024-02-01', 5), (2, 1, '2024-02-06', 3), (3, 2, '2024-02-29', 8)]),
+))
+def test_bulk_update_charges(client: FlaskClient, auth: AuthActions, app: Flask, body, count,
+                             expected):
+    token = auth.login()
+
+    response = client.put(
+        '/charges/bulk_update',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json=body)
+
+    assert response.status_code == 200
+    assert response.get_json()['count'] == count
+
+    with app.app_context():
+        db = open_trs.db.get_db()
+        db_charges = db.execute('SELECT id, project, date_charged, hours FROM Charges'
+                                ' WHERE user = ? ORDER BY id', (1,)).fetchall()
+
+        assert [(charge['id'], charge['project'], open_trs.db.day_to_iso(charge['date_charged']),
+                 charge['hours']) for charge in db_charges] == expected
+
+
+def test_bulk_update_charges_shift_consecutive_days(client: FlaskClient, auth: AuthActions,
+                                                    app: Flask):
+    token = auth.login()
+    headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'}
+    client.post('/charges/create', headers=headers, json={'charges': [
+        {'project': 1, 'hours': 1, 'date_charged': f'2024-03-0{day}'} for day in range(4, 8)]})
+
+    def shift(start: str, end: str, shift_days: int):
+        return client.put('/charges/bulk_update', headers=headers, json={
+            'filter': {'project': 1, 'date_range': {'start': start, 'end': end}},
+            'set': {'shift_days': shift_days}})
+
+    def get_days() -> List[str]:
+        with app.app_context():
+            return [open_trs.db.day_to_iso(row['date_charged']) for row in open_trs.db.get_db()
+                    .execute('SELECT date_charged FROM Charges WHERE user = 1 AND project = 1'
+                             ' AND date_charged >= ? ORDER BY date_charged',
+                             (open_trs.db.date_to_day(datetime.date(2024, 3, 1)),))]
+
+    # Every charge but the last moves onto the day of the next one
+    assert shift('2024-03-01', '2024-03-31', 1).status_code == 200
+    assert get_days() == ['2024-03-05', '2024-03-06', '2024-03-07', '2024-03-08']
+
+    assert shift('2024-03-01', '2024-03-31', -2).status_code == 200
+    assert get_days() == ['2024-03-03', '2024-03-04', '2024-03-05', '2024-03-06']
+
+    # Charges left in place still conflict
+    response = shift('2024-03-03', '2024-03-04', 1)
+
+    assert response.status_code == 400
+    assert b'Project already charged for this date' in response.data
+    assert get_days() == ['2024-03-03', '2024-03-04', '2024-03-05', '2024-03-06']
+
+
+@pytest.mark.parametrize('body, message, status', (
+    ({'set': {'hours': 1}}, b'Filter required', 400),
+    ({'filter': {'hours': {'like': 1}}, 'set': {'hours': 1}}, b'Invalid hours operator', 400),
+    ({'filter': {'project': 1}}, b'No changes provided', 400),
+    ({'filter': {'project': 1}, 'set': {'hours': 0}}, b'Hours must be greater than 0', 400),
+    ({'filter': {'project': 1}, 'set': {'project': 3}}, b'Forbidden', 403),
+    ({'filter': {'project': 1}, 'set': {'date_charged': '2024-02-01', 'shift_days': 1}},
+     b'Specify either date_charged or shift_days', 400),
+    ({'filter': {'project': 1}, 'set': {'date_charged': '2024-03-01'}},
+     b'Project already charged for this date', 400),
+    ({'filter': {'project': 1}, 'set': {'shift_days': True}}, b'Invalid shift_days', 400),
+    ({'filter': {'project': 1}, 'set': {'shift_days': 10 ** 7}, 'dry_run': True},
+     b'Invalid shift_days', 400),
+    ({'filter': {'project': 1}, 'set': {'shift_days': 3 * 10 ** 6}, 'dry_run': True},
+     b'past the supported dates', 400),
+    ({'filter': {'project': 42}, 'set': {'shift_days': 10 ** 30}}, b'Invalid shift_days', 400),
+))
+def test_bulk_update_charges_validate_input(client: FlaskClient, auth: AuthActions, body, message,
+                                            status):
+    token = auth.login()
+
+    response = client.put(
+        '/charges/bulk_update',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json=body)
+
+    assert response.status_code == status
+    assert message in response.data
+
+
+@pytest.mark.parametrize('dry_run, remaining', ((False, [3, 4]), (True, [1, 2, 3, 4])))
+def test_bulk_delete_charges(client: FlaskClient, auth: AuthActions, app: Flask, dry_run,
+                             remaining):
+    token = auth.login()
+
+    # User 2 also charged on 2024-02-06, but bulk operations only touch the user's own charges
+    response = client.delete(
+        '/charges/bulk_delete',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json={'filter': {'date_range': {'start': '2024-02-01', 'end': '2024-02-06'}},
+              'dry_run': dry_run})
+
+    assert response.status_code == 200
+    assert response.get_json()['count'] == 2
+
+    with app.app_context():
+        db = open_trs.db.get_db()
+        ids = [row['id'] for row in db.execute('SELECT id FROM Charges ORDER BY id')]
+
+        assert ids == remaining
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+from flask import Flask, jsonify
+
+import open_trs.auth
+import open_trs.coalesce
+import open_trs.db
+import open_trs.events
+from tests.conftest import AuthActions
+
+_calls = []
+_release = threading.Event()
+
+
+@open_trs.auth.login_required
+@open_trs.coalesce.coalesced
+def _slow_view(user_id: int):
+    _calls.append(user_id)
+    _release.wait(5)
+
+    return jsonify({'calls': len(_calls)}), 200
+
+
+@pytest.fixture
+def coalesce_app(file_app: Flask) -> Flask:
+    """
+    Adds a slow view that counts its executions to a file-backed app, where concurrent requests
+    use their own connections.
+    """
+
+    file_app.add_url_rule('/slow', 'slow', _slow_view)
+    file_app.test_client().post('/auth/register', json={
+        'username': 'test', 'email': 'test@test.com', 'password': 'test'})
+    _calls.clear()
+    _release.clear()
+
+    return file_app
+
+
+def _get_concurrently(app: Flask, requests: list) -> list:
+    responses = [None] * len(requests)
+
+    def get(index: int, headers: dict, json: dict):
+        responses[index] = app.test_client().get('/slow', headers=headers, json=json)
+
+    threads = [threading.Thread(target=get, args=(index, *request))
+               for index, request in enumerate(requests)]
+
+    for thread in threads:
+        thread.start()
+        time.sleep(0.1)
+
+    _release.set()
+
+    for thread in threads:
+        thread.join()
+
+    return responses
+
+
+def test_coalesce_identical_requests(coalesce_app: Flask):
+    headers = {'Authorization': f'Bearer {AuthActions(coalesce_app.test_client()).login()}'}
+
+    responses = _get_concurrently(coalesce_app, [(headers, {'a': 1, 'b': 2})] * 2
+                                  + [(headers, {'b': 2, 'a': 1})])
+
+    assert _calls == [1]
+    assert [response.get_json() for response in responses] == [{'calls': 1}] * 3
+
+
+def test_coalesce_different_requests(coalesce_app: Flask):
+    headers = {'Authorization': f'Bearer {AuthActions(coalesce_app.test_client()).login()}'}
+
+    responses = _get_concurrently(coalesce_app, [(headers, {'a': 1}), (headers, {'a': 2})])
+
+    assert _calls == [1, 1]
+    assert all(response.status_code == 200 for response in responses)
+
+
+def test_coalesce_after_change(coalesce_app: Flask):
+    client = coalesce_app.test_client()
+    headers = {'Authorization': f'Bearer {AuthActions(client).login()}'}
+    threads = [threading.Thread(target=client.get, args=('/slow',),
+                                kwargs={'headers': headers, 'json': {}}) for _ in range(2)]
+    threads[0].start()
+    time.sleep(0.1)
+
+    # A change committed while the first request runs, whose event has expired since
+    with coalesce_app.app_context():
+        db = open_trs.db.get_db()
+        open_trs.events.publish(db, 1, 'projects', {'action': 'created', 'ids': []})
+        db.execute('DELETE FROM Events')
+        db.commit()
+
+    threads[1].start()
+    time.sleep(0.1)
+    _release.set()
+
+    for thread in threads:
+        thread.join()
+
+    assert _calls == [1, 1]
+
+
+def test_coalesce_disabled(coalesce_app: Flask):
+    coalesce_app.config['COALESCE_READS'] = False
+    headers = {'Authorization': f'Bearer {AuthActions(coalesce_app.test_client()).login()}'}
+
+    _get_concurrently(coalesce_app, [(headers, {'a': 1})] * 2)
+
+    assert _calls == [1, 1]
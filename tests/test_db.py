@@ -1,3 +1,4 @@
+import datetime
 import sqlite3
 
 import pytest
@@ -30,3 +31,247 @@ def test_init_db_command(runner: FlaskCliRunner, monkeypatch: pytest.MonkeyPatch
 
     assert 'Initialized' in result.output
     assert Recorder.called
+
+
+def test_populate_calendar(app: Flask):
+    with app.app_context():
+        db = open_trs.db.get_db()
+        open_trs.db.populate_calendar(db, 2023, 2024)
+        open_trs.db.populate_calendar(db, 2024, 2024)
+
+        assert db.execute('SELECT COUNT(*) FROM Calendar').fetchone()[0] == 365 + 366
+
+        day = db.execute('SELECT * FROM Calendar WHERE date = ?', ('2024-12-30',)).fetchone()
+        assert open_trs.db.day_to_date(day['day']) == datetime.date(2024, 12, 30)
+        assert day['iso_week'] == '2025-W01'
+        assert day['month'] == '2024-12'
+        assert day['quarter'] == '2024-Q4'
+        assert day['year'] == 2024
+
+
+_LEGACY_SCHEMA = '''
+CREATE TABLE Users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    email TEXT UNIQUE NOT NULL,
+    password TEXT NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE Projects (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    owner INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    category INTEGER NOT NULL DEFAULT 0,
+    description TEXT,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (owner) REFERENCES Users (id)
+);
+
+CREATE TABLE Charges (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project INTEGER NOT NULL,
+    user INTEGER NOT NULL,
+    hours INTEGER NOT NULL,
+    date_charged DATE NOT NULL,
+    created TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (project) REFERENCES Projects (id),
+    FOREIGN KEY (user) REFERENCES Users (id)
+);
+
+INSERT INTO Projects (owner, name) VALUES (1, 'Legacy Project');
+INSERT INTO Charges (project, user, hours, date_charged)
+VALUES (1, 1, 4, '2023-12-31'), (1, 1, 2, '2024-02-29'), (1, 1, 1, '2024-03-01'),
+       (1, 1, 3, '2023-12-31');
+DELETE FROM Charges WHERE date_charged = '2024-03-01';
+'''
+
+
+@pytest.mark.parametrize('file_app', [{'init_db': False}], indirect=True)
+def test_migrate_db_command(file_app: Flask):
+    legacy_db = sqlite3.connect(file_app.config['DATABASE'])
+    legacy_db.executescript(_LEGACY_SCHEMA)
+    legacy_db.close()
+
+    with file_app.app_context():
+        result = file_app.test_cli_runner().invoke(args=['migrate-db'])
+
+        assert '0002_integer_dates.sql' in result.output
+        assert '0004_unique_charges.sql' in result.output
+        assert f'schema version {open_trs.db.SCHEMA_VERSION}' in result.output
+
+        db = open_trs.db.get_db()
+
+        assert db.execute('PRAGMA user_version').fetchone()[0] == open_trs.db.SCHEMA_VERSION
+
+        charges = db.execute('SELECT * FROM Charges ORDER BY id').fetchall()
+        assert [(open_trs.db.day_to_iso(charge['date_charged']), charge['hours'])
+                for charge in charges] == [('2023-12-31', 7), ('2024-02-29', 2)]
+
+        db.execute('INSERT INTO Charges (project, user, hours, date_charged) VALUES (1, 1, 1, 0)')
+        assert db.execute('SELECT MAX(id) FROM Charges').fetchone()[0] == 5
+
+        result = file_app.test_cli_runner().invoke(args=['migrate-db'])
+        assert 'Applied' not in result.output
+
+
+@pytest.mark.parametrize('file_app', [{'init_db': False}], indirect=True)
+def test_migrate_db_command_uninitialized(file_app: Flask):
+    with file_app.app_context():
+        result = file_app.test_cli_runner().invoke(args=['migrate-db'])
+
+    assert result.exit_code != 0
+    assert 'init-db' in result.output
+
+
+def test_schema_version(app: Flask):
+    with app.app_context():
+        db = open_trs.db.get_db()
+        assert db.execute('PRAGMA user_version').fetchone()[0] == open_trs.db.SCHEMA_VERSION
+
+
+def _login(client, username: str) -> str:
+    return client.post('/auth/login', json={'username': username, 'password': username}
+                       ).get_json()['token']
+
+
+def _register_and_login(client, username: str) -> str:
+    client.post('/auth/register', json={'username': username, 'email': f'{username}@test.com',
+                                        'password': username})
+
+    return _login(client, username)
+
+
+def _create_project(client, token: str, name: str) -> dict:
+    headers = {'Authorization': f'Bearer {token}'}
+    project = client.post('/projects/create', headers=headers, json={'name': name, 'category': 0}
+                          ).get_json()['project']
+    client.post('/charges/create', headers=headers, json={
+        'charges': [{'hours': 1, 'project': project['id'], 'date_charged': '2024-01-01'}]})
+
+    return project
+
+
+# A directory database and two shards
+_sharded = pytest.mark.parametrize('file_app', [{
+    'DATABASE': '{tmp_path}/directory.sqlite',
+    'DATABASE_SHARDS': {'a': '{tmp_path}/shard_a.sqlite', 'b': '{tmp_path}/shard_b.sqlite'}}],
+    indirect=True)
+
+
+def test_hash_ring():
+    ring = open_trs.db.HashRing(['a', 'b'])
+    grown_ring = open_trs.db.HashRing(['a', 'b', 'c'])
+
+    placements = [ring.get_shard(user_id) for user_id in range(1000)]
+    grown_placements = [grown_ring.get_shard(user_id) for user_id in range(1000)]
+    moved = [(old, new) for old, new in zip(placements, grown_placements) if old != new]
+
+    assert 350 < placements.count('a') < 650
+    assert all(new == 'c' for _, new in moved)
+    assert 200 < len(moved) < 450
+
+
+@_sharded
+def test_sharded_writes(file_app: Flask):
+    client = file_app.test_client()
+    ring = open_trs.db.HashRing(['a', 'b'])
+    users = {}
+
+    for username in ('alice', 'bob', 'carol', 'dave'):
+        token = _register_and_login(client, username)
+        users[username] = _create_project(client, token, f'{username} project')
+
+    for username, project in users.items():
+        user_id = project['owner']
+        shard = ring.get_shard(user_id)
+        other_shard = 'b' if shard == 'a' else 'a'
+
+        assert project['id'] > 2 ** 40
+
+        for name, should_exist in ((shard, True), (other_shard, False)):
+            db = sqlite3.connect(file_app.config['DATABASE_SHARDS'][name])
+            charges = db.execute('SELECT * FROM Charges WHERE user = ?', (user_id,)).fetchall()
+            db.close()
+
+            assert (len(charges) == 1) == should_exist
+
+        response = client.get('/projects/',
+                              headers={'Authorization': f'Bearer {_login(client, username)}'})
+        assert response.get_json()['projects'] == [project]
+
+    directory = sqlite3.connect(file_app.config['DATABASE'])
+    assert directory.execute('SELECT COUNT(*) FROM UserShards').fetchone()[0] == 4
+    assert directory.execute('SELECT COUNT(*) FROM Projects').fetchone()[0] == 0
+    directory.close()
+
+
+@_sharded
+def test_rebalance_shards_command(file_app: Flask):
+    shards = file_app.config['DATABASE_SHARDS']
+    file_app.config['DATABASE_SHARDS'] = {'a': shards['a']}
+    client = file_app.test_client()
+    projects = {}
+
+    for username in ('alice', 'bob', 'carol', 'dave', 'erin', 'frank'):
+        token = _register_and_login(client, username)
+        projects[username] = _create_project(client, token, f'{username} project')
+
+    file_app.config['DATABASE_SHARDS'] = shards
+    expected_moves = [project['owner'] for project in projects.values()
+                      if open_trs.db.HashRing(['a', 'b']).get_shard(project['owner']) == 'b']
+
+    assert expected_moves
+
+    with file_app.app_context():
+        runner = file_app.test_cli_runner()
+
+        result = runner.invoke(args=['rebalance-shards', '--dry-run'])
+        assert f'Would move {len(expected_moves)} users' in result.output
+
+        result = runner.invoke(args=['rebalance-shards'])
+        assert f'Moved {len(expected_moves)} users' in result.output
+
+        result = runner.invoke(args=['rebalance-shards'])
+        assert 'Moved 0 users' in result.output
+
+    shard_a = sqlite3.connect(shards['a'])
+    shard_b = sqlite3.connect(shards['b'])
+    moved_users = [row[0] for row in shard_b.execute('SELECT DISTINCT user FROM Charges')]
+    # Users' change events move with their data, keeping their IDs
+    moved_events = [row[0] for row in shard_b.execute('SELECT DISTINCT user FROM Events')]
+    remaining_events = [row[0] for row in shard_a.execute('SELECT DISTINCT user FROM Events')]
+    shard_a.close()
+    shard_b.close()
+
+    assert sorted(moved_users) == sorted(moved_events) == sorted(expected_moves)
+    assert not set(remaining_events) & set(expected_moves)
+
+    for username, project in projects.items():
+        response = client.get('/charges/',
+                              headers={'Authorization': f'Bearer {_login(client, username)}'},
+                              json={})
+
+        assert [charge['project'] for charge in response.get_json()['charges']] == [project['id']]
+
+
+def test_bind_values(app: Flask):
+    with app.app_context():
+        db = open_trs.db.get_db()
+        db.execute('CREATE TABLE Bound (id INTEGER PRIMARY KEY, name TEXT)')
+
+        # More rows and values than SQLite's variable limit, under a single statement text
+        num_rows = db.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER) + 1
+        rows_sql, rows_parameters = open_trs.db.bind_rows(
+            db, [(i, f'name {i}') for i in range(num_rows)], 2)
+        db.execute(f'INSERT INTO Bound (id, name) {rows_sql}', rows_parameters)
+
+        ids_sql, ids_parameters = open_trs.db.bind_values(db, range(0, num_rows, 2))
+        small_ids_sql, _ = open_trs.db.bind_values(db, [1])
+        assert ids_sql == small_ids_sql
+        assert db.execute(f'SELECT COUNT(*) FROM Bound WHERE id IN {ids_sql}', ids_parameters
+                          ).fetchone()[0] == (num_rows + 1) // 2
+
+        names_sql, names_parameters = open_trs.db.bind_values(db, ['name 3', 'missing'])
+        assert [row['id'] for row in db.execute(
+            f'SELECT id FROM Bound WHERE name IN {names_sql}', names_parameters)] == [3]
@@ -0,0 +1,116 @@
+import json
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+import open_trs.db
+from tests.conftest import AuthActions
+
+
+@pytest.fixture
+def headers(app: Flask, auth: AuthActions) -> dict:
+    """
+    Logs in and makes event streams return once they have caught up.
+    """
+
+    app.config['EVENTS_STREAM_TIMEOUT'] = 0
+
+    return {'Content-Type': 'application/json', 'Authorization': f'Bearer {auth.login()}'}
+
+
+def _read_events(client: FlaskClient, headers: dict, **kwargs) -> list:
+    # Closed like a server would, which frees the stream's place
+    with client.get('/events/stream', headers=headers, **kwargs) as response:
+        assert response.status_code == 200
+        assert response.mimetype == 'text/event-stream'
+        data = response.get_data(as_text=True)
+
+    events = []
+
+    for message in data.split('\n\n'):
+        fields = dict(line.split(': ', 1) for line in message.splitlines()
+                      if not line.startswith(':'))
+
+        if 'event' in fields:
+            events.append((int(fields['id']), fields['event'], json.loads(fields['data'])))
+
+    return events
+
+
+def test_stream_changes(client: FlaskClient, headers: dict):
+    assert _read_events(client, headers) == []
+
+    charge = client.post('/charges/create', headers=headers, json={
+        'charges': [{'hours': 1, 'project': 1, 'date_charged': '2024-03-01'}]}
+    ).get_json()['charges'][0]
+    client.put('/charges/update', headers=headers,
+               json={'charges': [{'id': charge['id'], 'hours': 2}]})
+    project = client.post('/projects/create', headers=headers,
+                          json={'name': 'Streamed', 'category': 0}).get_json()['project']
+    client.delete(f'/projects/{project["id"]}/delete', headers=headers)
+    client.delete('/charges/bulk_delete', headers=headers, json={'filter': {'project': 1}})
+
+    events = _read_events(client, headers, query_string={'last_event_id': 0})
+
+    assert [(topic, data) for _, topic, data in events] == [
+        ('charges', {'action': 'created', 'ids': [charge['id']]}),
+        ('charges', {'action': 'updated', 'ids': [charge['id']]}),
+        ('projects', {'action': 'created', 'ids': [project['id']]}),
+        ('projects', {'action': 'deleted', 'ids': [project['id']]}),
+        ('charges', {'action': 'deleted', 'count': 3}),
+    ]
+
+    # Browsers resume with the ID of the last event they received
+    resumed = _read_events(client, {**headers, 'Last-Event-ID': str(events[2][0])})
+    assert resumed == events[3:]
+
+
+def test_stream_only_own_events(client: FlaskClient, auth: AuthActions, headers: dict):
+    client.post('/projects/create', headers=headers, json={'name': 'Mine', 'category': 0})
+
+    credentials = {'username': 'other', 'email': 'other@test.com', 'password': 'other'}
+    client.post('/auth/register', json=credentials)
+    other_token = auth.login(**credentials)
+    other_headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {other_token}'}
+
+    assert _read_events(client, other_headers, query_string={'last_event_id': 0}) == []
+
+
+def test_stream_reset(client: FlaskClient, app: Flask, headers: dict):
+    client.post('/projects/create', headers=headers, json={'name': 'Expired', 'category': 0})
+    client.post('/projects/create', headers=headers, json={'name': 'Kept', 'category': 0})
+
+    with app.app_context():
+        db = open_trs.db.get_db()
+        first_id = db.execute('SELECT MIN(id) FROM Events').fetchone()[0]
+        db.execute('DELETE FROM Events WHERE id = ?', (first_id,))
+        db.commit()
+
+    events = _read_events(client, {**headers, 'Last-Event-ID': str(first_id - 1)})
+
+    assert [topic for _, topic, _ in events] == ['reset', 'projects']
+
+
+def test_stream_invalid_last_event_id(client: FlaskClient, headers: dict):
+    response = client.get('/events/stream', headers={**headers, 'Last-Event-ID': 'abc'})
+
+    assert response.status_code == 400
+    assert b'Invalid Last-Event-ID' in response.data
+
+
+def test_stream_limit(client: FlaskClient, app: Flask, headers: dict):
+    app.config['EVENTS_MAX_STREAMS'] = 1
+    first = client.get('/events/stream', headers=headers)
+
+    response = client.get('/events/stream', headers=headers)
+
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '1'
+
+    # Closing a stream frees its place
+    first.close()
+    response = client.get('/events/stream', headers=headers)
+
+    assert response.status_code == 200
+    response.close()
@@ -1,7 +1,14 @@
+import gc
+import logging
+import os
+
 import pytest
 
 import open_trs
 import open_trs.configs
+import open_trs.db
+import open_trs.metrics
+from tests.conftest import AuthActions
 
 
 def test_config(monkeypatch: pytest.MonkeyPatch):
@@ -12,3 +19,46 @@ def test_config(monkeypatch: pytest.MonkeyPatch):
     monkeypatch.setenv('FLASK_ENV', 'development')
     normal_app = open_trs.create_app()
     assert not normal_app.testing
+
+
+def test_config_overrides():
+    app = open_trs.create_app(testing=True, config={'JWT_EXPIRATION': 60})
+
+    assert app.config['JWT_EXPIRATION'] == 60
+
+
+def test_warmup(tmp_path, caplog: pytest.LogCaptureFixture):
+    database = str(tmp_path / 'open_trs.sqlite')
+
+    with open_trs.create_app(testing=True, config={'DATABASE': database}).app_context():
+        open_trs.db.init_db()
+
+    caplog.set_level(logging.INFO)
+
+    try:
+        app = open_trs.create_app(testing=True, config={'DATABASE': database, 'WARMUP': True})
+
+        assert gc.get_freeze_count() > 0
+        assert 'Warmed up' in caplog.text
+    finally:
+        gc.unfreeze()
+
+    auth = AuthActions(app.test_client())
+    app.test_client().post('/auth/register', json={
+        'username': 'test', 'email': 'test@test.com', 'password': 'test'})
+    assert auth.login() is not None
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='Requires os.fork')
+def test_fork_resets_process_state():
+    open_trs.metrics.increment('forked')
+    pid = os.fork()
+
+    if pid == 0:
+        # Report through the exit status, since assertions cannot fail the test from the child
+        os._exit(0 if not open_trs.metrics.get_counters() else 1)
+
+    _, status = os.waitpid(pid, 0)
+
+    assert os.waitstatus_to_exitcode(status) == 0
+    assert open_trs.metrics.get_counters()[('forked', ())] >= 1
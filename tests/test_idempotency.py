@@ -0,0 +1,161 @@
+import datetime
+import time
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+import open_trs.db
+from tests.conftest import AuthActions
+
+_NEW_CHARGES = {'charges': [{'hours': 1, 'project': 1, 'date_charged': '2024-01-01'}]}
+
+
+def _headers(token: str, key: str) -> dict:
+    return {'Content-Type': 'application/json', 'Authorization': f'Bearer {token}',
+            'Idempotency-Key': key}
+
+
+def test_idempotent_retry(client: FlaskClient, auth: AuthActions, app: Flask):
+    token = auth.login()
+
+    first = client.post('/charges/create', headers=_headers(token, 'retry'), json=_NEW_CHARGES)
+    retry = client.post('/charges/create', headers=_headers(token, 'retry'), json=_NEW_CHARGES)
+
+    assert first.status_code == retry.status_code == 201
+    assert first.get_json() == retry.get_json()
+    assert 'Idempotent-Replayed' not in first.headers
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+
+    with app.app_context():
+        db = open_trs.db.get_db()
+        charges = db.execute('SELECT * FROM Charges WHERE project = 1 AND date_charged = ?',
+                             (open_trs.db.date_to_day(datetime.date(2024, 1, 1)),)).fetchall()
+
+        assert len(charges) == 1
+
+
+def test_idempotent_retry_project(client: FlaskClient, auth: AuthActions):
+    token = auth.login()
+    new_project = {'name': 'Idempotent Project', 'category': 0}
+
+    first = client.post('/projects/create', headers=_headers(token, 'project'), json=new_project)
+    retry = client.post('/projects/create', headers=_headers(token, 'project'), json=new_project)
+
+    assert first.status_code == retry.status_code == 201
+    assert first.get_json() == retry.get_json()
+
+
+def test_idempotent_different_request(client: FlaskClient, auth: AuthActions):
+    token = auth.login()
+
+    client.post('/charges/create', headers=_headers(token, 'reused'), json=_NEW_CHARGES)
+    response = client.post('/charges/create', headers=_headers(token, 'reused'),
+                           json={'charges': [{'hours': 2, 'project': 1,
+                                              'date_charged': '2024-01-01'}]})
+
+    assert response.status_code == 422
+    assert b'already used for a different request' in response.data
+
+
+def test_idempotent_in_progress(client: FlaskClient, auth: AuthActions, app: Flask):
+    token = auth.login()
+
+    with app.app_context():
+        db = open_trs.db.get_db()
+        db.execute('INSERT INTO IdempotencyKeys (user, idempotency_key, request_hash, created)'
+                   ' VALUES (?, ?, ?, ?)', (1, 'in-flight', 'hash', int(time.time())))
+        db.commit()
+
+    response = client.post('/charges/create', headers=_headers(token, 'in-flight'),
+                           json=_NEW_CHARGES)
+
+    assert response.status_code == 409
+    assert b'already in progress' in response.data
+
+
+def test_idempotent_in_progress_lease_expired(client: FlaskClient, auth: AuthActions,
+                                              app: Flask):
+    token = auth.login()
+
+    # Claimed by a request whose worker died before it finished
+    with app.app_context():
+        db = open_trs.db.get_db()
+        db.execute('INSERT INTO IdempotencyKeys (user, idempotency_key, request_hash, created)'
+                   ' VALUES (?, ?, ?, ?)',
+                   (1, 'abandoned', 'hash',
+                    int(time.time()) - app.config['IDEMPOTENCY_CLAIM_LEASE'] - 1))
+        db.commit()
+
+    response = client.post('/charges/create', headers=_headers(token, 'abandoned'),
+                           json=_NEW_CHARGES)
+    retry = client.post('/charges/create', headers=_headers(token, 'abandoned'),
+                        json=_NEW_CHARGES)
+
+    assert response.status_code == 201
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+
+
+def test_idempotent_failure_releases_key(client: FlaskClient, auth: AuthActions):
+    token = auth.login()
+
+    response = client.post('/charges/create', headers=_headers(token, 'failure'),
+                           json={'charges': [{'hours': 1, 'project': 42,
+                                              'date_charged': '2024-01-01'}]})
+    assert response.status_code == 404
+
+    response = client.post('/charges/create', headers=_headers(token, 'failure'),
+                           json=_NEW_CHARGES)
+    assert response.status_code == 201
+
+
+def test_idempotency_keys_expire(client: FlaskClient, auth: AuthActions, app: Flask):
+    token = auth.login()
+
+    with app.app_context():
+        db = open_trs.db.get_db()
+        db.execute('INSERT INTO IdempotencyKeys'
+                   ' (user, idempotency_key, request_hash, status_code, response, created)'
+                   ' VALUES (?, ?, ?, ?, ?, ?)',
+                   (1, 'expired', 'hash', 201, '{}',
+                    int(time.time()) - app.config['IDEMPOTENCY_KEY_TTL'] - 1))
+        db.commit()
+
+    response = client.post('/charges/create', headers=_headers(token, 'expired'),
+                           json=_NEW_CHARGES)
+
+    assert response.status_code == 201
+    assert 'Idempotent-Replayed' not in response.headers
+
+
+def test_idempotency_keys_bounded(client: FlaskClient, auth: AuthActions, app: Flask):
+    token = auth.login()
+    app.config['IDEMPOTENCY_MAX_KEYS'] = 2
+
+    with app.app_context():
+        db = open_trs.db.get_db()
+        db.executemany('INSERT INTO IdempotencyKeys'
+                       ' (user, idempotency_key, request_hash, status_code, response, created)'
+                       ' VALUES (?, ?, ?, ?, ?, ?)',
+                       [(1, f'old-{i}', 'hash', 201, '{}', int(time.time()) - 10 + i)
+                        for i in range(3)])
+        db.commit()
+
+    client.post('/charges/create', headers=_headers(token, 'newest'), json=_NEW_CHARGES)
+
+    with app.app_context():
+        db = open_trs.db.get_db()
+        keys = [row['idempotency_key'] for row in db.execute(
+            'SELECT idempotency_key FROM IdempotencyKeys ORDER BY created')]
+
+        assert keys == ['old-2', 'newest']
+
+
+@pytest.mark.parametrize('key', ('', 'k' * 256))
+def test_idempotency_key_validate_input(client: FlaskClient, auth: AuthActions, key):
+    token = auth.login()
+
+    response = client.post('/charges/create', headers=_headers(token, key), json=_NEW_CHARGES)
+
+    assert response.status_code == 400
+    assert b'Idempotency key must be' in response.data
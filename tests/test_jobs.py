@@ -0,0 +1,154 @@
+import time
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+import open_trs.db
+import open_trs.jobs
+from tests.conftest import AuthActions
+
+_ran_jobs = []
+
+
+@open_trs.jobs.handler('test_record')
+def _record_job(payload: dict, report_progress) -> dict:
+    report_progress(0.5)
+    _ran_jobs.append(payload['name'])
+
+    return {'name': payload['name']}
+
+
+@open_trs.jobs.handler('test_fail')
+def _fail_job(payload: dict, report_progress):
+    raise RuntimeError('Job failed')
+
+
+@open_trs.jobs.handler('test_limited', concurrency=1)
+def _limited_job(payload: dict, report_progress):
+    _ran_jobs.append(payload['name'])
+
+
+@pytest.fixture
+def queue(app: Flask):
+    """
+    Disables eager jobs so that tests control when queued jobs run.
+    """
+
+    app.config['JOBS_EAGER'] = False
+    _ran_jobs.clear()
+
+
+def test_enqueue_eager(client: FlaskClient, auth: AuthActions, app: Flask):
+    token = auth.login()
+
+    with app.app_context():
+        job_id = open_trs.jobs.enqueue('test_record', {'name': 'eager'}, user_id=1)
+
+    response = client.get(
+        f'/jobs/{job_id}',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'})
+
+    assert response.status_code == 200
+
+    job = response.get_json()['job']
+    assert (job['status'], job['progress'], job['attempts'], job['result']) == (
+        'succeeded', 1, 1, {'name': 'eager'})
+
+
+def test_work_priority(app: Flask, queue):
+    with app.app_context():
+        open_trs.jobs.enqueue('test_record', {'name': 'low'}, priority=-1)
+        open_trs.jobs.enqueue('test_record', {'name': 'first'})
+        open_trs.jobs.enqueue('test_record', {'name': 'high'}, priority=1)
+        open_trs.jobs.enqueue('test_record', {'name': 'second'})
+        open_trs.jobs.enqueue('test_record', {'name': 'delayed'}, delay=60)
+
+        assert open_trs.jobs.work('test', burst=True) == 4
+
+    assert _ran_jobs == ['high', 'first', 'second', 'low']
+
+
+def test_work_retry_backoff(app: Flask, queue):
+    app.config['JOBS_RETRY_BACKOFF'] = 60
+
+    with app.app_context():
+        job_id = open_trs.jobs.enqueue('test_fail', {})
+        open_trs.jobs.work('test', burst=True)
+        job = open_trs.jobs.get_job(job_id)
+
+        assert (job['status'], job['attempts']) == ('queued', 1)
+        assert job['run_after'] >= int(time.time()) + 59
+        assert 'Job failed' in job['error']
+
+        # Without a backoff the remaining attempts run right away
+        db = open_trs.db.get_db()
+        db.execute('UPDATE Jobs SET run_after = 0 WHERE id = ?', (job_id,))
+        db.commit()
+        app.config['JOBS_RETRY_BACKOFF'] = 0
+        open_trs.jobs.work('test', burst=True)
+        job = open_trs.jobs.get_job(job_id)
+
+        assert (job['status'], job['attempts']) == ('failed', 3)
+
+
+def test_work_concurrency_limit(app: Flask, queue):
+    with app.app_context():
+        running_id = open_trs.jobs.enqueue('test_limited', {'name': 'running'})
+        open_trs.jobs.enqueue('test_limited', {'name': 'limited'})
+        open_trs.jobs.enqueue('test_record', {'name': 'unlimited'})
+
+        assert open_trs.jobs.claim_job('other')['id'] == running_id
+        assert open_trs.jobs.work('test', burst=True) == 1
+        assert _ran_jobs == ['unlimited']
+
+        app.config['JOBS_CONCURRENCY'] = {'test_limited': 2}
+
+        assert open_trs.jobs.work('test', burst=True) == 1
+        assert _ran_jobs == ['unlimited', 'limited']
+
+
+def test_work_expired_lease(app: Flask, queue):
+    with app.app_context():
+        job_id = open_trs.jobs.enqueue('test_record', {'name': 'abandoned'})
+        open_trs.jobs.claim_job('crashed')
+
+        assert open_trs.jobs.work('test', burst=True) == 0
+
+        db = open_trs.db.get_db()
+        db.execute('UPDATE Jobs SET lease_expires = 0 WHERE id = ?', (job_id,))
+        db.commit()
+
+        assert open_trs.jobs.work('test', burst=True) == 1
+
+        job = open_trs.jobs.get_job(job_id)
+        assert (job['status'], job['attempts'], job['worker']) == ('succeeded', 2, 'test')
+
+
+def test_worker_command(app: Flask, queue):
+    with app.app_context():
+        open_trs.jobs.enqueue('test_record', {'name': 'command'})
+        result = app.test_cli_runner().invoke(args=['worker', '--burst', '--name', 'cli'])
+
+    assert 'Ran 1 jobs.' in result.output
+    assert _ran_jobs == ['command']
+
+
+@pytest.mark.parametrize(('user_id', 'job_id', 'message', 'status'), (
+    (1, 42, b'Job 42 does not exist', 404),
+    (2, 1, b'Forbidden', 403),
+    (None, 1, b'Forbidden', 403),
+))
+def test_get_job_validate_input(client: FlaskClient, auth: AuthActions, app: Flask, user_id,
+                                job_id, message, status):
+    token = auth.login()
+
+    with app.app_context():
+        open_trs.jobs.enqueue('test_record', {'name': 'other'}, user_id=user_id)
+
+    response = client.get(
+        f'/jobs/{job_id}',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'})
+
+    assert response.status_code == status
+    assert message in response.data
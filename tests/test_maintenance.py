@@ -0,0 +1,98 @@
+import sqlite3
+
+import pytest
+from flask import Flask
+
+import open_trs.db
+import open_trs.jobs
+import open_trs.maintenance
+
+
+def _fill_and_delete(db: sqlite3.Connection):
+    db.executemany('INSERT INTO Charges (project, user, hours, date_charged) VALUES (1, 1, 1, ?)',
+                   [(day,) for day in range(5000)])
+    db.commit()
+    db.execute('DELETE FROM Charges')
+    db.commit()
+
+
+def test_maintain_incremental_vacuum(file_app: Flask):
+    file_app.config['MAINTENANCE_VACUUM_PAGES'] = 2
+
+    with file_app.app_context():
+        db = open_trs.db.get_db()
+        assert db.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+        _fill_and_delete(db)
+        page_size = db.execute('PRAGMA page_size').fetchone()[0]
+        free_bytes = db.execute('PRAGMA freelist_count').fetchone()[0] * page_size
+
+        stats = open_trs.maintenance.maintain(db)
+
+        assert stats['bytes_reclaimed'] == 2 * page_size
+        assert stats['free_bytes'] < free_bytes - page_size
+        assert stats['free_bytes'] == db.execute('PRAGMA freelist_count').fetchone()[0] * page_size
+        assert db.execute("SELECT name FROM sqlite_master WHERE name = 'sqlite_stat1'"
+                          ).fetchone() is not None
+
+
+@pytest.mark.parametrize('file_app', [{'init_db': False}], indirect=True)
+def test_maintain_command_full(file_app: Flask):
+    # Databases that had tables before incremental vacuuming was enabled keep auto_vacuum off
+    legacy_db = sqlite3.connect(file_app.config['DATABASE'])
+    legacy_db.execute('CREATE TABLE Legacy (id INTEGER)')
+    legacy_db.close()
+
+    with file_app.app_context():
+        open_trs.db.init_db()
+        db = open_trs.db.get_db()
+        _fill_and_delete(db)
+
+        assert db.execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+
+        result = file_app.test_cli_runner().invoke(args=['maintain', '--full'])
+
+        assert 'Maintenance took' in result.output
+        assert ', 0 bytes still free.' in result.output
+        assert db.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+
+
+def test_maintain_schedule(file_app: Flask):
+    with file_app.app_context():
+        result = file_app.test_cli_runner().invoke(args=['maintain', '--schedule'])
+        assert 'Queued maintenance job 1.' in result.output
+
+        assert open_trs.jobs.get_job(1)['status'] == 'succeeded'
+        assert open_trs.jobs.get_job(2)['run_after'] >= open_trs.jobs.get_job(1)['created'] + 3600
+
+        result = file_app.test_cli_runner().invoke(args=['maintain', '--schedule'])
+        assert 'A maintenance job is already scheduled.' in result.output
+        assert open_trs.jobs.get_job(3) is None
+
+
+def test_maintain_schedule_failure(file_app: Flask, monkeypatch: pytest.MonkeyPatch):
+    file_app.config['JOBS_MAX_ATTEMPTS'] = 1
+
+    def fail():
+        raise RuntimeError('Database is locked')
+
+    monkeypatch.setattr(open_trs.maintenance, 'maintain_all', fail)
+
+    with file_app.app_context():
+        file_app.test_cli_runner().invoke(args=['maintain', '--schedule'])
+
+        # The schedule outlives a run that used up its attempts
+        assert open_trs.jobs.get_job(1)['status'] == 'failed'
+        assert open_trs.jobs.get_job(2)['status'] == 'queued'
+
+
+@pytest.mark.parametrize('enabled, expected', ((True, 1), (False, 0)))
+def test_optimize_on_close(app: Flask, monkeypatch: pytest.MonkeyPatch, enabled, expected):
+    calls = []
+    monkeypatch.setattr(open_trs.maintenance, 'optimize', calls.append)
+    app.config['MAINTENANCE_OPTIMIZE_ON_CLOSE'] = enabled
+
+    with app.app_context():
+        open_trs.db.get_db()
+
+    assert len(calls) == expected
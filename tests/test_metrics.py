@@ -0,0 +1,62 @@
+import pytest
+from flask import Flask
+
+import open_trs.db
+import open_trs.metrics
+from tests.conftest import AuthActions
+
+
+@pytest.fixture
+def deadline_app(file_app: Flask) -> Flask:
+    """
+    Adds enough charges to a file-backed app, where every request opens its own connection, for a
+    listing to take many SQLite instructions.
+    """
+
+    with file_app.app_context():
+        client = file_app.test_client()
+        client.post('/auth/register',
+                    json={'username': 'test', 'email': 'test@test.com', 'password': 'test'})
+
+        db = open_trs.db.get_db()
+        db.execute("INSERT INTO Projects (owner, name, category) VALUES (1, 'Slow', 0)")
+        db.executemany('INSERT INTO Charges (project, user, hours, date_charged)'
+                       ' VALUES (1, 1, 1, ?)', [(day,) for day in range(5000)])
+        db.commit()
+
+    return file_app
+
+
+def _aborted_count(endpoint: str) -> int:
+    return open_trs.metrics.get_counters().get(
+        ('queries_aborted', (('endpoint', endpoint),)), 0)
+
+
+def test_deadline_exceeded(deadline_app: Flask):
+    deadline_app.config.update(REQUEST_DEADLINES={'charges.get_charges': 0},
+                               METRICS_ENABLED=True)
+    client = deadline_app.test_client()
+    headers = {'Authorization': f'Bearer {AuthActions(client).login()}'}
+    aborted = _aborted_count('charges.get_charges')
+
+    response = client.get('/charges/', headers=headers, json={})
+
+    assert response.status_code == 503
+    assert b'took too long' in response.data
+    assert _aborted_count('charges.get_charges') == aborted + 1
+
+    metrics = client.get('/metrics').get_data(as_text=True)
+    assert (f'open_trs_queries_aborted_total{{endpoint="charges.get_charges"}} {aborted + 1}'
+            in metrics)
+
+    # Endpoints without a deadline are never aborted
+    deadline_app.config['REQUEST_DEADLINES'] = {'charges.get_charges': None}
+    response = client.get('/charges/', headers=headers, json={})
+
+    assert response.status_code == 200
+    assert len(response.get_json()['charges']) == 5000
+
+
+def test_metrics_disabled(app: Flask):
+    # Disabled by default, since anyone could read the counters
+    assert app.test_client().get('/metrics').status_code == 404
@@ -0,0 +1,164 @@
+import datetime
+import os
+
+import pytest
+from flask import Flask
+
+import open_trs.db
+import open_trs.partitions
+from tests.conftest import AuthActions, _data_sql
+
+
+pytestmark = pytest.mark.parametrize('file_app', [{'PARTITIONS_DIR': '{tmp_path}/partitions'}],
+                                     indirect=True)
+
+
+@pytest.fixture
+def archived_app(file_app: Flask) -> Flask:
+    """
+    Creates an app backed by a file with the test data, whose charges of 2024 are archived.
+    """
+
+    file_app.config['PARTITIONS_HOT_YEARS'] = datetime.date.today().year - 2024
+
+    with file_app.app_context():
+        open_trs.db.get_db().executescript(_data_sql)
+
+        assert open_trs.partitions.archive() == [('main', 2024, 4)]
+
+    return file_app
+
+
+def _headers(app: Flask) -> dict:
+    return {'Content-Type': 'application/json',
+            'Authorization': f'Bearer {AuthActions(app.test_client()).login()}'}
+
+
+def test_archive_command(file_app: Flask, tmp_path):
+    with file_app.app_context():
+        db = open_trs.db.get_db()
+        db.executescript(_data_sql)
+        runner = file_app.test_cli_runner()
+
+        result = runner.invoke(args=['archive-charges', '--year', str(datetime.date.today().year)])
+        assert 'Only years before' in result.output
+
+        result = runner.invoke(args=['archive-charges', '--year', '2024'])
+        assert 'Archived 4 charges of 2024 from main.' in result.output
+
+        assert db.execute('SELECT COUNT(*) FROM Charges').fetchone()[0] == 0
+        assert dict(db.execute('SELECT year, path, charges FROM Partitions').fetchone()) == {
+            'year': 2024, 'path': os.path.join('main', 'charges-2024.sqlite'), 'charges': 4}
+        assert os.path.exists(tmp_path / 'partitions' / 'main' / 'charges-2024.sqlite')
+
+        # Years without charges are not archived
+        result = runner.invoke(args=['archive-charges', '--year', '2023'])
+        assert 'Archived 0 partitions.' in result.output
+
+
+def test_read_archived_charges(archived_app: Flask):
+    client = archived_app.test_client()
+    headers = _headers(archived_app)
+
+    response = client.get('/charges/', headers=headers,
+                          json={'date_range': {'start': '2024-02-01', 'end': '2024-02-06'}})
+    assert [charge['hours'] for charge in response.get_json()['charges']] == [5, 3]
+
+    # Ranges reaching into the hot table read both
+    this_year = datetime.date.today().year
+    client.post('/charges/create', headers=headers, json={
+        'charges': [{'hours': 1, 'project': 1, 'date_charged': f'{this_year}-01-01'}]})
+    response = client.get('/charges/', headers=headers, json={})
+    assert [charge['hours'] for charge in response.get_json()['charges']] == [5, 3, 8, 1]
+
+    response = client.get('/charges/summary', headers=headers,
+                          json={'group_by': 'year', 'period': {'year': 2024}})
+    assert response.get_json()['summary'] == [{'period': '2024', 'project': 1, 'hours': 8},
+                                              {'period': '2024', 'project': 2, 'hours': 8}]
+
+    response = client.get('/charges/timesheet', headers=headers,
+                          json={'period': {'month': '2024-02'}})
+    assert response.get_json()['project_totals'] == [8, 8]
+
+
+def test_write_archived_charges(archived_app: Flask):
+    client = archived_app.test_client()
+    headers = _headers(archived_app)
+
+    response = client.post('/charges/create', headers=headers, json={
+        'charges': [{'hours': 1, 'project': 1, 'date_charged': '2024-03-01'}]})
+    assert response.status_code == 400
+    assert b'Charges of 2024 are archived' in response.data
+
+    charge = client.post('/charges/create', headers=headers, json={
+        'charges': [{'hours': 1, 'project': 1, 'date_charged': '2025-01-01'}]}
+    ).get_json()['charges'][0]
+
+    response = client.put('/charges/update', headers=headers, json={
+        'charges': [{'id': charge['id'], 'date_charged': '2024-12-31'}]})
+    assert response.status_code == 400
+
+    response = client.put('/charges/bulk_update', headers=headers, json={
+        'filter': {'project': 1}, 'set': {'shift_days': -1}, 'dry_run': True})
+    assert response.status_code == 400
+    assert b'Charges of 2024 are archived' in response.data
+
+
+def test_purge_archived_charges(archived_app: Flask):
+    client = archived_app.test_client()
+    response = client.delete('/projects/1/delete', headers=_headers(archived_app))
+    assert response.status_code == 200
+
+    with archived_app.app_context():
+        db = open_trs.db.get_db()
+        open_trs.partitions.attach_partitions(db)
+
+        assert [row['project'] for row in db.execute(
+            'SELECT project FROM partition_2024.Charges ORDER BY id')] == [2, 3]
+        assert db.execute('SELECT charges FROM Partitions').fetchone()[0] == 2
+        assert db.execute('SELECT deleted_charges FROM Purges').fetchone()[0] == 2
+
+
+def test_read_many_archived_years(file_app: Flask):
+    years = range(2010, 2022)
+    file_app.config['PARTITIONS_HOT_YEARS'] = datetime.date.today().year - years[-1]
+
+    with file_app.app_context():
+        db = open_trs.db.get_db()
+        db.executescript(_data_sql)
+        db.executemany('INSERT INTO Charges (project, user, hours, date_charged)'
+                       ' VALUES (1, 1, 1, ?)',
+                       [(open_trs.db.date_to_day(datetime.date(year, 6, 1)),) for year in years])
+        db.commit()
+
+        assert len(open_trs.partitions.archive()) == len(years)
+
+    client = file_app.test_client()
+    headers = _headers(file_app)
+
+    # Reads without a range see every archived year, more than can be attached at once
+    response = client.get('/charges/', headers=headers, json={})
+    assert [charge['date_charged'] for charge in response.get_json()['charges']][:len(years)] == [
+        f'{year}-06-01' for year in years]
+
+    response = client.get('/charges/summary', headers=headers, json={'group_by': 'year'})
+    assert response.status_code == 200
+    assert [row['period'] for row in response.get_json()['summary']][:len(years)] == [
+        str(year) for year in years]
+
+    response = client.get('/charges/stats', headers=headers, json={})
+    assert response.status_code == 200
+    assert response.get_json()['stats'][0]['hours'] == len(years) + 16
+
+    # Ranges sent by the client are still limited
+    response = client.get('/charges/', headers=headers, json={
+        'date_range': {'start': '2010-01-01', 'end': '2021-12-31'}})
+    assert response.status_code == 400
+    assert b'cannot span more than 10 archived years' in response.data
+
+    # Purges reach every archived year
+    assert client.delete('/projects/1/delete', headers=headers).status_code == 200
+
+    with file_app.app_context():
+        db = open_trs.db.get_db()
+        assert db.execute('SELECT SUM(charges) FROM Partitions').fetchone()[0] == 0
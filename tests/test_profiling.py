@@ -0,0 +1,72 @@
+import os
+import pstats
+import time
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+from tests.conftest import AuthActions
+
+
+def _slow_view():
+    time.sleep(0.1)
+
+    return 'done', 200
+
+
+@pytest.fixture
+def profiled_app(app: Flask, tmp_path) -> Flask:
+    """
+    Enables profiling into a temporary directory, with a slow view to sample.
+    """
+
+    app.config['PROFILING_TOKEN'] = 'profile-me'
+    app.config['PROFILING_DIR'] = str(tmp_path)
+    app.config['PROFILING_INTERVAL'] = 0.001
+    app.add_url_rule('/slow', 'slow', _slow_view)
+
+    return app
+
+
+def test_profile_requested(profiled_app: Flask, client: FlaskClient, auth: AuthActions):
+    headers = {'Authorization': f'Bearer {auth.login()}', 'X-Profile': 'profile-me'}
+
+    response = client.get('/projects/', headers=headers)
+    assert response.status_code == 200
+
+    path = os.path.join(profiled_app.config['PROFILING_DIR'], response.headers['X-Profile-Id'])
+    functions = {name for _, _, name in pstats.Stats(f'{path}.pstats').stats}
+    assert 'get_projects' in functions
+
+    with open(f'{path}.allocations.txt') as file:
+        assert 'size=' in file.read()
+
+
+def test_profile_sampled(profiled_app: Flask, client: FlaskClient):
+    profiled_app.config['PROFILING_SAMPLE_RATE'] = 1
+
+    response = client.get('/slow')
+
+    path = os.path.join(profiled_app.config['PROFILING_DIR'], response.headers['X-Profile-Id'])
+
+    with open(f'{path}.collapsed') as file:
+        stacks = file.read().splitlines()
+
+    assert stacks
+    assert all(stack.rsplit(' ', 1)[1].isdigit() for stack in stacks)
+    assert any(stack.split(' ')[0].endswith('test_profiling:_slow_view') for stack in stacks)
+
+
+def test_profile_not_requested(profiled_app: Flask, client: FlaskClient):
+    profiled_app.config['PROFILING_KEEP'] = 1
+
+    assert 'X-Profile-Id' not in client.get('/slow').headers
+    assert 'X-Profile-Id' not in client.get('/slow', headers={'X-Profile': 'wrong'}).headers
+
+    profiled_app.config['PROFILING_SAMPLE_RATE'] = 1
+
+    for _ in range(2):
+        client.get('/slow')
+
+    assert len(os.listdir(profiled_app.config['PROFILING_DIR'])) == 1
@@ -216,3 +216,135 @@ def test_delete_project_validate_input(
 
     assert response.status_code == status
     assert message in response.data
+
+
+def test_bulk_projects(client: FlaskClient, auth: AuthActions, app: Flask):
+    token = auth.login()
+
+    # The deleted project's name is reused, and the updated project swaps into a created name
+    response = client.post(
+        '/projects/bulk',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json={'create': [{'name': 'Existing Project', 'category': 1},
+                         {'name': 'The Other Existing Project', 'description': 'Recreated'}],
+              'update': [{'id': 2, 'name': 'Renamed Project'}],
+              'delete': [1]})
+
+    assert response.status_code == 200
+
+    response_json = response.get_json()
+    assert [project['name'] for project in response_json['created']] == [
+        'Existing Project', 'The Other Existing Project']
+    assert [project['name'] for project in response_json['updated']] == ['Renamed Project']
+    assert response_json['deleted'] == [1]
+
+    with app.app_context():
+        db = open_trs.db.get_db()
+        projects = db.execute('SELECT id, name, category FROM Projects WHERE owner = ? ORDER BY id',
+                              (1,)).fetchall()
+
+        assert [tuple(project) for project in projects] == [
+            (2, 'Renamed Project', 0), (4, 'Existing Project', 1),
+            (5, 'The Other Existing Project', 0)]
+        assert db.execute('SELECT * FROM Charges WHERE project = ?', (1,)).fetchall() == []
+
+
+@pytest.mark.parametrize(('body', 'message', 'status'), (
+    ({}, b'No operations provided', 400),
+    ({'create': [{'name': ''}]}, b'Project name is required', 400),
+    ({'create': [{'name': 'Existing Project'}]}, b'already exists', 400),
+    ({'create': [{'name': 'new_project'}, {'name': 'new_project'}]}, b'used more than once', 400),
+    ({'update': [{'id': 1}]}, b'Nothing to update for project 1', 400),
+    ({'update': [{'id': 1, 'name': 'The Other Existing Project'}]}, b'already exists', 400),
+    ({'update': [{'id': 1, 'name': 'new_project'}], 'delete': [1]}, b'both updated and deleted',
+     400),
+    ({'delete': [1, 42]}, b'Project 42 does not exist', 404),
+    ({'delete': [3]}, b'Forbidden', 403),
+    ({'delete': [[1]]}, b'Project ID required', 400),
+    ({'delete': 5}, b'must be lists', 400),
+    ({'create': 'x'}, b'must be lists', 400),
+    ({'create': ['x']}, b'Invalid project, use an object', 400),
+    ({'update': [1]}, b'Invalid project, use an object', 400),
+    ({'create': [{'name': 'new_project', 'description': ['x']}]}, b'Invalid description', 400),
+))
+def test_bulk_projects_validate_input(client: FlaskClient, auth: AuthActions, app: Flask, body,
+                                      message, status):
+    token = auth.login()
+
+    response = client.post(
+        '/projects/bulk',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'},
+        json=body)
+
+    assert response.status_code == status
+    assert message in response.data
+
+    with app.app_context():
+        db = open_trs.db.get_db()
+
+        assert db.execute('SELECT COUNT(*) FROM Projects').fetchone()[0] == 3
+
+
+def test_delete_project_purge(client: FlaskClient, auth: AuthActions, app: Flask):
+    token = auth.login()
+    app.config['PURGE_CHUNK_SIZE'] = 1
+    app.config['PURGE_PAUSE'] = 0
+
+    response = client.delete(
+        '/projects/1/delete',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'})
+
+    assert response.status_code == 200
+    assert response.get_json()['purge']['status'] == 'done'
+
+    response = client.get(
+        '/projects/1/purge',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'})
+
+    assert response.status_code == 200
+    assert response.get_json()['purge']['deleted_charges'] == 2
+
+
+def test_delete_project_hidden_until_purged(client: FlaskClient, auth: AuthActions, app: Flask):
+    token = auth.login()
+    headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'}
+    app.config['JOBS_EAGER'] = False
+
+    response = client.delete('/projects/1/delete', headers=headers)
+    assert response.get_json()['purge']['status'] == 'pending'
+
+    assert client.get('/projects/1', headers=headers).status_code == 404
+    assert client.delete('/projects/1/delete', headers=headers).status_code == 404
+
+    charges = client.get('/charges/', headers=headers, json={}).get_json()['charges']
+    assert [charge['id'] for charge in charges] == [3]
+
+    with app.app_context():
+        result = app.test_cli_runner().invoke(args=['worker', '--burst'])
+
+    assert 'Ran 1 jobs.' in result.output
+
+    job = client.get(f'/jobs/{response.get_json()["job"]}', headers=headers).get_json()['job']
+    assert (job['status'], job['result']) == ('succeeded', {'deleted_charges': 2})
+
+    with app.app_context():
+        db = open_trs.db.get_db()
+
+        assert db.execute('SELECT * FROM Projects WHERE id = ?', (1,)).fetchone() is None
+        assert db.execute('SELECT * FROM Charges WHERE project = ?', (1,)).fetchall() == []
+
+
+@pytest.mark.parametrize(('project_id', 'message', 'status'), (
+    (1, b'Project 1 has not been deleted', 404),
+    (42, b'Project 42 has not been deleted', 404),
+))
+def test_get_purge_validate_input(client: FlaskClient, auth: AuthActions, project_id, message,
+                                  status):
+    token = auth.login()
+
+    response = client.get(
+        f'/projects/{project_id}/purge',
+        headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'})
+
+    assert response.status_code == status
+    assert message in response.data
@@ -0,0 +1,82 @@
+import time
+
+import pytest
+from flask import Flask
+from flask.testing import FlaskClient
+
+import open_trs
+import open_trs.ratelimit
+from tests.conftest import AuthActions
+
+
+@pytest.fixture
+def limited_app(app: Flask, tmp_path) -> Flask:
+    """
+    Enables rate limiting with a fresh store and small buckets.
+    """
+
+    app.config['RATELIMIT_ENABLED'] = True
+    app.config['RATELIMIT_STORAGE'] = str(tmp_path / 'ratelimit.sqlite')
+    app.config['RATELIMIT_LIMITS'] = {'default': (1, 2), 'auth.login': (0.5, 3)}
+
+    return app
+
+
+def test_limit_login_by_ip(limited_app: Flask, client: FlaskClient, auth: AuthActions):
+    for _ in range(3):
+        assert auth.login() is not None
+
+    response = client.post('/auth/login', json={'username': 'test', 'password': 'test'})
+
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '2'
+    assert b'Too many requests' in response.data
+
+    # Other addresses have buckets of their own
+    response = client.post('/auth/login', json={'username': 'test', 'password': 'test'},
+                           environ_base={'REMOTE_ADDR': '10.0.0.2'})
+    assert response.status_code == 200
+
+
+def test_limit_by_user(limited_app: Flask, client: FlaskClient, auth: AuthActions,
+                       monkeypatch):
+    headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {auth.login()}'}
+    now = time.time()
+    monkeypatch.setattr(open_trs.ratelimit.time, 'time', lambda: now)
+
+    # Routes without limits of their own share the default bucket
+    assert client.get('/projects/', headers=headers).status_code == 200
+    assert client.get('/charges/', headers=headers, json={}).status_code == 200
+
+    response = client.get('/projects/', headers=headers)
+    assert response.status_code == 429
+    assert response.headers['Retry-After'] == '1'
+
+    # Buckets refill at their rate
+    monkeypatch.setattr(open_trs.ratelimit.time, 'time', lambda: now + 1)
+    assert client.get('/projects/', headers=headers).status_code == 200
+    assert client.get('/projects/', headers=headers).status_code == 429
+
+
+def test_limit_disabled(app: Flask, client: FlaskClient, auth: AuthActions):
+    app.config['RATELIMIT_LIMITS'] = {'default': (1, 1)}
+
+    assert auth.login() is not None
+    assert auth.login() is not None
+
+
+def test_limit_blocked(limited_app: Flask, client: FlaskClient, auth: AuthActions):
+    limited_app.config['RATELIMIT_LIMITS']['projects.get_projects'] = (0, 0)
+    headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {auth.login()}'}
+
+    response = client.get('/projects/', headers=headers)
+    assert response.status_code == 429
+    assert 'Retry-After' not in response.headers
+
+    # Other routes are still counted, and a zero rate does not break cleaning up idle buckets
+    assert client.get('/charges/', headers=headers, json={}).status_code == 200
+
+
+def test_limit_invalid():
+    with pytest.raises(ValueError, match='a rate of 0 needs a burst of 0'):
+        open_trs.create_app(testing=True, config={'RATELIMIT_LIMITS': {'default': (0, 5)}})
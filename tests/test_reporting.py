@@ -0,0 +1,76 @@
+import pytest
+from flask import Flask
+
+import open_trs.jobs
+import open_trs.reporting
+
+
+def _charge(client, headers: dict, project_id: int, date_charged: str):
+    client.post('/charges/create', headers=headers, json={
+        'charges': [{'hours': 1, 'project': project_id, 'date_charged': date_charged}]})
+
+
+@pytest.mark.parametrize('file_app', [{
+    'REPORTING_SNAPSHOT': True, 'REPORTING_DIR': '{tmp_path}/reporting'}], indirect=True)
+def test_reporting_snapshot(file_app: Flask):
+    client = file_app.test_client()
+    credentials = {'username': 'report', 'email': 'report@test.com', 'password': 'report'}
+    client.post('/auth/register', json=credentials)
+    token = client.post('/auth/login', json=credentials).get_json()['token']
+    headers = {'Authorization': f'Bearer {token}'}
+
+    project = client.post('/projects/create', headers=headers,
+                          json={'name': 'Reported', 'category': 0}).get_json()['project']
+    _charge(client, headers, project['id'], '2024-02-01')
+
+    # Without a snapshot, reports are read live
+    summary = client.get('/charges/summary', headers=headers, json={}).get_json()
+    assert summary['as_of'] is None
+    assert summary['summary'] == [{'period': '2024-02', 'project': project['id'], 'hours': 1}]
+
+    with file_app.app_context():
+        result = file_app.test_cli_runner().invoke(args=['refresh-reporting'])
+
+    assert 'Refreshed main:' in result.output
+
+    _charge(client, headers, project['id'], '2024-02-02')
+
+    date_range = {'date_range': {'start': '2024-02-01', 'end': '2024-02-02'}}
+    timesheet = client.get('/charges/timesheet', headers=headers, json=date_range).get_json()
+    assert timesheet['as_of'] is not None
+    assert timesheet['hours'] == [[1, 0]]
+
+    # Years missing from the snapshot's calendar are summarized live
+    summary = client.get('/charges/summary', headers=headers,
+                         json={'date_range': {'start': '2023-01-01', 'end': '2024-12-31'}}
+                         ).get_json()
+    assert summary['as_of'] is None
+    assert summary['summary'] == [{'period': '2024-02', 'project': project['id'], 'hours': 2}]
+
+    with file_app.app_context():
+        open_trs.jobs.enqueue('refresh_reporting', {})
+
+    timesheet = client.get('/charges/timesheet', headers=headers, json=date_range).get_json()
+    assert timesheet['hours'] == [[1, 1]]
+
+
+@pytest.mark.parametrize('file_app', [{
+    'REPORTING_DIR': '{tmp_path}/reporting', 'JOBS_MAX_ATTEMPTS': 1}], indirect=True)
+def test_reporting_schedule(file_app: Flask, monkeypatch: pytest.MonkeyPatch):
+    def fail():
+        raise RuntimeError('Disk full')
+
+    monkeypatch.setattr(open_trs.reporting, 'refresh', fail)
+
+    with file_app.app_context():
+        runner = file_app.test_cli_runner()
+        result = runner.invoke(args=['refresh-reporting', '--schedule'])
+        assert 'Queued refresh job 1.' in result.output
+
+        # A failed refresh still queues the next one, and scheduling again adds no other chain
+        assert open_trs.jobs.get_job(1)['status'] == 'failed'
+        assert open_trs.jobs.get_job(2)['status'] == 'queued'
+
+        result = runner.invoke(args=['refresh-reporting', '--schedule'])
+        assert 'A refresh job is already scheduled.' in result.output
+        assert open_trs.jobs.get_job(3) is None
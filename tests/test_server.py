@@ -0,0 +1,61 @@
+import pytest
+from flask import Flask
+
+import open_trs.server
+import open_trs.warmup
+
+
+def test_get_options(app: Flask):
+    options = open_trs.server.get_options(app, cpu_count=4)
+
+    assert options['workers'] == 9
+    assert options['worker_class'] == 'gthread'
+    assert options['threads'] == app.config['SERVER_THREADS']
+    assert options['preload_app']
+    assert app.config['DATABASE_POOL_SIZE'] == app.config['SERVER_THREADS']
+
+    # Connections are shared out between workers, but every worker gets at least one
+    app.config.update(SERVER_WORKERS=3, DATABASE_MAX_CONNECTIONS=12)
+    options = open_trs.server.get_options(app, cpu_count=4)
+
+    assert options['workers'] == 3
+    assert app.config['DATABASE_POOL_SIZE'] == 4
+
+    app.config['DATABASE_MAX_CONNECTIONS'] = 2
+    open_trs.server.get_options(app)
+
+    assert app.config['DATABASE_POOL_SIZE'] == 1
+
+
+def test_main_print_options(monkeypatch: pytest.MonkeyPatch, tmp_path, capsys):
+    monkeypatch.setenv('FLASK_ENV', 'production')
+    monkeypatch.setenv('OPEN_TRS_DATABASE', str(tmp_path / 'open_trs.sqlite'))
+    monkeypatch.setenv('OPEN_TRS_WARMUP', 'false')
+
+    with pytest.raises(SystemExit, match='SECRET_KEY is not set'):
+        open_trs.server.main(['--print-options'])
+
+    monkeypatch.setenv('OPEN_TRS_SECRET_KEY', 'secret')
+    open_trs.server.main(['--print-options', '--workers', '2', '--threads', '3',
+                          '--bind', '127.0.0.1:9000'])
+
+    output = capsys.readouterr().out
+    assert "bind = '127.0.0.1:9000'" in output
+    assert 'workers = 2' in output
+    assert 'threads = 3' in output
+    assert 'database_pool_size = 3' in output
+
+
+def test_main_without_secret_key(monkeypatch: pytest.MonkeyPatch, tmp_path):
+    monkeypatch.setenv('FLASK_ENV', 'production')
+    monkeypatch.setenv('OPEN_TRS_DATABASE', str(tmp_path / 'open_trs.sqlite'))
+    monkeypatch.delenv('OPEN_TRS_SECRET_KEY', raising=False)
+    warmed_up = []
+    monkeypatch.setattr(open_trs.warmup, 'warm_up', warmed_up.append)
+
+    with pytest.raises(SystemExit, match='SECRET_KEY is not set'):
+        open_trs.server.main([])
+
+    # No database was opened for a server that cannot start
+    assert warmed_up == []
+    assert not (tmp_path / 'open_trs.sqlite').exists()